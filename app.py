@@ -1,15 +1,35 @@
 # app.py
+import time
+_import_started = time.perf_counter()
+
 import os
 import json
+import gzip
 import hmac
 import hashlib
 import asyncio
 import aiohttp
 from aiohttp import web
-from pathlib import Path
 from datetime import datetime, timezone
 from dotenv import load_dotenv
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
+
+from services import cluster, http_client, metrics, profiling, shedding, subscriptions, user_query
+from services.broadcast import broadcaster_for
+from services.cache import TTLCache
+from services.cluster import LeaderElection
+from services.expiry import ExpiryScheduler, PermanentEventError
+from services.games import GameSlip
+from services.jobs import JobQueue, PermanentJobError
+from services.membership import MembershipSweeper
+from services.middleware import aiogram_timing, timing_middleware
+from services.notify import AdminDigest
+from services.polling import UpdatePoller
+from services.publisher import SlipPublisher, parse_games, parse_plans, parse_send_at
+from services.reconcile import PaystackReconciler, parse_ts, to_iso
+from services.shedding import ConcurrencyLimiter, KeyedBuckets, UnknownReferences, shedding_middleware
+from services.updates import UpdateExecutor
+from services.storage import DATA_DIR, get_backend
 
 load_dotenv()
 
@@ -19,6 +39,7 @@ load_dotenv()
 PORT = int(os.getenv("PORT", 10000))
 PAYSTACK_WEBHOOK_SECRET = os.getenv("PAYSTACK_WEBHOOK_SECRET", "")
 PAYSTACK_SECRET_KEY = os.getenv("PAYSTACK_SECRET_KEY", "")
+PAYSTACK_API_BASE = os.getenv("PAYSTACK_API_BASE", "https://api.paystack.co").rstrip("/")
 ACCESS_BOT_TOKEN = os.getenv("ACCESS_BOT_TOKEN")           # Access verification bot
 RESULTS_BOT_TOKEN = os.getenv("RESULTS_BOT_TOKEN")         # Results posting bot
 ADMIN_TELEGRAM_IDS = [int(x) for x in (os.getenv("ADMIN_TELEGRAM_IDS","").split(",") if os.getenv("ADMIN_TELEGRAM_IDS") else [])]
@@ -28,63 +49,96 @@ DAILY_GROUP_LINK = os.getenv("DAILY_GROUP_LINK", "")
 WEEKEND_GROUP_LINK = os.getenv("WEEKEND_GROUP_LINK", "")
 ACCESS_BOT_USERNAME = os.getenv("ACCESS_BOT_USERNAME", "StakeAwareAccessBot")
 JWT_SECRET = os.getenv("BACKEND_ADMIN_KEY", os.getenv("JWT_SECRET", ""))
-DAILY_PLAN_AMOUNT = int(os.getenv("DAILY_PLAN_AMOUNT", "50000"))
-DAILY_PLAN_DURATION = int(os.getenv("DAILY_PLAN_DURATION", "30"))
-WEEKEND_PLAN_DURATION = int(os.getenv("WEEKEND_PLAN_DURATION", "30"))
 EXPIRY_ALERT_DAYS = int(os.getenv("EXPIRY_ALERT_DAYS", "3"))
 SELF_PING_INTERVAL = int(os.getenv("SELF_PING_INTERVAL", "600"))  # seconds
-
-# file storage
-DATA_DIR = Path("data")
-DATA_DIR.mkdir(exist_ok=True)
-USERS_FILE = DATA_DIR / "users.json"
-GAMES_FILE = DATA_DIR / "games.json"
+RECONCILE_INTERVAL = int(os.getenv("RECONCILE_INTERVAL", "3600"))  # seconds; 0 turns the background run off
+PROCESSED_REF_TTL = int(os.getenv("PROCESSED_REF_TTL", str(7 * 24 * 3600)))  # Paystack retries for up to 72h
+PROCESSED_REF_MAX = int(os.getenv("PROCESSED_REF_MAX", "100000"))
+VERIFY_CACHE_TTL = int(os.getenv("VERIFY_CACHE_TTL", "3600"))
+VERIFY_CACHE_MAX = int(os.getenv("VERIFY_CACHE_MAX", "10000"))
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "1000"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_BACKOFF_BASE = float(os.getenv("JOB_BACKOFF_BASE", "1.0"))  # seconds, doubled per retry
+JOB_QUEUE_DURABLE = os.getenv("JOB_QUEUE_DURABLE", "0") == "1"
+JOB_DRAIN_TIMEOUT = float(os.getenv("JOB_DRAIN_TIMEOUT", "25"))
+ADMIN_DIGEST_WINDOW = float(os.getenv("ADMIN_DIGEST_WINDOW", "30"))  # seconds; 0 sends every event at once
+ADMIN_DIGEST_MAX = int(os.getenv("ADMIN_DIGEST_MAX", "50"))
+UPDATE_MAX_INFLIGHT = int(os.getenv("UPDATE_MAX_INFLIGHT", "64"))  # concurrent aiogram handlers per bot
+WEBHOOK_SET_TIMEOUT = float(os.getenv("WEBHOOK_SET_TIMEOUT", "10"))  # seconds per set_webhook attempt
+WEBHOOK_SET_ATTEMPTS = int(os.getenv("WEBHOOK_SET_ATTEMPTS", "5"))   # then keep retrying every WEBHOOK_RETRY_MAX
+WEBHOOK_RETRY_MAX = float(os.getenv("WEBHOOK_RETRY_MAX", "60"))
+READY_REQUIRES_WEBHOOKS = os.getenv("READY_REQUIRES_WEBHOOKS", "1") == "1"
+TELEGRAM_UPDATES = os.getenv("TELEGRAM_UPDATES", "auto")   # webhook | polling | auto (polling without PUBLIC_URL)
+ADMIN_URGENT_KINDS = [x.strip() for x in os.getenv("ADMIN_URGENT_KINDS", "").split(",") if x.strip()]
 
 # --------------------
-# Helpers: file store
+# Helpers: storage (STORAGE_BACKEND=json|sqlite, see services/storage.py)
 # --------------------
-def load_json(p: Path) -> Dict[str, Any]:
-    if not p.exists():
-        return {}
-    try:
-        return json.loads(p.read_text(encoding="utf-8"))
-    except Exception:
-        return {}
-
-def save_json(p: Path, obj: Any):
-    p.write_text(json.dumps(obj, indent=2, ensure_ascii=False), encoding="utf-8")
+backend = get_backend()
 
 # users structure: { email: { email, plan, paystack_reference, expires_at, active, chat_id } }
-def load_users():
-    return load_json(USERS_FILE)
-
-def save_users(u):
-    save_json(USERS_FILE, u)
+# resident store with email / reference / chat_id indexes; loaded in on_startup
+store = subscriptions.store
+ledger = subscriptions.ledger
 
 def load_games():
-    return load_json(GAMES_FILE).get("games", [])
+    return backend.load_games()
 
 def save_games(games):
-    save_json(GAMES_FILE, {"games": games})
+    global games_version
+    backend.save_games(games.to_json())
+    games_version = backend.games_version()
 
 # --------------------
 # Aiogram setup (webhook style)
 # --------------------
 from aiogram import Bot, Dispatcher, types
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
-# create bots
-access_bot = Bot(token=ACCESS_BOT_TOKEN)
-results_bot = Bot(token=RESULTS_BOT_TOKEN)
+# bots are built on first use, so a missing token doesn't stop the web app from starting
+_bots: Dict[str, Bot] = {}
+
+def _bot(name: str, token: Optional[str]) -> Bot:
+    bot = _bots.get(name)
+    if bot is None:
+        bot = _bots[name] = Bot(token=token, session=http_client.telegram_session())
+    return bot
+
+def access_bot() -> Bot:
+    return _bot("access", ACCESS_BOT_TOKEN)
+
+def results_bot() -> Bot:
+    return _bot("results", RESULTS_BOT_TOKEN)
 
 # dispatchers
 access_dp = Dispatcher()
 results_dp = Dispatcher()
 
+# handler latency per handler function
+for _name, _dp in (("access", access_dp), ("results", results_dp)):
+    _dp.message.middleware(aiogram_timing(_name))
+    _dp.callback_query.middleware(aiogram_timing(_name))
+
 # --------------------
 # Paystack verification & grant logic (keeps your original behavior)
 # --------------------
+# references already granted (survives restarts; workers merge their saves into one file)
+# and successful verify responses
+processed_refs = TTLCache(PROCESSED_REF_MAX, PROCESSED_REF_TTL, path=DATA_DIR / "processed_refs.json",
+                          shared=cluster.MULTI_WORKER)
+verified_cache = TTLCache(VERIFY_CACHE_MAX, VERIFY_CACHE_TTL)
+inflight_refs = set()
+
+# public endpoints: per-IP / per-chat budgets, a cap on concurrent handlers and
+# references recently looked up in vain (see services/shedding.py)
+http_limiter = ConcurrencyLimiter()
+ip_buckets = KeyedBuckets(shedding.IP_RATE, shedding.IP_BURST)
+link_buckets = KeyedBuckets(shedding.CHAT_LINK_RATE, shedding.CHAT_LINK_BURST)
+unknown_refs = UnknownReferences()
+store.observers.append(unknown_refs)
+
 def verify_paystack_signature(body_bytes: bytes, signature_header: Optional[str]) -> bool:
     if not PAYSTACK_WEBHOOK_SECRET:
         return True
@@ -96,61 +150,59 @@ def verify_paystack_signature(body_bytes: bytes, signature_header: Optional[str]
 async def verify_transaction_with_paystack(reference: str) -> Optional[Dict[str,Any]]:
     if not PAYSTACK_SECRET_KEY:
         return None
-    url = f"https://api.paystack.co/transaction/verify/{reference}"
+    cached = verified_cache.get(reference)
+    if cached is not None:
+        metrics.PAYSTACK_VERIFY_TOTAL.inc(outcome="cached")
+        return cached
+    url = f"{PAYSTACK_API_BASE}/transaction/verify/{reference}"
     headers = {"Authorization": f"Bearer {PAYSTACK_SECRET_KEY}"}
-    async with aiohttp.ClientSession() as s:
-        async with s.get(url, headers=headers, timeout=10) as r:
-            if r.status != 200:
-                return None
-            j = await r.json()
-            if j.get("status") and j.get("data", {}).get("status") == "success":
-                return j.get("data")
-            return None
-
-def grant_or_renew(email: str, plan: str, reference: str):
-    users = load_users()
-    now = int(datetime.now(tz=timezone.utc).timestamp())
-    duration_days = DAILY_PLAN_DURATION if plan == "daily" else WEEKEND_PLAN_DURATION
-    expires_at = now + duration_days * 24 * 3600
-
-    prev = users.get(email)
-    if prev and prev.get("expires_at", 0) > now:
-        new_expiry = max(prev["expires_at"], expires_at)
-        prev.update({
-            "plan": plan,
-            "paystack_reference": reference,
-            "expires_at": new_expiry,
-            "active": True
-        })
-        users[email] = prev
-        action = "renewed"
-    else:
-        users[email] = {
-            "email": email,
-            "plan": plan,
-            "paystack_reference": reference,
-            "expires_at": expires_at,
-            "active": True,
-            "chat_id": None
-        }
-        action = "activated"
-
-    save_users(users)
+    outcome = "error"
+    try:
+        with metrics.PAYSTACK_VERIFY_LATENCY.time():
+            async with http_client.get_session().get(url, headers=headers) as r:
+                if r.status != 200:
+                    outcome = f"http_{r.status}"
+                    return None
+                j = await r.json()
+        if j.get("status") and j.get("data", {}).get("status") == "success":
+            outcome = "success"
+            verified_cache.set(reference, j.get("data"))
+            return j.get("data")
+        outcome = "not_successful"
+        return None
+    finally:
+        metrics.PAYSTACK_VERIFY_TOTAL.inc(outcome=outcome)
+
+def grant_or_renew(email: str, plan: str, reference: str, amount: Optional[int] = None):
+    user, action = subscriptions.grant_or_renew(email, plan, reference, amount=amount)
+    if action == "duplicate":
+        return user
+    expiry_scheduler.schedule(user)
     # notify admin(s) via Telegram bot(s) if admin IDs present
     text = f"{email} {action} ({plan}). Paystack ref: {reference}\nDeep-link: https://t.me/{ACCESS_BOT_USERNAME}?start={reference}"
-    asyncio.create_task(bulk_send_admin_message(text))
-    return users[email]
+    admin_digest.add(action, text)
+    return user
 
 async def bulk_send_admin_message(text: str):
-    # try using results_bot for admin notifications (either bot will work)
-    for aid in ADMIN_TELEGRAM_IDS:
-        try:
-            await results_bot.send_message(aid, text)
-        except Exception:
-            try:
-                await access_bot.send_message(aid, text)
-            except Exception:
-                print("Admin notify failed for", aid)
+    if not ADMIN_TELEGRAM_IDS:
+        return
+    # results_bot first, access_bot for the admins it couldn't reach (either bot will work);
+    # a bot without a token is skipped, building it would raise
+    bots = [make for token, make in ((RESULTS_BOT_TOKEN, results_bot), (ACCESS_BOT_TOKEN, access_bot)) if token]
+    if not bots:
+        print("No bot token set; admin notice not sent")
+        return
+    results = [{"chat_id": cid, "ok": False, "error": None} for cid in ADMIN_TELEGRAM_IDS]
+    for make in bots:
+        results = await broadcaster_for(make()).broadcast([r["chat_id"] for r in results], text)
+        results = [r for r in results if not r["ok"]]
+        if not results:
+            return
+    for r in results:
+        print("Admin notify failed for", r["chat_id"], r["error"])
+
+# payment / expiry notices are batched into one digest per admin per window
+admin_digest = AdminDigest(bulk_send_admin_message, ADMIN_DIGEST_WINDOW, ADMIN_DIGEST_MAX, ADMIN_URGENT_KINDS)
 
 # --------------------
 # Web routes (aiohttp)
@@ -181,24 +233,128 @@ async def paystack_webhook(request: web.Request):
     if not ref or not email:
         return web.json_response({"error": "missing reference or email"}, status=400)
 
+    # Paystack redelivers charge.success; answer retries without re-verifying or re-granting
+    done = processed_refs.get(ref)
+    if done is None and store.find_by_reference(ref):
+        # granted by another worker (or before processed_refs was saved)
+        done = store.find_by_reference(ref)["email"]
+    if done is not None:
+        return web.json_response({"status": "duplicate", "email": done}, status=200)
+    if ref in inflight_refs:
+        return web.json_response({"status": "duplicate"}, status=200)
+
+    # ack now; verification and the grant run on the worker pool
+    job = {"reference": ref, "email": email, "amount": amount, "metadata": data.get("metadata")}
+    if not charge_jobs.submit(job):
+        return web.json_response({"error": "busy"}, status=503, headers={"Retry-After": "5"})
+    inflight_refs.add(ref)
+    return web.json_response({"status": "queued"}, status=200)
+
+async def process_charge(job: Dict[str, Any]):
+    await store_ready.wait()
+    ref = job["reference"]
+    email = job["email"]
+    amount = job["amount"]
+    if processed_refs.get(ref) is not None:
+        return
+
     # verify server-side with Paystack if key present
-    verified = None
     if PAYSTACK_SECRET_KEY:
+        # network errors propagate and are retried with backoff
         verified = await verify_transaction_with_paystack(ref)
         if not verified:
-            return web.json_response({"error": "verification failed"}, status=400)
+            raise PermanentJobError(f"verification failed for {ref}")
         email = (verified.get("customer") or {}).get("email") or verified.get("customer_email") or email
         amount = int(verified.get("amount", amount * 100)) // 100
 
-    # determine plan
-    md = data.get("metadata") or {}
-    plan = md.get("plan_type") if isinstance(md, dict) else None
-    if not plan:
-        plan = "daily" if amount >= DAILY_PLAN_AMOUNT else "weekend"
+    plan = subscriptions.plan_for(amount, job.get("metadata"))
+
+    grant_or_renew(email, plan, ref, amount)
+    processed_refs.set(ref, email)
 
-    user = grant_or_renew(email, plan, ref)
-    # Return success
-    return web.json_response({"status": "ok", "email": email}, status=200)
+charge_jobs = JobQueue(
+    process_charge,
+    maxsize=JOB_QUEUE_MAX,
+    workers=JOB_WORKERS,
+    max_attempts=JOB_MAX_ATTEMPTS,
+    backoff_base=JOB_BACKOFF_BASE,
+    # with several workers each gets its own journal (set in on_startup)
+    journal_path=DATA_DIR / "webhook_jobs.journal" if JOB_QUEUE_DURABLE else None,
+    name="paystack-webhook",
+)
+charge_jobs.on_done = lambda job: inflight_refs.discard(job["reference"])
+
+# --------------------
+# Missed webhooks: reconcile against Paystack's transaction list
+# --------------------
+reconciler = PaystackReconciler(PAYSTACK_API_BASE, PAYSTACK_SECRET_KEY, DATA_DIR / "reconcile_cursor.json")
+
+def _payment(tx: Dict[str, Any]):
+    email = (tx.get("customer") or {}).get("email") or ""
+    amount = int(tx.get("amount") or 0) // 100
+    plan = subscriptions.plan_for(amount, tx.get("metadata"))
+    paid_at = parse_ts(tx.get("paid_at")) or subscriptions.now_ts()
+    return email, plan, tx["reference"], paid_at, amount
+
+def payment_missing(tx: Dict[str, Any]) -> bool:
+    ref = tx.get("reference")
+    if not ref or processed_refs.get(ref) is not None or ref in inflight_refs:
+        return False
+    email, plan, ref, paid_at, _ = _payment(tx)
+    if not email or paid_at + subscriptions.plan_seconds(plan) <= subscriptions.now_ts():
+        # nobody to grant, or the period it paid for is already over
+        return False
+    return not subscriptions.payment_reflected(email, ref, plan, paid_at)
+
+async def apply_reconciled(txs: List[Dict[str, Any]]) -> Dict[str, int]:
+    grants = [_payment(tx) for tx in txs]
+    results = subscriptions.grant_many(grants)
+    counts = {"activated": 0, "renewed": 0, "duplicate": 0}
+    lines = []
+    for (email, plan, ref, paid_at, _), (user, action) in zip(grants, results):
+        processed_refs.set(ref, email)
+        counts[action] += 1
+        if action == "duplicate":
+            continue
+        expiry_scheduler.schedule(user)
+        lines.append(f"{email} {action} ({plan}), paid {subscriptions.format_expiry(paid_at)}. "
+                     f"Deep-link: https://t.me/{ACCESS_BOT_USERNAME}?start={ref}")
+    # one digest for the whole batch instead of an event per payment
+    for text in admin_digest.render({"reconciled from Paystack": lines}):
+        await admin_digest.send(text)
+    return counts
+
+async def reconcile_task():
+    if not PAYSTACK_SECRET_KEY or RECONCILE_INTERVAL <= 0:
+        return
+    await reconciler.run(RECONCILE_INTERVAL, payment_missing, apply_reconciled)
+
+@routes.get("/admin/reconcile")
+async def admin_reconcile_stats(request: web.Request):
+    key = request.headers.get("x-admin-key", "")
+    if JWT_SECRET and key != JWT_SECRET:
+        return web.Response(text="unauthorized", status=401)
+    return web.json_response(reconciler.stats())
+
+@routes.post("/admin/reconcile")
+async def admin_reconcile(request: web.Request):
+    # ?dry_run=1 lists what would be applied; ?since=2026-05-01 starts a fresh window there
+    key = request.headers.get("x-admin-key", "")
+    if JWT_SECRET and key != JWT_SECRET:
+        return web.Response(text="unauthorized", status=401)
+    if not PAYSTACK_SECRET_KEY:
+        return web.json_response({"error":"PAYSTACK_SECRET_KEY not set"}, status=400)
+    try:
+        since = request.query.get("since")
+        since = to_iso(datetime.fromisoformat(since).replace(tzinfo=timezone.utc).timestamp()) if since else None
+    except ValueError:
+        return web.json_response({"error":"invalid since"}, status=400)
+    dry_run = request.query.get("dry_run") == "1"
+    try:
+        summary = await reconciler.run_once(payment_missing, None if dry_run else apply_reconciled, since)
+    except Exception as e:
+        return web.json_response({"error": str(e)}, status=502)
+    return web.json_response(summary)
 
 @routes.post("/link_telegram")
 async def link_telegram(request: web.Request):
@@ -210,57 +366,385 @@ async def link_telegram(request: web.Request):
     reference = body.get("reference") or body.get("paystack_reference")
     if not chat_id or not reference:
         return web.json_response({"error":"chat_id and reference required"}, status=400)
+    try:
+        chat_id = int(chat_id)
+    except (TypeError, ValueError):
+        return web.json_response({"error":"invalid chat_id"}, status=400)
+    wait = link_buckets.take(chat_id)
+    if wait:
+        metrics.SHED_REQUESTS.inc(route="/link_telegram", reason="chat_rate_limited")
+        return web.json_response({"error":"too many attempts"}, status=429, headers={"Retry-After": str(int(wait) + 1)})
 
-    users = load_users()
-    found = None
-    for email, u in users.items():
-        if u.get("paystack_reference") == reference:
-            found = (email, u)
-            break
-    if not found:
+    u = await link_and_notify(str(reference), chat_id)
+    if not u:
+        # guessing references costs more than using them
+        ip_buckets.penalize(request.get("client_ip"), shedding.UNKNOWN_REF_PENALTY)
         return web.json_response({"error":"user not found"}, status=404)
+    return web.json_response({"status":"linked","email":u["email"]})
+
+announcements: set = set()
 
-    email, u = found
-    u["chat_id"] = int(chat_id)
-    u["active"] = True
-    users[email] = u
-    save_users(users)
+async def link_and_notify(reference: str, chat_id: int) -> Optional[Dict[str, Any]]:
+    u = None if unknown_refs.get(reference) else subscriptions.link_chat(reference, chat_id)
+    if not u:
+        unknown_refs.set(reference)
+        link_buckets.penalize(chat_id, shedding.UNKNOWN_REF_PENALTY)
+        return None
+    expiry_scheduler.schedule(u)
+    email = u["email"]
 
     # choose group link based on plan
     group_link = DAILY_GROUP_LINK if u.get("plan") == "daily" else WEEKEND_GROUP_LINK
     # send DM with inline button (no raw URL in text)
     kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="Join Group", url=group_link)]])
-    try:
-        await access_bot.send_message(int(chat_id), f"Payment verified! You now have {u.get('plan')} access.", reply_markup=kb)
-    except Exception as e:
-        print("Failed DM user:", e)
+    dm = broadcaster_for(access_bot()).send(chat_id, f"Payment verified! You now have {u.get('plan')} access.", reply_markup=kb)
 
     # announce to group(s) if configured (post a plain message)
+    # weekend plan -> announce to weekend only if configured
+    gid = DAILY_GROUP_ID if u.get("plan") == "daily" and DAILY_GROUP_ID else WEEKEND_GROUP_ID
+    if gid:
+        # group sends are throttled to a few per minute; don't hold the response on them
+        t = asyncio.create_task(broadcaster_for(results_bot()).send(gid, f"{email} joined {u.get('plan')} subscribers."))
+        announcements.add(t)
+        t.add_done_callback(announcements.discard)
+    dm_result = await dm
+    if not dm_result["ok"]:
+        print("Failed DM user:", dm_result["error"])
+
+    return u
+
+@routes.get("/admin/users")
+async def admin_users(request: web.Request):
+    key = request.headers.get("x-admin-key", "")
+    if JWT_SECRET and key != JWT_SECRET:
+        return web.Response(text="unauthorized", status=401)
     try:
-        gid_daily = DAILY_GROUP_ID
-        gid_weekend = WEEKEND_GROUP_ID
-        if u.get("plan") == "daily" and gid_daily:
+        f = user_query.parse_filters(request.query)
+        limit = int(request.query.get("limit") or 0)
+    except ValueError:
+        return web.json_response({"error":"invalid filter"}, status=400)
+    cursor = request.query.get("cursor")
+
+    # the store version changes on every write, so it doubles as a validator
+    etag = f'W/"{store.version}-{hashlib.sha1(request.query_string.encode()).hexdigest()[:16]}"'
+    if etag in request.headers.get("If-None-Match", ""):
+        return web.Response(status=304, headers={"ETag": etag})
+    headers = {"ETag": etag, "Vary": "Accept-Encoding"}
+    gzip_ok = "gzip" in request.headers.get("Accept-Encoding", "")
+
+    if request.query.get("format") == "ndjson":
+        # stream matches incrementally instead of building one big document
+        resp = web.StreamResponse(headers=dict(headers, **{"Content-Type": "application/x-ndjson"}))
+        if gzip_ok:
+            resp.enable_compression()
+        await resp.prepare(request)
+        buf = []
+        for u in user_query.iter_matching(store, f):
+            buf.append(json.dumps(u, ensure_ascii=False))
+            if len(buf) >= 500:
+                await resp.write(("\n".join(buf) + "\n").encode("utf-8"))
+                buf = []
+        if buf:
+            await resp.write(("\n".join(buf) + "\n").encode("utf-8"))
+        await resp.write_eof()
+        return resp
+
+    key = (request.query_string, gzip_ok)
+    body = cached_admin_body(key)
+    if body is None:
+        if limit or cursor:
             try:
-                await results_bot.send_message(gid_daily, f"{email} joined {u.get('plan')} subscribers.")
-            except Exception:
-                pass
+                users, next_cursor = user_query.page(store, f, cursor, limit or 100)
+            except ValueError:
+                return web.json_response({"error":"invalid cursor"}, status=400)
+            payload = {"users": users, "next_cursor": next_cursor}
         else:
-            # weekend plan -> announce to weekend only if configured
-            try:
-                await results_bot.send_message(gid_weekend, f"{email} joined {u.get('plan')} subscribers.")
-            except Exception:
-                pass
+            payload = {u["email"]: u for u in user_query.iter_matching(store, f)}
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        if gzip_ok:
+            body = gzip.compress(body, compresslevel=5)
+        cache_admin_body(key, body)
+    if gzip_ok:
+        headers["Content-Encoding"] = "gzip"
+    return web.Response(body=body, content_type="application/json", headers=headers)
+
+# serialized /admin/users responses for the current store version
+_admin_body_cache: Dict[Any, bytes] = {}
+_admin_body_version = -1
+
+def cached_admin_body(key) -> Optional[bytes]:
+    if _admin_body_version != store.version:
+        return None
+    return _admin_body_cache.get(key)
+
+def cache_admin_body(key, body: bytes):
+    global _admin_body_version
+    if _admin_body_version != store.version:
+        _admin_body_cache.clear()
+        _admin_body_version = store.version
+    if len(_admin_body_cache) >= 64:
+        _admin_body_cache.clear()
+    _admin_body_cache[key] = body
+
+@routes.get("/admin/users/count")
+async def admin_user_count(request: web.Request):
+    # same filters as /admin/users; answered from the columnar mirror without touching the dicts
+    key = request.headers.get("x-admin-key", "")
+    if JWT_SECRET and key != JWT_SECRET:
+        return web.Response(text="unauthorized", status=401)
+    try:
+        f = user_query.parse_filters(request.query)
+    except ValueError:
+        return web.json_response({"error":"invalid filter"}, status=400)
+    return web.json_response(user_query.count(store, f))
+
+@routes.get("/admin/stats")
+async def admin_stats(request: web.Request):
+    # ?bucket=day|hour&limit=N; aggregates kept by services/stats.py, no user scan
+    key = request.headers.get("x-admin-key", "")
+    if JWT_SECRET and key != JWT_SECRET:
+        return web.Response(text="unauthorized", status=401)
+    try:
+        limit = int(request.query.get("limit", "0")) or None
+    except ValueError:
+        return web.json_response({"error":"invalid limit"}, status=400)
+    return web.json_response(subscriptions.stats.snapshot(request.query.get("bucket", "day"), limit))
+
+@routes.post("/admin/stats/rebuild")
+async def admin_stats_rebuild(request: web.Request):
+    # start the aggregates over from the stored users (one full pass)
+    key = request.headers.get("x-admin-key", "")
+    if JWT_SECRET and key != JWT_SECRET:
+        return web.Response(text="unauthorized", status=401)
+    started = time.perf_counter()
+    subscriptions.stats.rebuild(store.all(), subscriptions.plan_seconds)
+    subscriptions.stats.save()
+    return web.json_response({"users": len(store), "seconds": round(time.perf_counter() - started, 3)})
+
+@routes.get("/admin/users/by_chat/{chat_id}")
+async def admin_user_by_chat(request: web.Request):
+    key = request.headers.get("x-admin-key", "")
+    if JWT_SECRET and key != JWT_SECRET:
+        return web.Response(text="unauthorized", status=401)
+    try:
+        chat_id = int(request.match_info["chat_id"])
+    except ValueError:
+        return web.json_response({"error":"invalid chat_id"}, status=400)
+    u = subscriptions.status_for_chat(chat_id)
+    if not u:
+        return web.json_response({"error":"user not found"}, status=404)
+    return web.json_response(u)
+
+@routes.get("/admin/cache_stats")
+async def admin_cache_stats(request: web.Request):
+    key = request.headers.get("x-admin-key", "")
+    if JWT_SECRET and key != JWT_SECRET:
+        return web.Response(text="unauthorized", status=401)
+    return web.json_response({
+        "processed_refs": processed_refs.stats(),
+        "verified_transactions": verified_cache.stats(),
+        "unknown_references": unknown_refs.stats(),
+        "user_columns": {"rows": len(store.columns), "bytes": store.columns.nbytes()} if store.columns is not None else None,
+    })
+
+@routes.get("/admin/membership")
+async def admin_membership(request: web.Request):
+    key = request.headers.get("x-admin-key", "")
+    if JWT_SECRET and key != JWT_SECRET:
+        return web.Response(text="unauthorized", status=401)
+    return web.json_response(membership.stats())
+
+@routes.post("/admin/membership/sweep")
+async def admin_membership_sweep(request: web.Request):
+    # remove expired members / re-admit renewed ones now instead of at the next interval
+    key = request.headers.get("x-admin-key", "")
+    if JWT_SECRET and key != JWT_SECRET:
+        return web.Response(text="unauthorized", status=401)
+    if not membership.groups:
+        return web.json_response({"error":"no groups configured"}, status=400)
+    return web.json_response(await membership.sweep_once())
+
+# --------------------
+# Profiling a live process (this worker only)
+# --------------------
+memory_tracker = profiling.MemoryTracker()
+
+@routes.post("/admin/debug/profile")
+async def admin_debug_profile(request: web.Request):
+    # ?seconds=10&sort=cumulative&limit=50; ?format=pstats returns marshalled stats for pstats.Stats / snakeviz
+    key = request.headers.get("x-admin-key", "")
+    if JWT_SECRET and key != JWT_SECRET:
+        return web.Response(text="unauthorized", status=401)
+    q = request.query
+    try:
+        result = await profiling.profile_for(float(q.get("seconds", "10")), q.get("sort", "cumulative"),
+                                             int(q.get("limit", "50")), raw=q.get("format") == "pstats")
+    except profiling.ProfilerBusy as e:
+        return web.json_response({"error": str(e)}, status=409)
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+    if isinstance(result, bytes):
+        return web.Response(body=result, content_type="application/octet-stream",
+                            headers={"Content-Disposition": f"attachment; filename=profile-{os.getpid()}.pstats"})
+    return web.Response(text=result)
+
+@routes.post("/admin/debug/tracemalloc/{action}")
+async def admin_debug_tracemalloc(request: web.Request):
+    # start[?frames=10] | snapshot[?group_by=lineno&limit=30] (top + diff since the last one) | stop
+    key = request.headers.get("x-admin-key", "")
+    if JWT_SECRET and key != JWT_SECRET:
+        return web.Response(text="unauthorized", status=401)
+    action = request.match_info["action"]
+    q = request.query
+    try:
+        if action == "start":
+            return web.json_response(memory_tracker.start(int(q.get("frames", profiling.TRACEMALLOC_FRAMES))))
+        if action == "stop":
+            return web.json_response(memory_tracker.stop())
+        if action == "snapshot":
+            report = await asyncio.to_thread(memory_tracker.take, q.get("group_by", "lineno"), int(q.get("limit", "30")))
+            return web.json_response(report)
+    except (RuntimeError, ValueError) as e:
+        return web.json_response({"error": str(e)}, status=400)
+    return web.json_response({"error": "action must be start, snapshot or stop"}, status=404)
+
+@routes.get("/admin/debug/tracemalloc")
+async def admin_debug_tracemalloc_status(request: web.Request):
+    key = request.headers.get("x-admin-key", "")
+    if JWT_SECRET and key != JWT_SECRET:
+        return web.Response(text="unauthorized", status=401)
+    return web.json_response(memory_tracker.status())
+
+@routes.get("/admin/ledger")
+async def admin_ledger(request: web.Request):
+    # ?email=... lists that customer's payments and links; ?verify=1 compares with the store
+    key = request.headers.get("x-admin-key", "")
+    if JWT_SECRET and key != JWT_SECRET:
+        return web.Response(text="unauthorized", status=401)
+    if ledger is None:
+        return web.json_response({"error":"ledger disabled"}, status=404)
+    email = request.query.get("email")
+    if email:
+        ledger.flush()
+        return web.json_response({"email": email, "events": await asyncio.to_thread(ledger.history, email)})
+    if request.query.get("verify") == "1":
+        ledger.catch_up()
+        return web.json_response(ledger.verify(store.all()))
+    ledger.catch_up()
+    return web.json_response(ledger.stats())
+
+@routes.get("/admin/queue_stats")
+async def admin_queue_stats(request: web.Request):
+    key = request.headers.get("x-admin-key", "")
+    if JWT_SECRET and key != JWT_SECRET:
+        return web.Response(text="unauthorized", status=401)
+    return web.json_response({
+        "paystack_webhook": charge_jobs.stats(),
+        "access_bot_updates": access_updates.stats(),
+        "results_bot_updates": results_updates.stats(),
+        "http_limiter": http_limiter.stats(),
+        "ip_buckets": ip_buckets.stats(),
+        "link_buckets": link_buckets.stats(),
+        "polling": {name: p.stats() for name, p in pollers.items()},
+        "leader": leader.stats(),
+    })
+
+@routes.get("/admin/slips")
+async def admin_slips(request: web.Request):
+    key = request.headers.get("x-admin-key", "")
+    if JWT_SECRET and key != JWT_SECRET:
+        return web.Response(text="unauthorized", status=401)
+    return web.json_response({
+        "posts": publisher.list(pending_only=request.query.get("pending") == "1"),
+        **publisher.stats(),
+    })
+
+@routes.post("/admin/slips")
+async def admin_schedule_slip(request: web.Request):
+    # body: {"send_at": "18:30" | "+2h" | unix time, "plans": [...], "games": [...]}; games default to the current slip
+    key = request.headers.get("x-admin-key", "")
+    if JWT_SECRET and key != JWT_SECRET:
+        return web.Response(text="unauthorized", status=401)
+    try:
+        body = await request.json()
     except Exception:
-        pass
+        return web.json_response({"error":"invalid json"}, status=400)
+    try:
+        send_at = parse_send_at(str(body.get("send_at", "now")))
+        plans = parse_plans(body.get("plans"))
+        with backend.transaction():
+            if body.get("games") is not None:
+                post = publisher.schedule(parse_games(body["games"]), send_at, plans)
+            else:
+                refresh_games()
+                post = publisher.schedule(games, send_at, plans)
+                games.clear()
+                save_games(games)
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+    return web.json_response(post, status=201)
 
-    return web.json_response({"status":"linked","email":email})
+@routes.delete("/admin/slips/{post_id}")
+async def admin_cancel_slip(request: web.Request):
+    key = request.headers.get("x-admin-key", "")
+    if JWT_SECRET and key != JWT_SECRET:
+        return web.Response(text="unauthorized", status=401)
+    post = publisher.cancel(request.match_info["post_id"])
+    if post is None:
+        return web.json_response({"error":"slip not found"}, status=404)
+    if post["status"] != "cancelled":
+        return web.json_response({"error": f"slip is {post['status']}"}, status=409)
+    return web.json_response(post)
 
-@routes.get("/admin/users")
-async def admin_users(request: web.Request):
+@routes.post("/admin/slips/{post_id}/retry")
+async def admin_retry_slip(request: web.Request):
+    # resend to the groups that failed
     key = request.headers.get("x-admin-key", "")
     if JWT_SECRET and key != JWT_SECRET:
         return web.Response(text="unauthorized", status=401)
-    return web.json_response(load_users())
+    post = await publisher.publish(request.match_info["post_id"], retry=True)
+    if post is None:
+        return web.json_response({"error":"slip not found or not retryable"}, status=409)
+    return web.json_response(post)
+
+@routes.get("/metrics")
+async def metrics_endpoint(request: web.Request):
+    # Prometheus scrape; accepts the admin key as x-admin-key or a bearer token
+    key = request.headers.get("x-admin-key", "") or request.headers.get("Authorization", "").replace("Bearer ", "", 1)
+    if JWT_SECRET and key != JWT_SECRET:
+        return web.Response(text="unauthorized", status=401)
+    metrics.STORE_FILE_BYTES.set(backend.size_bytes())
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+metrics.STORE_USERS.set_function(lambda: len(store))
+metrics.QUEUE_DEPTH.set_function(lambda: charge_jobs.depth, queue="paystack_webhook")
+metrics.QUEUE_DEPTH.set_function(lambda: access_updates.pending, queue="access_bot_updates")
+metrics.QUEUE_DEPTH.set_function(lambda: results_updates.pending, queue="results_bot_updates")
+metrics.QUEUE_DEPTH.set_function(lambda: admin_digest.pending(), queue="admin_digest")
+metrics.QUEUE_DEPTH.set_function(lambda: len(expiry_scheduler), queue="expiry_scheduler")
+metrics.QUEUE_DEPTH.set_function(lambda: publisher.pending(), queue="slip_publisher")
+metrics.QUEUE_DEPTH.set_function(lambda: membership.queued(), queue="group_readmissions")
+metrics.QUEUE_DEPTH.set_function(lambda: http_limiter.waiting, queue="http_limiter")
+
+@routes.get("/healthz")
+async def healthz(request: web.Request):
+    # liveness: the loop answers
+    return web.json_response({"status": "ok"})
+
+@routes.get("/readyz")
+async def readyz(request: web.Request):
+    r = readiness()
+    return web.json_response(r, status=200 if r["ready"] else 503)
+
+# reachable before the store is loaded; webhooks only enqueue, their workers wait
+ALWAYS_OPEN = {"/", "/healthz", "/readyz", "/metrics", "/paystack/webhook", "/access-bot-webhook", "/results-bot-webhook"}
+
+@web.middleware
+async def readiness_gate(request: web.Request, handler):
+    if not store_ready.is_set() and request.path not in ALWAYS_OPEN:
+        return web.json_response({"error": "starting"}, status=503, headers={"Retry-After": "2"})
+    return await handler(request)
 
 @routes.get("/")
 async def home(request: web.Request):
@@ -270,45 +754,43 @@ async def home(request: web.Request):
 # Results bot handlers (full logic preserved)
 # --------------------
 # persistent games list
-games = load_games()  # list of strings
+games = GameSlip()  # parsed {raw, fixture, market, odds} records; loaded in warm_up()
+games_version = None
+
+def refresh_games():
+    # first use, or another worker changed the slip
+    global games, games_version
+    v = backend.games_version()
+    if v != games_version or v is None:
+        games = GameSlip(load_games())
+        games_version = v
 
 def is_admin(uid: int) -> bool:
     return uid in ADMIN_TELEGRAM_IDS
 
-def format_betting_slip(games_list):
-    if not games_list:
-        return "📭 No games added yet."
-    lines = ["🎯 *STAKEAWARE OFFICIAL RESULTS*","\n"]
-    total = 1.0
-    for i, g in enumerate(games_list, start=1):
-        # try extract odds: last token numeric
-        toks = g.strip().split()
-        odds = None
-        for t in reversed(toks):
-            try:
-                odds = float(t.replace(",", "."))
-                break
-            except:
-                continue
-        if odds:
-            total *= odds
-            lines.append(f"{i}. *{g}* — `{odds:.2f}`")
-        else:
-            lines.append(f"{i}. *{g}*")
-    total_text = f"{total:.2f}" if total and total != 1.0 else "—"
-    lines.append("\n💰 *Total Odds:* " + total_text)
-    lines.append("\n🔥 Play Responsibly 🔥")
-    return "\n".join(lines)
+SLIP_TITLE = "🎯 *STAKEAWARE OFFICIAL RESULTS*\n\n"
+
+def format_betting_slip(slip: GameSlip):
+    return slip.render(SLIP_TITLE)
+
+# queued slips: pre-rendered, routed plan -> groups, sent by the leader at their time
+publisher = SlipPublisher(backend, lambda: broadcaster_for(results_bot()), SLIP_TITLE)
+
+def format_post(post: Dict[str, Any]) -> str:
+    when = datetime.fromtimestamp(post["send_at"], timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
+    done = publisher.delivered_count(post)
+    return f"`{post['id']}` {when} — {len(post['games'])} game(s), {post['status']} ({done}/{len(post['targets'])} groups)"
 
 # results bot command handlers
 @results_dp.message(Command("start"))
 async def results_start(message: types.Message):
     if is_admin(message.from_user.id):
         kb = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton("➕ Add Game", callback_data="add_game")],
-            [InlineKeyboardButton("📋 List Games", callback_data="list_games")],
-            [InlineKeyboardButton("📤 Post Games", callback_data="post_games")],
-            [InlineKeyboardButton("🗑️ Clear Games", callback_data="clear_games")]
+            [InlineKeyboardButton(text="➕ Add Game", callback_data="add_game")],
+            [InlineKeyboardButton(text="📋 List Games", callback_data="list_games")],
+            [InlineKeyboardButton(text="📤 Post Games", callback_data="post_games")],
+            [InlineKeyboardButton(text="🕒 Scheduled Posts", callback_data="scheduled")],
+            [InlineKeyboardButton(text="🗑️ Clear Games", callback_data="clear_games")]
         ])
         await message.answer("Welcome to StakeAware Results Bot (admin). Use buttons below.", reply_markup=kb)
     else:
@@ -321,6 +803,7 @@ async def results_menu_handler(callback: types.CallbackQuery):
     if not is_admin(uid):
         await callback.answer("❌ Not authorized", show_alert=True)
         return
+    refresh_games()
 
     if data == "add_game":
         await callback.message.edit_text("Send the game text as a reply to this chat message: e.g. `Real vs Opp GG - 1.55`")
@@ -333,8 +816,10 @@ async def results_menu_handler(callback: types.CallbackQuery):
         return
 
     if data == "clear_games":
-        games.clear()
-        save_games(games)
+        with backend.transaction():
+            refresh_games()
+            games.clear()
+            save_games(games)
         await callback.message.edit_text("🗑️ All added games cleared.")
         await callback.answer()
         return
@@ -343,24 +828,67 @@ async def results_menu_handler(callback: types.CallbackQuery):
         if not games:
             await callback.answer("No games to post.", show_alert=True)
             return
-        text = format_betting_slip(games)
-        day = datetime.now().weekday()  # Monday=0 ... Sunday=6
-        targets = [DAILY_GROUP_ID]
-        if day in [4,5,6]:  # Fri(4), Sat(5), Sun(6)
-            targets.append(WEEKEND_GROUP_ID)
-        posted = 0
-        for gid in targets:
+        # an immediate post goes through the publisher too: all groups at once, status kept.
+        # Nothing is awaited inside the transaction: the lock is per process, not per task
+        error = None
+        with backend.transaction():
+            refresh_games()
             try:
-                await results_bot.send_message(gid, text, parse_mode="Markdown")
-                posted += 1
-            except Exception as e:
-                print("Failed to post to", gid, e)
-        games.clear()
-        save_games(games)
-        await callback.message.edit_text(f"✅ Results posted to {posted} group(s).")
+                post = publisher.schedule(games, time.time())
+                games.clear()
+                save_games(games)
+            except ValueError as e:
+                error = str(e)
+        if error:
+            await callback.answer(f"❌ {error}", show_alert=True)
+            return
+        sent = await publisher.publish(post["id"])
+        if sent is None:
+            # the leader's send loop claimed it first and is posting it
+            await callback.message.edit_text("✅ Results are being posted by the scheduler.")
+        else:
+            await callback.message.edit_text(f"✅ Results posted to {publisher.delivered_count(sent)} group(s).")
+        await callback.answer()
+        return
+
+    if data == "scheduled":
+        posts = publisher.list(pending_only=True)
+        text = "\n".join(format_post(p) for p in posts) if posts else "📭 No slips queued."
+        await callback.message.edit_text(text, parse_mode="Markdown")
         await callback.answer()
         return
 
+@results_dp.message(Command("schedule"))
+async def results_schedule(message: types.Message, command: CommandObject):
+    # /schedule <when> [plan ...]   when: 18:30 (UTC), +2h, 2026-05-01 18:30
+    if not is_admin(message.from_user.id):
+        return
+    args = (command.args or "").split()
+    if not args:
+        await message.reply("Usage: /schedule 18:30 [daily weekend] (UTC), /schedule +2h, /schedule 2026-05-01T18:30")
+        return
+    try:
+        send_at = parse_send_at(args[0])
+        with backend.transaction():
+            refresh_games()
+            post = publisher.schedule(games, send_at, args[1:] or None)
+            games.clear()
+            save_games(games)
+    except ValueError as e:
+        await message.reply(f"❌ {e}")
+        return
+    await message.reply("🕒 Queued " + format_post(post), parse_mode="Markdown")
+
+@results_dp.message(Command("cancel"))
+async def results_cancel(message: types.Message, command: CommandObject):
+    if not is_admin(message.from_user.id):
+        return
+    post = publisher.cancel((command.args or "").strip())
+    if post is None:
+        await message.reply("❌ No such slip.")
+    else:
+        await message.reply(format_post(post), parse_mode="Markdown")
+
 @results_dp.message()
 async def results_text_handler(message: types.Message):
     # Admin sends game text as normal message after 'add_game' prompt
@@ -369,37 +897,35 @@ async def results_text_handler(message: types.Message):
     txt = message.text.strip()
     if not txt:
         return
-    games.append(txt)
-    save_games(games)
+    with backend.transaction():
+        refresh_games()
+        games.add(txt)
+        save_games(games)
     await message.reply(f"✅ Game added:\n*{txt}*", parse_mode="Markdown")
 
 # --------------------
 # Access bot handlers (linking /status)
 # --------------------
 @access_dp.message(Command("start"))
-async def access_start(message: types.Message):
-    # deep-link args are in message.get_args()
-    args = message.get_args()
-    check_kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton("ℹ️ Check Status", callback_data="status")]])
+async def access_start(message: types.Message, command: CommandObject):
+    # deep-link payload: /start <reference>
+    args = command.args
+    check_kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="ℹ️ Check Status", callback_data="status")]])
     if args:
         ref = args.strip()
-        # call backend /link_telegram
-        async with aiohttp.ClientSession() as s:
-            try:
-                payload = {"reference": ref, "chat_id": message.chat.id}
-                # backend is this same app; call internal route
-                url = f"http://127.0.0.1:{PORT}/link_telegram"
-                async with s.post(url, json=payload, timeout=10) as r:
-                    text = await r.text()
-                    if r.status == 200:
-                        await message.answer("✅ Payment reference linked. You now have access if the payment is valid.", reply_markup=check_kb)
-                        return
-                    else:
-                        await message.answer(f"❌ Could not link reference: {text}", reply_markup=check_kb)
-                        return
-            except Exception as e:
-                await message.answer(f"❌ Error connecting to backend: {e}", reply_markup=check_kb)
-                return
+        if link_buckets.take(message.chat.id):
+            await message.answer("⏳ Too many attempts. Please wait a minute and try again.", reply_markup=check_kb)
+            return
+        try:
+            u = await link_and_notify(ref, message.chat.id)
+        except Exception as e:
+            await message.answer(f"❌ Error linking reference: {e}", reply_markup=check_kb)
+            return
+        if u:
+            await message.answer("✅ Payment reference linked. You now have access if the payment is valid.", reply_markup=check_kb)
+        else:
+            await message.answer("❌ Could not link reference: user not found", reply_markup=check_kb)
+        return
 
     await message.answer(
         "Welcome to StakeAware Access Bot.\n\nIf you completed payment, open the verification deep-link from the payment page (it should open this bot with a reference). Use the button below to check status.",
@@ -409,121 +935,375 @@ async def access_start(message: types.Message):
 @access_dp.callback_query(lambda c: c.data == "status")
 async def access_status_cb(callback: types.CallbackQuery):
     chat_id = callback.message.chat.id
-    # call /admin/users with admin key if present
-    headers = {}
-    if JWT_SECRET:
-        headers["x-admin-key"] = JWT_SECRET
-    async with aiohttp.ClientSession() as s:
-        try:
-            url = f"http://127.0.0.1:{PORT}/admin/users"
-            async with s.get(url, headers=headers, timeout=10) as r:
-                if r.status != 200:
-                    await callback.message.answer("Could not fetch status from backend.")
-                    await callback.answer()
-                    return
-                j = await r.json()
-                for email, u in j.items():
-                    if int(u.get("chat_id", 0)) == chat_id:
-                        exp = u.get("expires_at")
-                        exp_str = datetime.fromtimestamp(int(exp), tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC") if exp else "N/A"
-                        await callback.message.answer(f"✅ Active plan: {u.get('plan')} | Expires at (UTC): {exp_str}")
-                        await callback.answer()
-                        return
-                await callback.message.answer("❌ No active subscription found for this account.")
-                await callback.answer()
-                return
-        except Exception as e:
-            await callback.message.answer(f"Error fetching status: {e}")
-            await callback.answer()
-            return
+    u = subscriptions.status_for_chat(chat_id)
+    if u:
+        exp_str = subscriptions.format_expiry(u.get("expires_at"))
+        await callback.message.answer(f"✅ Active plan: {u.get('plan')} | Expires at (UTC): {exp_str}")
+    else:
+        await callback.message.answer("❌ No active subscription found for this account.")
+    await callback.answer()
 
 # --------------------
 # Background expiry checker + self-pinger
 # --------------------
+async def send_expiry_reminder(u: Dict[str, Any]):
+    exp = int(u["expires_at"])
+    if u.get("chat_id"):
+        r = await broadcaster_for(access_bot()).send(int(u["chat_id"]),
+            f"Reminder: your {u.get('plan')} subscription expires on {subscriptions.format_expiry(exp)}"
+        )
+        if not r["ok"]:
+            # the scheduler retries the reminder later, unless the chat can't be reached at all
+            raise (PermanentEventError if r["permanent"] else RuntimeError)(r["error"])
+    else:
+        admin_digest.add("expiring without chat_id", f"User {u['email']} ({u.get('plan')}) expires soon but has no chat_id. Deep-link: https://t.me/{ACCESS_BOT_USERNAME}?start={u.get('paystack_reference')}")
+
+async def notify_expired(u: Dict[str, Any]):
+    admin_digest.add("expired", f"{u['email']} subscription expired.")
+
+# wakes only when the next reminder / expiry deadline is due
+expiry_scheduler = ExpiryScheduler(store, EXPIRY_ALERT_DAYS * 24 * 3600, send_expiry_reminder, notify_expired)
+
 async def expiry_checker_task():
+    expiry_scheduler.rebuild()
+    await expiry_scheduler.run()
+
+def on_user_synced(u: Optional[Dict[str, Any]]):
+    # writes from other workers; only the leader runs the scheduler
+    if not leader.is_leader:
+        return
+    if u is None:
+        expiry_scheduler.rebuild()
+    else:
+        expiry_scheduler.schedule(u)
+
+store.listeners.append(on_user_synced)
+
+async def send_readmit_links(chat_id: int, u: Dict[str, Any], links: List[tuple]):
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="Join Group" if len(links) == 1 else f"Join Group {i}", url=link)]
+        for i, (_, link) in enumerate(links, 1)
+    ])
+    r = await broadcaster_for(access_bot()).send(chat_id,
+        f"Welcome back! Your {u.get('plan')} subscription is active again until {subscriptions.format_expiry(u.get('expires_at'))}. "
+        "These links work once:", reply_markup=kb)
+    if not r["ok"]:
+        admin_digest.add("re-admission DM failed", f"{u['email']}: {r['error']}")
+
+# expired members out of the groups, renewed ones back in (leader only)
+membership = MembershipSweeper(store, results_bot, publisher.routes, DATA_DIR / "membership_sweep.json", send_readmit_links)
+store.observers.append(membership)
+
+def adopt_orphaned_jobs():
+    # durable webhook journals left by workers that died
+    if not (JOB_QUEUE_DURABLE and cluster.MULTI_WORKER):
+        return
+    for p in DATA_DIR.glob("webhook_jobs.*.journal"):
+        try:
+            pid = int(p.name.split(".")[1])
+        except ValueError:
+            continue
+        if pid == os.getpid() or _pid_alive(pid):
+            continue
+        for job in charge_jobs.adopt(p):
+            inflight_refs.add(job["reference"])
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+async def cluster_maintenance_task():
+    # leader only: orphaned job journals, the SQLite change feed and old slips
+    while True:
+        await asyncio.sleep(60)
+        try:
+            adopt_orphaned_jobs()
+            if cluster.MULTI_WORKER and hasattr(backend, "prune_changes"):
+                backend.prune_changes(time.time() - 3600)
+            publisher.prune()
+        except Exception as e:
+            print("Cluster maintenance failed:", e)
+
+leader = LeaderElection(backend, "background-jobs")
+leader.on_elected.append(adopt_orphaned_jobs)
+leader.add_job(expiry_checker_task)
+leader.add_job(cluster_maintenance_task)
+leader.add_job(publisher.run)
+leader.add_job(reconcile_task)
+leader.add_job(membership.run)
+leader.add_job(lambda: self_ping_task(f"http://127.0.0.1:{PORT}/"))
+if store.shared:
+    leader.add_job(store.compact_loop)
+if ledger is not None:
+    leader.add_job(ledger.snapshot_loop)
+
+async def cache_saver_task():
     while True:
-        users = load_users()
-        now = int(datetime.now(tz=timezone.utc).timestamp())
-        changed = False
-        for email, u in list(users.items()):
-            exp = int(u.get("expires_at", 0))
-            if u.get("active") and exp:
-                if 0 < exp - now <= EXPIRY_ALERT_DAYS * 24 * 3600:
-                    if u.get("chat_id"):
-                        try:
-                            await access_bot.send_message(int(u["chat_id"]),
-                                f"Reminder: your {u.get('plan')} subscription expires on {datetime.fromtimestamp(exp, tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')}"
-                            )
-                        except Exception:
-                            pass
-                    else:
-                        await bulk_send_admin_message(f"User {email} ({u.get('plan')}) expires soon but has no chat_id. Deep-link: https://t.me/{ACCESS_BOT_USERNAME}?start={u.get('paystack_reference')}")
-                if exp <= now:
-                    u["active"] = False
-                    users[email] = u
-                    changed = True
-                    await bulk_send_admin_message(f"{email} subscription expired.")
-        if changed:
-            save_users(users)
-        await asyncio.sleep(3600)
+        await asyncio.sleep(30)
+        try:
+            async with metrics.task_run("cache_saver"):
+                processed_refs.save()
+                if leader.is_leader:
+                    # every worker keeps the same series from the change feed; one writes them
+                    subscriptions.stats.save()
+        except Exception as e:
+            print("Failed to save processed refs:", e)
 
 async def self_ping_task(app_url: str):
     # keep free Render service awake
-    async with aiohttp.ClientSession() as s:
-        while True:
-            try:
-                await s.get(app_url, timeout=5)
-            except Exception:
-                pass
-            await asyncio.sleep(SELF_PING_INTERVAL)
+    while True:
+        try:
+            async with metrics.task_run("self_ping"):
+                async with http_client.get_session().get(app_url, timeout=aiohttp.ClientTimeout(total=5)) as r:
+                    await r.read()
+        except Exception:
+            pass
+        await asyncio.sleep(SELF_PING_INTERVAL)
 
 # --------------------
 # Startup / runner
 # --------------------
-async def on_startup(app: web.Application):
-    # set webhooks for both bots to our endpoints (use RENDER external URL env var if provided)
-    public_url = os.getenv("PUBLIC_URL") or os.getenv("BACKEND_BASE_URL") or os.getenv("BACKEND_URL")
-    if public_url:
+# readiness: the web server listens at once, the slow parts load in warm_up()
+store_ready = asyncio.Event()
+webhook_status: Dict[str, Any] = {}   # bot -> True | error text; empty when PUBLIC_URL is unset
+startup_timings: Dict[str, float] = {"import": 0.0}
+
+async def timed(name: str, coro):
+    started = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        startup_timings[name] = time.perf_counter() - started
+
+async def set_webhook_with_retry(name: str, bot: Bot, url: str):
+    attempt = 0
+    while True:
+        attempt += 1
         try:
-            await results_bot.set_webhook(f"{public_url.rstrip('/')}/results-bot-webhook")
-            await access_bot.set_webhook(f"{public_url.rstrip('/')}/access-bot-webhook")
-            print("Webhooks set to:", public_url)
+            await asyncio.wait_for(bot.set_webhook(url), WEBHOOK_SET_TIMEOUT)
+            webhook_status[name] = True
+            return
         except Exception as e:
-            print("Failed to set webhook automatically:", e)
-    else:
+            webhook_status[name] = f"attempt {attempt}: {type(e).__name__}: {e}"
+            print(f"Failed to set {name} webhook ({webhook_status[name]})")
+            retry_after = getattr(e, "retry_after", None)
+            # quick retries first, then keep trying slowly in the background
+            delay = retry_after or min(WEBHOOK_RETRY_MAX, 2 ** attempt if attempt < WEBHOOK_SET_ATTEMPTS else WEBHOOK_RETRY_MAX)
+            await asyncio.sleep(delay)
+
+def configured_public_url() -> Optional[str]:
+    # RENDER external URL env var if provided
+    return os.getenv("PUBLIC_URL") or os.getenv("BACKEND_BASE_URL") or os.getenv("BACKEND_URL")
+
+async def register_webhooks():
+    # set webhooks for both bots to our endpoints
+    if pollers:
+        return
+    public_url = configured_public_url()
+    if not public_url:
         print("PUBLIC_URL not set; remember to set webhooks manually.")
+        return
+    base = public_url.rstrip('/')
+    await asyncio.gather(
+        set_webhook_with_retry("results", results_bot(), f"{base}/results-bot-webhook"),
+        set_webhook_with_retry("access", access_bot(), f"{base}/access-bot-webhook"),
+    )
+    print("Webhooks set to:", public_url)
+
+def restore_store_from_ledger():
+    # the user store couldn't be read: put the ledger's state in its place
+    users_file = getattr(backend, "users_file", None)
+    if users_file is not None and users_file.exists():
+        aside = users_file.with_name(users_file.name + ".corrupt")
+        os.replace(users_file, aside)
+        print("Moved the unreadable user store to", aside)
+    backend.replace_users(ledger.rebuild_users(alert_seconds=EXPIRY_ALERT_DAYS * 24 * 3600))
+    store.load()
+
+async def load_store(ledger_loaded: Optional[asyncio.Task]):
+    try:
+        await asyncio.to_thread(store.load)
+    except Exception as e:
+        if ledger_loaded is None:
+            raise
+        await ledger_loaded
+        if not ledger.users:
+            raise
+        print(f"User store failed to load ({e}); rebuilding it from the payment ledger")
+        await asyncio.to_thread(restore_store_from_ledger)
+    if ledger is not None:
+        await ledger_loaded
+        if ledger.events == 0 and len(store):
+            # first start with a ledger: record the existing subscribers as its starting point
+            seeded = await asyncio.to_thread(ledger.seed, store.all())
+            await asyncio.to_thread(ledger.catch_up)
+            print("Payment ledger started with", seeded, "existing users")
+
+# loops started at startup; on_shutdown cancels them
+background_tasks: List[asyncio.Task] = []
+
+def start_background(coro) -> asyncio.Task:
+    t = asyncio.create_task(coro)
+    background_tasks.append(t)
+    return t
+
+async def warm_up(app: web.Application):
+    started = time.perf_counter()
+    webhooks = asyncio.create_task(timed("webhooks", register_webhooks()))
+    # snapshot + tail only
+    ledger_loaded = asyncio.create_task(timed("ledger", asyncio.to_thread(ledger.load))) if ledger is not None else None
+    try:
+        # independent files, read on threads side by side
+        await asyncio.gather(
+            timed("store", load_store(ledger_loaded)),
+            timed("processed_refs", asyncio.to_thread(processed_refs.load)),
+            timed("stats", asyncio.to_thread(subscriptions.stats.load)),
+            timed("games", asyncio.to_thread(refresh_games)),
+        )
+    except Exception as e:
+        print("Startup failed loading state:", e)
+        raise
+    store_ready.set()
+    print("Loaded", len(store), "users")
+
+    # background tasks that need the store
+    start_background(store.run())
+    start_background(cache_saver_task())
+    if ledger is not None:
+        start_background(ledger.run())
+    # expiry reminders, self-ping and compaction run in one worker only
+    start_background(leader.run())
+
+    startup_timings["ready"] = time.perf_counter() - started
+    print("Startup timings: " + ", ".join(f"{k} {v:.2f}s" for k, v in startup_timings.items()))
+    # may keep retrying for a while; its time shows up in /readyz once done
+    await webhooks
 
-    # start background tasks
-    app.loop.create_task(expiry_checker_task())
-    app.loop.create_task(self_ping_task(f"http://127.0.0.1:{PORT}/"))
+async def on_startup(app: web.Application):
+    started = time.perf_counter()
+    await http_client.start()
+    if JOB_QUEUE_DURABLE and cluster.MULTI_WORKER:
+        charge_jobs.journal_path = DATA_DIR / f"webhook_jobs.{os.getpid()}.journal"
+    # jobs and updates are accepted now and wait for store_ready before running
+    for job in await charge_jobs.start():
+        inflight_refs.add(job["reference"])
+    start_background(admin_digest.run())
+    start_background(warm_up(app))
+    startup_timings["on_startup"] = time.perf_counter() - started
+
+def readiness() -> Dict[str, Any]:
+    queues = {
+        "paystack_webhook": charge_jobs.accepting and charge_jobs.depth < charge_jobs.maxsize * 0.9,
+        "access_bot_updates": access_updates.pending < access_updates.max_pending * 0.9,
+        "results_bot_updates": results_updates.pending < results_updates.max_pending * 0.9,
+    }
+    webhooks_ok = all(v is True for v in webhook_status.values())
+    ready = store_ready.is_set() and all(queues.values()) and (webhooks_ok or not READY_REQUIRES_WEBHOOKS)
+    return {
+        "ready": ready,
+        "store_loaded": store_ready.is_set(),
+        "users": len(store),
+        "webhooks": webhook_status or "not configured",
+        "updates": "polling" if pollers else "webhook",
+        "queues": queues,
+        "startup": {k: round(v, 3) for k, v in startup_timings.items()},
+    }
 
-async def feed_update_to_dispatcher(dispatcher: Dispatcher, update_data: dict):
-    # aiogram Dispatcher has method feed_update in 3.x: use dispatcher.feed_update or process_update
-    # We'll call dispatcher.feed_update
+async def shutdown_step(name: str, coro):
+    # a failing step mustn't keep the later ones, or on_cleanup's flushes, from running
     try:
-        await dispatcher.feed_update(update_data)
-    except AttributeError:
-        # fallback
-        await dispatcher.process_update(types.Update(**update_data))
+        await coro
+    except Exception as e:
+        print(f"Shutdown: {name} failed:", e)
+
+# the leader writes the stats series; on_shutdown remembers it past the release
+saves_stats = False
+
+async def stop_background():
+    for t in background_tasks:
+        t.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+
+async def on_shutdown(app: web.Application):
+    global saves_stats
+    saves_stats = leader.is_leader
+    await shutdown_step("leader release", leader.release())
+    await shutdown_step("background tasks", stop_background())
+    # finish queued webhook jobs before the store is flushed and closed
+    await shutdown_step("update drain", asyncio.gather(access_updates.drain(), results_updates.drain()))
+    # polled updates handled by now are confirmed, so a restart doesn't get them again
+    await shutdown_step("poll offsets", asyncio.gather(*(p.commit() for p in pollers.values())))
+    await shutdown_step("webhook jobs", charge_jobs.drain(JOB_DRAIN_TIMEOUT))
+    await shutdown_step("admin digest", admin_digest.flush())
+
+async def on_cleanup(app: web.Application):
+    await store.close()
+    backend.close()
+    if ledger is not None:
+        ledger.flush()
+    if store_ready.is_set():
+        # not before it was loaded, or the saved cache would be wiped
+        processed_refs.save()
+        if saves_stats:
+            subscriptions.stats.save()
+    await http_client.close()
+    await asyncio.gather(*(b.session.close() for b in _bots.values()))
+
+async def feed_update_to_dispatcher(dispatcher: Dispatcher, bot: Bot, update_data: dict):
+    await store_ready.wait()
+    # aiogram 3.x: feed_raw_update validates the dict into types.Update
+    await dispatcher.feed_raw_update(bot, update_data)
+
+# updates are acked at once and run here: deduped by update_id, ordered per chat
+access_updates = UpdateExecutor(lambda u: feed_update_to_dispatcher(access_dp, access_bot(), u),
+                                max_inflight=UPDATE_MAX_INFLIGHT, name="access-bot")
+results_updates = UpdateExecutor(lambda u: feed_update_to_dispatcher(results_dp, results_bot(), u),
+                                 max_inflight=UPDATE_MAX_INFLIGHT, name="results-bot")
+
+def use_polling() -> bool:
+    if TELEGRAM_UPDATES in ("webhook", "polling"):
+        return TELEGRAM_UPDATES == "polling"
+    return not configured_public_url()
+
+# without a public URL, long-poll getUpdates into the same executors instead; in
+# the leader only, since Telegram allows one poller per bot
+pollers: Dict[str, UpdatePoller] = {}
+if use_polling():
+    for _name, _token, _updates in (("access", ACCESS_BOT_TOKEN, access_updates), ("results", RESULTS_BOT_TOKEN, results_updates)):
+        if _token:
+            pollers[_name] = UpdatePoller(_name, _token, _updates)
+            leader.add_job(pollers[_name].run)
 
 # aiohttp endpoints to receive telegram updates (webhooks)
 @routes.post("/results-bot-webhook")
 async def results_bot_webhook(req: web.Request):
     upd = await req.json()
     # feed into results dispatcher
-    await feed_update_to_dispatcher(results_dp, upd)
+    if not results_updates.submit(upd):
+        return web.Response(text="busy", status=503)
     return web.Response(text="ok")
 
 @routes.post("/access-bot-webhook")
 async def access_bot_webhook(req: web.Request):
     upd = await req.json()
-    await feed_update_to_dispatcher(access_dp, upd)
+    if not access_updates.submit(upd):
+        return web.Response(text="busy", status=503)
     return web.Response(text="ok")
 
 # wire routes
-app = web.Application()
+app = web.Application(middlewares=[timing_middleware, shedding_middleware(http_limiter, ip_buckets, ALWAYS_OPEN), readiness_gate])
 app.add_routes(routes)
 app.on_startup.append(on_startup)
+app.on_shutdown.append(on_shutdown)
+app.on_cleanup.append(on_cleanup)
+
+startup_timings["import"] = time.perf_counter() - _import_started
 
 # run
 if __name__ == "__main__":
@@ -0,0 +1,234 @@
+# bench/fake_servers.py
+# Local stand-ins for api.paystack.co and the Telegram Bot API, so the runner
+# can be driven without tokens or network. Both add configurable latency and
+# the Telegram one injects 429s at a given ratio.
+#
+#   python -m bench.fake_servers --paystack-port 18001 --telegram-port 18002 --latency 0.05 --rate-limit 0.01
+#
+# then start the runner with PAYSTACK_API_BASE=http://127.0.0.1:18001 and
+# TELEGRAM_API_BASE=http://127.0.0.1:18002.
+import time
+import random
+import asyncio
+import argparse
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+
+
+class _Latency:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+
+    async def wait(self):
+        d = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0.0)
+        if d > 0:
+            await asyncio.sleep(d)
+
+
+# --------------------
+# Paystack
+# --------------------
+class FakePaystack:
+    # transactions: {reference: {reference, status, amount, customer: {email}, paid_at, id}}
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, auto_success: bool = True, seed: Optional[int] = None):
+        self.delay = _Latency(latency, jitter, seed)
+        self.auto_success = auto_success   # unknown references verify as successful
+        self.transactions: Dict[str, Dict[str, Any]] = {}
+        self.calls: Counter = Counter()
+        self.app = web.Application()
+        self.app.router.add_get("/transaction/verify/{reference}", self.verify)
+        self.app.router.add_get("/transaction", self.list_transactions)
+        self.app.router.add_get("/_stats", self.stats)
+
+    def add(self, reference: str, email: str, amount: int, status: str = "success", **extra) -> Dict[str, Any]:
+        # amount in kobo, as Paystack reports it
+        tx = {
+            "id": len(self.transactions) + 1,
+            "reference": reference,
+            "status": status,
+            "amount": amount,
+            "customer": {"email": email},
+            "paid_at": extra.pop("paid_at", time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())),
+        }
+        tx.update(extra)
+        self.transactions[reference] = tx
+        return tx
+
+    async def verify(self, request: web.Request):
+        self.calls["verify"] += 1
+        await self.delay.wait()
+        ref = request.match_info["reference"]
+        tx = self.transactions.get(ref)
+        if tx is None and self.auto_success:
+            tx = {"reference": ref, "status": "success", "amount": 0, "customer": {"email": f"{ref}@bench.test"}}
+        if tx is None:
+            return web.json_response({"status": False, "message": "Transaction reference not found"}, status=400)
+        return web.json_response({"status": True, "message": "Verification successful", "data": tx})
+
+    async def list_transactions(self, request: web.Request):
+        # GET /transaction?perPage=&page=&status=&from=&to=  (newest first, like Paystack)
+        self.calls["list"] += 1
+        await self.delay.wait()
+        per_page = max(1, min(int(request.query.get("perPage", "50")), 1000))
+        page = max(1, int(request.query.get("page", "1")))
+        status = request.query.get("status")
+        since, until = request.query.get("from"), request.query.get("to")
+        # paid_at strings share one format, so they compare in time order
+        txs = [t for t in reversed(list(self.transactions.values()))
+               if (not status or t["status"] == status)
+               and (not since or t["paid_at"] >= since) and (not until or t["paid_at"] <= until)]
+        start = (page - 1) * per_page
+        return web.json_response({
+            "status": True,
+            "message": "Transactions retrieved",
+            "data": txs[start:start + per_page],
+            "meta": {"total": len(txs), "perPage": per_page, "page": page,
+                     "pageCount": (len(txs) + per_page - 1) // per_page},
+        })
+
+    async def stats(self, request: web.Request):
+        return web.json_response(dict(self.calls))
+
+
+# --------------------
+# Telegram Bot API
+# --------------------
+class FakeTelegram:
+    # answers POST /bot<token>/<method> the way api.telegram.org does, enough for aiogram
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, rate_limit: float = 0.0,
+                 retry_after: int = 1, seed: Optional[int] = None):
+        self.delay = _Latency(latency, jitter, seed)
+        self.rate_limit = rate_limit       # fraction of calls answered with 429
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.calls: Counter = Counter()
+        self.limited: Counter = Counter()
+        self.sent = 0
+        self.updates: Dict[str, list] = {}  # token -> queued updates for getUpdates
+        self.app = web.Application()
+        self.app.router.add_post("/bot{token}/{method}", self.handle)
+        self.app.router.add_get("/bot{token}/{method}", self.handle)
+        self.app.router.add_get("/_stats", self.stats)
+
+    async def _params(self, request: web.Request) -> Dict[str, Any]:
+        if request.content_type == "application/json":
+            return await request.json()
+        if request.method == "POST":
+            form = await request.post()
+            return {k: v for k, v in form.items() if isinstance(v, str)}
+        return dict(request.query)
+
+    def _message(self, chat_id: Any, text: str = "") -> Dict[str, Any]:
+        self.sent += 1
+        try:
+            cid = int(chat_id)
+        except (TypeError, ValueError):
+            cid = 0
+        return {
+            "message_id": self.sent,
+            "date": int(time.time()),
+            "chat": {"id": cid, "type": "supergroup" if cid < 0 else "private"},
+            "text": text,
+        }
+
+    async def handle(self, request: web.Request):
+        token = request.match_info["token"]
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        params = await self._params(request)
+        if method == "getUpdates":
+            return await self._get_updates(token, params)
+        await self.delay.wait()
+        if self.rate_limit and method.startswith("send") and self.rng.random() < self.rate_limit:
+            self.limited[method] += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+        return web.json_response({"ok": True, "result": self._result(token, method, params)})
+
+    def _result(self, token: str, method: str, params: Dict[str, Any]) -> Any:
+        if method == "getMe":
+            bot_id = int(token.split(":")[0]) if token.split(":")[0].isdigit() else 1
+            return {"id": bot_id, "is_bot": True, "first_name": "Bench", "username": f"bench_{bot_id}_bot"}
+        if method in ("sendMessage", "editMessageText", "sendPhoto", "sendDocument"):
+            return self._message(params.get("chat_id"), params.get("text") or params.get("caption") or "")
+        if method == "createChatInviteLink":
+            return {
+                "invite_link": f"https://t.me/+bench{self.calls[method]}",
+                "creator": {"id": 1, "is_bot": True, "first_name": "Bench"},
+                "creates_join_request": False,
+                "is_primary": False,
+                "is_revoked": False,
+                "member_limit": int(params.get("member_limit") or 1),
+            }
+        if method == "getWebhookInfo":
+            return {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        return True
+
+    def push_update(self, token: str, update: Dict[str, Any]):
+        self.updates.setdefault(token, []).append(update)
+
+    async def _get_updates(self, token: str, params: Dict[str, Any]):
+        queue = self.updates.setdefault(token, [])
+        offset = int(params.get("offset") or 0)
+        if offset:
+            # confirming an offset drops everything before it, as Telegram does
+            queue[:] = [u for u in queue if u["update_id"] >= offset]
+        limit = min(int(params.get("limit") or 100), 100)
+        timeout = float(params.get("timeout") or 0)
+        deadline = time.monotonic() + timeout
+        while not queue and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        return web.json_response({"ok": True, "result": queue[:limit]})
+
+    async def stats(self, request: web.Request):
+        return web.json_response({"calls": dict(self.calls), "rate_limited": dict(self.limited)})
+
+
+async def start_site(app: web.Application, host: str = "127.0.0.1", port: int = 0):
+    # returns (runner, base_url); port 0 picks a free one
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    sock = site._server.sockets[0]
+    return runner, f"http://{host}:{sock.getsockname()[1]}"
+
+
+async def _serve(args):
+    paystack = FakePaystack(args.latency, args.jitter, seed=args.seed)
+    telegram = FakeTelegram(args.latency, args.jitter, args.rate_limit, args.retry_after, seed=args.seed)
+    _, p_url = await start_site(paystack.app, args.host, args.paystack_port)
+    _, t_url = await start_site(telegram.app, args.host, args.telegram_port)
+    print("PAYSTACK_API_BASE=" + p_url)
+    print("TELEGRAM_API_BASE=" + t_url)
+    await asyncio.Event().wait()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Fake Paystack and Telegram Bot API servers")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--paystack-port", type=int, default=18001)
+    ap.add_argument("--telegram-port", type=int, default=18002)
+    ap.add_argument("--latency", type=float, default=0.0, help="base response latency, seconds")
+    ap.add_argument("--jitter", type=float, default=0.0, help="extra uniform latency, seconds")
+    ap.add_argument("--rate-limit", type=float, default=0.0, help="fraction of Telegram sends answered with 429")
+    ap.add_argument("--retry-after", type=int, default=1)
+    ap.add_argument("--seed", type=int, default=None)
+    try:
+        asyncio.run(_serve(ap.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
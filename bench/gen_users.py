@@ -0,0 +1,68 @@
+# bench/gen_users.py
+# Synthetic users.json for load tests, written as a stream so 1M users never sit in memory.
+#
+#   python -m bench.gen_users --users 100000 --out /tmp/bench/users.json
+#
+# user i: email user<i>@bench.test, reference bench-ref-<i>, chat_id 10_000_000 + i when linked.
+import os
+import json
+import time
+import random
+import argparse
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+CHAT_ID_BASE = 10_000_000
+
+
+def email_for(i: int) -> str:
+    return f"user{i}@bench.test"
+
+
+def reference_for(i: int) -> str:
+    return f"bench-ref-{i}"
+
+
+def make_user(i: int, now: int, rng: random.Random, linked_ratio: float = 0.7) -> Dict[str, Any]:
+    # expiries spread from 60 days ago to 30 days ahead, so filters and the expiry index see a mix
+    expires_at = now + rng.randint(-60 * 86400, 30 * 86400)
+    return {
+        "email": email_for(i),
+        "plan": "daily" if rng.random() < 0.6 else "weekend",
+        "paystack_reference": reference_for(i),
+        "expires_at": expires_at,
+        "active": expires_at > now,
+        "chat_id": CHAT_ID_BASE + i if rng.random() < linked_ratio else None,
+    }
+
+
+def write_users(path: Path, n: int, seed: int = 1, linked_ratio: float = 0.7, now: Optional[int] = None) -> Path:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    now = int(now or time.time())
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write("{")
+        for i in range(n):
+            u = make_user(i, now, rng, linked_ratio)
+            f.write(("," if i else "") + "\n" + json.dumps(u["email"]) + ": " + json.dumps(u))
+        f.write("\n}\n")
+    os.replace(tmp, path)
+    return path
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Generate a synthetic users.json")
+    ap.add_argument("--users", type=int, default=1000)
+    ap.add_argument("--out", default="data/users.json")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--linked-ratio", type=float, default=0.7)
+    args = ap.parse_args()
+    started = time.perf_counter()
+    p = write_users(Path(args.out), args.users, args.seed, args.linked_ratio)
+    print(f"Wrote {args.users} users to {p} ({p.stat().st_size / 1e6:.1f} MB) in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
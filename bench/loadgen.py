@@ -0,0 +1,84 @@
+# bench/loadgen.py
+# Open-loop load generator: requests are started on a fixed schedule at the
+# target rate whether or not earlier ones have finished, and latency is taken
+# from the scheduled start, so a stalled server shows up as latency instead of
+# quietly lowering the offered load.
+import math
+import time
+import asyncio
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    # nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, math.ceil(q / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+class Result:
+    def __init__(self, name: str, rps: float, duration: float):
+        self.name = name
+        self.rps = rps
+        self.duration = duration
+        self.latencies: List[float] = []
+        self.statuses: Counter = Counter()
+        self.dropped = 0          # not started because max_inflight was reached
+        self.elapsed = 0.0
+
+    def record(self, latency: float, status: Any):
+        self.latencies.append(latency)
+        self.statuses[str(status)] += 1
+
+    def summary(self) -> Dict[str, Any]:
+        lat = sorted(self.latencies)
+        ok = sum(c for s, c in self.statuses.items() if s.startswith("2") or s == "304")
+        return {
+            "scenario": self.name,
+            "target_rps": self.rps,
+            "requests": len(lat),
+            "ok": ok,
+            "errors": len(lat) - ok,
+            "dropped": self.dropped,
+            "statuses": dict(self.statuses),
+            "throughput": round(len(lat) / self.elapsed, 1) if self.elapsed else 0.0,
+            "p50_ms": round(percentile(lat, 50) * 1000, 2),
+            "p95_ms": round(percentile(lat, 95) * 1000, 2),
+            "p99_ms": round(percentile(lat, 99) * 1000, 2),
+            "max_ms": round(lat[-1] * 1000, 2) if lat else 0.0,
+        }
+
+
+async def drive(name: str, request: Callable[[int], Awaitable[Any]], rps: float, duration: float,
+                max_inflight: int = 1000) -> Result:
+    # request(i) performs one call and returns its status
+    result = Result(name, rps, duration)
+    total = int(rps * duration)
+    interval = 1.0 / rps
+    inflight = set()
+    start = time.perf_counter()
+
+    async def one(i: int, scheduled: float):
+        try:
+            status = await request(i)
+        except Exception as e:
+            status = type(e).__name__
+        result.record(time.perf_counter() - scheduled, status)
+
+    for i in range(total):
+        scheduled = start + i * interval
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(inflight) >= max_inflight:
+            result.dropped += 1
+            continue
+        t = asyncio.create_task(one(i, scheduled))
+        inflight.add(t)
+        t.add_done_callback(inflight.discard)
+    if inflight:
+        await asyncio.gather(*inflight)
+    result.elapsed = time.perf_counter() - start
+    return result
@@ -0,0 +1,115 @@
+# bench/reconcile.py
+# Offline check of the Paystack reconciliation job against the fake Paystack.
+#
+#   python -m bench.reconcile --users 100000 --missing 500 --lapsed 200
+#
+# The fake gets one successful transaction per synthetic user (already in the
+# store), `missing` recent payments from customers the store has never seen
+# (webhooks that never arrived) and `lapsed` ones whose period is already over.
+# A dry run, a real run and a second real run must find missing / apply
+# missing / find nothing. The second run rescans the real run's window (its
+# `from`), so it pages through the same transactions and has to recognise the
+# ones just applied; the run also reports pages and wall time.
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import aiohttp
+
+from bench.fake_servers import FakePaystack, start_site
+from bench.gen_users import email_for, reference_for, write_users
+from bench.run import ADMIN_KEY, DAILY_AMOUNT, Runner
+
+DAY = 86400
+
+
+def _paid_at(ts: float) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(ts))
+
+
+def seed_transactions(paystack: FakePaystack, users: int, missing: int, lapsed: int):
+    now = time.time()
+    # oldest first: the fake lists newest first, like Paystack
+    for i in range(lapsed):
+        paystack.add(f"bench-lapsed-{i}", f"lapsed{i}@bench.test", DAILY_AMOUNT * 100, paid_at=_paid_at(now - 29 * DAY - 3600 * 24))
+    for i in range(users):
+        paystack.add(reference_for(i), email_for(i), DAILY_AMOUNT * 100, paid_at=_paid_at(now - 20 * DAY + i % DAY))
+    for i in range(missing):
+        paystack.add(f"bench-missed-{i}", f"missed{i}@bench.test", DAILY_AMOUNT * 50, paid_at=_paid_at(now - 2 * DAY + i))
+
+
+async def _reconcile(s: aiohttp.ClientSession, base: str, dry_run: bool, since: Optional[str] = None) -> Dict[str, Any]:
+    params = {"dry_run": "1"} if dry_run else {}
+    if since:
+        params["since"] = since
+    async with s.post(base + "/admin/reconcile", params=params, headers={"x-admin-key": ADMIN_KEY}) as r:
+        body = await r.json()
+        if r.status != 200:
+            raise RuntimeError(f"/admin/reconcile: HTTP {r.status} {body}")
+        return body
+
+
+async def amain(args) -> int:
+    paystack = FakePaystack(args.paystack_latency, seed=1)
+    seed_transactions(paystack, args.users, args.missing, args.lapsed)
+    p_runner, p_url = await start_site(paystack.app)
+    failures = []
+    try:
+        with tempfile.TemporaryDirectory(prefix="stakeaware-reconcile-") as tmp:
+            data_dir = Path(tmp) / "data"
+            write_users(data_dir / "users.json", args.users, seed=1)
+            runner = Runner(data_dir, p_url, "http://127.0.0.1:9", args.backend, Path(tmp) / "app.log")
+            runner.env["RECONCILE_PER_PAGE"] = str(args.per_page)
+            runner.env["RECONCILE_CONCURRENCY"] = str(args.concurrency)
+            if args.backend == "sqlite":
+                runner.migrate()
+            try:
+                await runner.start()
+                timeout = aiohttp.ClientTimeout(total=600)
+                async with aiohttp.ClientSession(timeout=timeout) as s:
+                    applied = None
+                    for label, dry_run, expect in (("dry run", True, args.missing),
+                                                   ("apply", False, args.missing),
+                                                   ("again", False, 0)):
+                        # the cursor has moved past the applied run; rescan its window
+                        since = applied["from"] if label == "again" else None
+                        r = await _reconcile(s, runner.base_url, dry_run, since)
+                        print(f"  {label:<8} pages {r['pages']:>5}  transactions {r['transactions']:>8}  "
+                              f"missing {r['missing']:>6}  applied {r['applied']}  {r['seconds']:.2f}s")
+                        if r["missing"] != expect:
+                            failures.append(f"{label}: expected {expect} missing, got {r['missing']}")
+                        if not r["pages"]:
+                            failures.append(f"{label}: scanned no pages")
+                        if label == "apply":
+                            applied = r
+                        elif label == "again" and r["transactions"] != applied["transactions"]:
+                            failures.append(f"again: saw {r['transactions']} transactions, "
+                                            f"the applied run saw {applied['transactions']}")
+            finally:
+                runner.stop()
+    finally:
+        await p_runner.cleanup()
+    print(f"paystack: {dict(paystack.calls)}")
+    for f in failures:
+        print("FAILED", f)
+    return 1 if failures else 0
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Check Paystack reconciliation against the fake Paystack")
+    ap.add_argument("--users", type=int, default=10000)
+    ap.add_argument("--missing", type=int, default=500)
+    ap.add_argument("--lapsed", type=int, default=200)
+    ap.add_argument("--per-page", type=int, default=100)
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    ap.add_argument("--paystack-latency", type=float, default=0.05)
+    sys.exit(asyncio.run(amain(ap.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
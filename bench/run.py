@@ -0,0 +1,366 @@
+# bench/run.py
+# Offline load test of app.py against the fake Paystack / Telegram servers.
+#
+#   python -m bench.run --users 1000 100000 --duration 10
+#   python -m bench.run --users 100000 --record          # store as the new baseline
+#
+# For each user count: generate a synthetic users.json in a temp DATA_DIR,
+# start app.py as a subprocess pointed at the fakes, drive each scenario at the
+# target rate and report p50/p95/p99, throughput and the runner's peak RSS.
+# Results are compared with bench/baselines.json; a regression beyond
+# --tolerance exits non-zero. Baselines are machine specific, record them on
+# the box the comparison runs on.
+import os
+import sys
+import json
+import hmac
+import time
+import socket
+import asyncio
+import hashlib
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import aiohttp
+
+from bench.fake_servers import FakePaystack, FakeTelegram, start_site
+from bench.gen_users import CHAT_ID_BASE, email_for, reference_for, write_users
+from bench.loadgen import drive
+from services.user_query import encode_cursor
+
+ROOT = Path(__file__).resolve().parent.parent
+BASELINES = Path(__file__).resolve().parent / "baselines.json"
+
+WEBHOOK_SECRET = "bench-webhook-secret"
+ADMIN_KEY = "bench-admin-key"
+ACCESS_TOKEN = "1000001:bench-access"
+RESULTS_TOKEN = "1000002:bench-results"
+DAILY_AMOUNT = 50000   # naira, matches the runner's DAILY_PLAN_AMOUNT default
+
+# default target rates; link_telegram DMs every user, so it is bounded by Telegram's ~30 msg/s
+DEFAULT_RPS = {"paystack_webhook": 200, "link_telegram": 25, "admin_users": 200, "bot_updates": 200}
+
+# compared against the baseline: field -> True when higher is worse
+CHECKED = {"p95_ms": True, "p99_ms": True, "throughput": False, "peak_rss_mb": True}
+LATENCY_SLACK_MS = 2.0   # absolute slack so sub-millisecond noise is not a regression
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _proc_status(pid: int) -> Dict[str, float]:
+    # VmHWM is the peak resident set size so far; Linux only
+    out = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(("VmHWM:", "VmRSS:")):
+                    k, v = line.split(":", 1)
+                    out[k] = int(v.split()[0]) / 1024.0   # kB -> MB
+    except OSError:
+        pass
+    return out
+
+
+class Runner:
+    # app.py in a subprocess with its data dir and upstreams pointed at the bench
+
+    def __init__(self, data_dir: Path, paystack_url: str, telegram_url: str, backend: str, log_path: Path):
+        self.data_dir = data_dir
+        self.port = _free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.env = dict(os.environ)
+        self.env.update({
+            "PORT": str(self.port),
+            "DATA_DIR": str(data_dir),
+            "STORAGE_BACKEND": backend,
+            "PAYSTACK_API_BASE": paystack_url,
+            "TELEGRAM_API_BASE": telegram_url,
+            "PAYSTACK_SECRET_KEY": "sk_test_bench",
+            "PAYSTACK_WEBHOOK_SECRET": WEBHOOK_SECRET,
+            "BACKEND_ADMIN_KEY": ADMIN_KEY,
+            "ACCESS_BOT_TOKEN": ACCESS_TOKEN,
+            "RESULTS_BOT_TOKEN": RESULTS_TOKEN,
+            "DAILY_GROUP_ID": "-1001",
+            "WEEKEND_GROUP_ID": "-1002",
+            "DAILY_PLAN_AMOUNT": str(DAILY_AMOUNT),
+            "PYTHONPATH": str(ROOT),
+            # no webhook registration or self-pings during a run
+            "PUBLIC_URL": "",
+            "BACKEND_BASE_URL": "",
+            "BACKEND_URL": "",
+            "SELF_PING_INTERVAL": "86400",
+            # reminders for the synthetic expiries would otherwise compete with the measured sends
+            "EXPIRY_ALERT_DAYS": "0",
+            # reconciliation is exercised by bench/reconcile.py instead
+            "RECONCILE_INTERVAL": "0",
+            # every request comes from one address and a few chats; per-source limits would refuse most
+            "IP_RATE": "0",
+            "CHAT_LINK_RATE": "0",
+        })
+        self.log_path = log_path
+        self.proc: Optional[subprocess.Popen] = None
+        self.startup_seconds = 0.0
+
+    def migrate(self):
+        subprocess.run([sys.executable, "-m", "services.migrate"], cwd=ROOT, env=self.env, check=True,
+                       stdout=subprocess.DEVNULL)
+
+    async def start(self, timeout: float = 600.0):
+        started = time.perf_counter()
+        self._log = open(self.log_path, "w")
+        self.proc = subprocess.Popen([sys.executable, str(ROOT / "app.py")], cwd=ROOT, env=self.env,
+                                     stdout=self._log, stderr=subprocess.STDOUT)
+        async with aiohttp.ClientSession() as s:
+            while time.perf_counter() - started < timeout:
+                if self.proc.poll() is not None:
+                    raise RuntimeError(f"app.py exited with {self.proc.returncode}; see {self.log_path}")
+                try:
+                    async with s.get(self.base_url + "/readyz") as r:
+                        if r.status == 200:
+                            self.startup_seconds = time.perf_counter() - started
+                            return
+                except aiohttp.ClientError:
+                    pass
+                await asyncio.sleep(0.1)
+        raise RuntimeError(f"app.py did not come up within {timeout}s; see {self.log_path}")
+
+    def memory(self) -> Dict[str, float]:
+        return _proc_status(self.proc.pid) if self.proc else {}
+
+    def stop(self):
+        if self.proc and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(30)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        if getattr(self, "_log", None):
+            self._log.close()
+
+
+# --------------------
+# Scenarios: each returns request(i) -> status
+# --------------------
+# webhook renewals replace a user's reference, so they use the upper half of the
+# synthetic users and link_telegram the lower half
+def paystack_webhook(s: aiohttp.ClientSession, base: str, users: int, paystack: FakePaystack, run_id: str):
+    half = users // 2
+
+    def request(i: int) -> Awaitable[Any]:
+        ref = f"bench-pay-{run_id}-{i}"
+        # every third charge is a new customer, the rest renew existing users
+        email = email_for(half + i % (users - half)) if users and i % 3 else f"new-{run_id}-{i}@bench.test"
+        amount = DAILY_AMOUNT * 100 if i % 2 else DAILY_AMOUNT * 50
+        paystack.add(ref, email, amount)
+        body = json.dumps({"event": "charge.success", "data": {
+            "reference": ref, "amount": amount, "customer": {"email": email}}}).encode()
+        sig = hmac.new(WEBHOOK_SECRET.encode(), body, hashlib.sha512).hexdigest()
+        return _status(s.post(base + "/paystack/webhook", data=body,
+                              headers={"x-paystack-signature": sig, "Content-Type": "application/json"}))
+    return request
+
+
+def link_telegram(s: aiohttp.ClientSession, base: str, users: int, paystack: FakePaystack, run_id: str):
+    def request(i: int) -> Awaitable[Any]:
+        j = (i * 7919) % max(users // 2, 1)
+        return _status(s.post(base + "/link_telegram",
+                              json={"reference": reference_for(j), "chat_id": CHAT_ID_BASE + j}))
+    return request
+
+
+def admin_users(s: aiohttp.ClientSession, base: str, users: int, paystack: FakePaystack, run_id: str):
+    headers = {"x-admin-key": ADMIN_KEY, "Accept-Encoding": "gzip"}
+
+    def request(i: int) -> Awaitable[Any]:
+        j = (i * 7919) % max(users, 1)
+        params = (
+            {"limit": "100"},
+            {"plan": "daily", "active": "true", "limit": "100"},
+            {"linked": "false", "limit": "50"},
+            {"limit": "100", "cursor": encode_cursor(email_for(j))},
+        )[i % 4]
+        return _status(s.get(base + "/admin/users", params=params, headers=headers))
+    return request
+
+
+def bot_updates(s: aiohttp.ClientSession, base: str, users: int, paystack: FakePaystack, run_id: str):
+    first_id = int(time.time() * 1000) % 1_000_000_000
+
+    def request(i: int) -> Awaitable[Any]:
+        chat_id = CHAT_ID_BASE + (i * 7919) % max(users, 1)
+        user = {"id": chat_id, "is_bot": False, "first_name": "Bench"}
+        update = {"update_id": first_id + i, "callback_query": {
+            "id": str(i), "from": user, "chat_instance": str(chat_id), "data": "status",
+            "message": {"message_id": i + 1, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}},
+        }}
+        return _status(s.post(base + "/access-bot-webhook", json=update))
+    return request
+
+
+SCENARIOS: Dict[str, Callable] = {
+    "paystack_webhook": paystack_webhook,
+    "link_telegram": link_telegram,
+    "admin_users": admin_users,
+    "bot_updates": bot_updates,
+}
+
+
+async def _status(ctx) -> int:
+    async with ctx as r:
+        await r.read()
+        return r.status
+
+
+async def _wait_idle(s: aiohttp.ClientSession, base: str, timeout: float = 60.0):
+    # let queued background work finish so it does not bleed into the next scenario
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with s.get(base + "/admin/queue_stats", headers={"x-admin-key": ADMIN_KEY}) as r:
+                q = await r.json()
+            if all((v.get("depth") or v.get("pending") or 0) == 0 for v in q.values()):
+                return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+
+
+# --------------------
+# Baselines
+# --------------------
+def load_baselines() -> Dict[str, Dict[str, Any]]:
+    if BASELINES.exists():
+        return json.loads(BASELINES.read_text(encoding="utf-8"))
+    return {}
+
+
+def compare(summary: Dict[str, Any], base: Optional[Dict[str, Any]], tolerance: float) -> List[str]:
+    if not base:
+        return []
+    problems = []
+    for field, higher_is_worse in CHECKED.items():
+        old, new = base.get(field), summary.get(field)
+        if old is None or new is None:
+            continue
+        if higher_is_worse:
+            limit = old * (1 + tolerance) + (LATENCY_SLACK_MS if field.endswith("_ms") else 0)
+            if new > limit:
+                problems.append(f"{field} {new} > {old} (+{tolerance:.0%})")
+        elif new < old * (1 - tolerance):
+            problems.append(f"{field} {new} < {old} (-{tolerance:.0%})")
+    return problems
+
+
+def _print_row(r: Dict[str, Any]):
+    print(f"  {r['scenario']:<18} {r['requests']:>7} req  {r['throughput']:>8} req/s  "
+          f"p50 {r['p50_ms']:>8} ms  p95 {r['p95_ms']:>8} ms  p99 {r['p99_ms']:>8} ms  "
+          f"err {r['errors']:>5}  drop {r['dropped']:>5}  rss {r.get('peak_rss_mb', 0):>7.1f} MB")
+
+
+# --------------------
+# Main
+# --------------------
+async def bench_users(n: int, args, paystack: FakePaystack, p_url: str, t_url: str) -> List[Dict[str, Any]]:
+    results = []
+    with tempfile.TemporaryDirectory(prefix=f"stakeaware-bench-{n}-") as tmp:
+        data_dir = Path(tmp) / "data"
+        started = time.perf_counter()
+        write_users(data_dir / "users.json", n, seed=args.seed)
+        print(f"{n} users: generated in {time.perf_counter() - started:.1f}s")
+        runner = Runner(data_dir, p_url, t_url, args.backend, Path(tmp) / "app.log")
+        if args.backend == "sqlite":
+            runner.migrate()
+        try:
+            await runner.start()
+            print(f"  startup {runner.startup_seconds:.2f}s, rss {runner.memory().get('VmRSS', 0):.1f} MB")
+            run_id = str(int(time.time()))
+            connector = aiohttp.TCPConnector(limit=args.connections)
+            timeout = aiohttp.ClientTimeout(total=args.timeout)
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as s:
+                for name in args.scenarios:
+                    request = SCENARIOS[name](s, runner.base_url, n, paystack, run_id)
+                    res = await drive(name, request, args.rps or DEFAULT_RPS[name], args.duration, args.max_inflight)
+                    await _wait_idle(s, runner.base_url)
+                    summary = res.summary()
+                    summary["users"] = n
+                    summary["backend"] = args.backend
+                    summary["peak_rss_mb"] = round(runner.memory().get("VmHWM", 0.0), 1)
+                    summary["startup_s"] = round(runner.startup_seconds, 2)
+                    _print_row(summary)
+                    results.append(summary)
+        finally:
+            runner.stop()
+            if args.keep_logs:
+                dest = Path(args.keep_logs) / f"app-{n}.log"
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                dest.write_bytes((Path(tmp) / "app.log").read_bytes())
+    return results
+
+
+async def amain(args) -> int:
+    paystack = FakePaystack(args.paystack_latency, args.jitter, seed=args.seed)
+    telegram = FakeTelegram(args.telegram_latency, args.jitter, args.rate_limit, seed=args.seed)
+    p_runner, p_url = await start_site(paystack.app)
+    t_runner, t_url = await start_site(telegram.app)
+    all_results: List[Dict[str, Any]] = []
+    try:
+        for n in args.users:
+            all_results.extend(await bench_users(n, args, paystack, p_url, t_url))
+    finally:
+        await p_runner.cleanup()
+        await t_runner.cleanup()
+    print(f"telegram: {dict(telegram.calls)} rate limited: {dict(telegram.limited)}; paystack: {dict(paystack.calls)}")
+
+    if args.out:
+        Path(args.out).write_text(json.dumps(all_results, indent=2), encoding="utf-8")
+
+    baselines = load_baselines()
+    key = lambda r: f"{r['scenario']}@{r['users']}/{r['backend']}"
+    if args.record:
+        for r in all_results:
+            baselines[key(r)] = {f: r[f] for f in ("p50_ms", "p95_ms", "p99_ms", "throughput", "peak_rss_mb",
+                                                   "startup_s", "target_rps")}
+        BASELINES.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+        print("Recorded", len(all_results), "baseline(s) in", BASELINES)
+        return 0
+
+    regressions = 0
+    for r in all_results:
+        problems = compare(r, baselines.get(key(r)), args.tolerance)
+        for p in problems:
+            print(f"REGRESSION {key(r)}: {p}")
+        regressions += len(problems)
+    return 1 if regressions else 0
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Offline load test for the StakeAware runner")
+    ap.add_argument("--users", type=int, nargs="+", default=[1000])
+    ap.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    ap.add_argument("--rps", type=float, default=None, help="target rate for every scenario (default: per scenario)")
+    ap.add_argument("--duration", type=float, default=10, help="seconds per scenario")
+    ap.add_argument("--max-inflight", type=int, default=1000)
+    ap.add_argument("--connections", type=int, default=200)
+    ap.add_argument("--timeout", type=float, default=10, help="per-request timeout, seconds")
+    ap.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    ap.add_argument("--paystack-latency", type=float, default=0.05)
+    ap.add_argument("--telegram-latency", type=float, default=0.03)
+    ap.add_argument("--jitter", type=float, default=0.02)
+    ap.add_argument("--rate-limit", type=float, default=0.0, help="fraction of Telegram sends answered with 429")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--tolerance", type=float, default=0.25)
+    ap.add_argument("--record", action="store_true", help="write the results to bench/baselines.json")
+    ap.add_argument("--out", help="also write raw results as JSON here")
+    ap.add_argument("--keep-logs", help="copy each runner's log into this directory")
+    sys.exit(asyncio.run(amain(ap.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
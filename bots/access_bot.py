@@ -1,53 +1,48 @@
 # bots/access_bot.py
 import os
-import json
-import requests
 from aiogram import types
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+from services import http_client
+from services.storage import get_backend
+
 BACKEND_BASE = os.getenv("BACKEND_BASE_URL")
 BACKEND_ADMIN_KEY = os.getenv("BACKEND_ADMIN_KEY", "")
 
-USERS_FILE = "data/users.json"
-os.makedirs("data", exist_ok=True)
-
 def _load_users():
-    try:
-        with open(USERS_FILE, "r") as f:
-            return json.load(f)
-    except Exception:
-        return {}
+    return get_backend().load_users()
 
 def _save_users(u):
-    with open(USERS_FILE, "w") as f:
-        json.dump(u, f, indent=2)
+    get_backend().replace_users(u)
 
 def register_handlers(dp, bot):
     # Aiogram 3.x style
     dp.message.register(start_cmd, Command(commands=["start"]))
     dp.message.register(status_cmd, Command(commands=["status"]))
+    # shared HTTP client is created on first use; close it with the dispatcher
+    dp.shutdown.register(http_client.close)
 
-async def start_cmd(message: types.Message):
-    args = message.get_args()  # deep-link argument if present
+async def start_cmd(message: types.Message, command: CommandObject):
+    args = command.args  # deep-link argument if present
     keyboard = InlineKeyboardBuilder().button(text="ℹ️ Check Status", callback_data="status").as_markup()
     
     if args:
         ref = args.strip()
         try:
-            resp = requests.post(
+            async with http_client.get_session().post(
                 f"{BACKEND_BASE}/link_telegram",
-                json={"reference": ref, "chat_id": message.chat.id},
-                timeout=8
-            )
-            if resp.status_code == 200:
+                json={"reference": ref, "chat_id": message.chat.id}
+            ) as resp:
+                text = await resp.text()
+            if resp.status == 200:
                 await message.answer(
                     "✅ Payment reference linked. You now have access if the payment is valid.",
                     reply_markup=keyboard
                 )
                 return
             else:
-                await message.answer(f"❌ Could not link reference: {resp.text}", reply_markup=keyboard)
+                await message.answer(f"❌ Could not link reference: {text}", reply_markup=keyboard)
                 return
         except Exception as e:
             await message.answer(f"❌ Error connecting to backend: {e}", reply_markup=keyboard)
@@ -66,20 +61,21 @@ async def status_cmd(message: types.Message):
         if BACKEND_ADMIN_KEY:
             headers["x-admin-key"] = BACKEND_ADMIN_KEY
 
-        resp = requests.get(f"{BACKEND_BASE}/admin/users", headers=headers, timeout=8)
-        if resp.status_code != 200:
+        # O(1) lookup by chat id instead of downloading every user
+        async with http_client.get_session().get(
+            f"{BACKEND_BASE}/admin/users/by_chat/{message.chat.id}", headers=headers
+        ) as resp:
+            u = await resp.json() if resp.status == 200 else None
+        if resp.status == 404:
+            await message.answer("❌ No active subscription found for this account.")
+            return
+        if u is None:
             await message.answer("Could not fetch status from backend.")
             return
 
-        users = resp.json()
-        for email, u in users.items():
-            if int(u.get("chat_id", 0)) == message.chat.id:
-                await message.answer(
-                    f"✅ Active plan: {u.get('plan')} | Expires at (UTC): {u.get('expires_at')}"
-                )
-                return
-
-        await message.answer("❌ No active subscription found for this account.")
+        await message.answer(
+            f"✅ Active plan: {u.get('plan')} | Expires at (UTC): {u.get('expires_at')}"
+        )
 
     except Exception as e:
         await message.answer(f"Error fetching status: {e}")
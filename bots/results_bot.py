@@ -1,10 +1,14 @@
 # bots/results_bot.py
 import os
-from datetime import datetime
+import time
 from aiogram import types
 from aiogram.filters import Command
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
+from services.broadcast import broadcaster_for
+from services.games import GameSlip
+from services.publisher import load_plan_days, load_routes, route
+
 ADMIN_IDS = [int(x) for x in os.getenv("ADMIN_TELEGRAM_IDS", "").split(",") if x.strip()]
 DAILY_GROUP_ID = int(os.getenv("DAILY_GROUP_ID", "0"))
 WEEKEND_GROUP_ID = int(os.getenv("WEEKEND_GROUP_ID", "0"))
@@ -12,7 +16,9 @@ DAILY_GROUP_LINK = os.getenv("DAILY_GROUP_LINK")
 WEEKEND_GROUP_LINK = os.getenv("WEEKEND_GROUP_LINK")
 
 # in-memory store (cleared after posting)
-games = []
+games = GameSlip()
+
+SLIP_TITLE = "🎯 *STAKEAWARE OFFICIAL PREDICTION FOR THE DAY*\n"
 
 def _is_admin(user_id: int) -> bool:
     return user_id in ADMIN_IDS
@@ -69,18 +75,15 @@ async def handle_menu(callback: types.CallbackQuery):
             return
 
         msg = format_games_list()
-        day = datetime.utcnow().weekday()  # Monday=0 .. Sunday=6
-        targets = [DAILY_GROUP_ID]
-        if day in [4, 5, 6]:  # Fri-Sun
-            targets.append(WEEKEND_GROUP_ID)
+        # same plan -> groups routing (and UTC weekdays) as the scheduled publisher
+        targets = route(load_routes(), load_plan_days(), time.time())
 
         sent = 0
-        for gid in targets:
-            try:
-                await callback.bot.send_message(chat_id=gid, text=msg, parse_mode="Markdown")
+        for r in await broadcaster_for(callback.bot).broadcast(targets, msg, parse_mode="Markdown"):
+            if r["ok"]:
                 sent += 1
-            except Exception as e:
-                print("Failed posting to", gid, e)
+            else:
+                print("Failed posting to", r["chat_id"], r["error"])
 
         games.clear()
         await callback.message.edit_text(f"✅ Results posted to {sent} group(s).", reply_markup=main_menu_kb())
@@ -91,29 +94,8 @@ async def add_game_message(message: types.Message):
     if not _is_admin(message.from_user.id):
         return
     text = message.text.strip()
-    games.append(text)
+    games.add(text)
     await message.reply(f"✅ Game added:\n*{text}*", parse_mode="Markdown")
 
 def format_games_list():
-    if not games:
-        return "📭 No games added yet."
-
-    lines = ["🎯 *STAKEAWARE OFFICIAL PREDICTION FOR THE DAY*\n"]
-    total = 1.0
-    for i, g in enumerate(games, start=1):
-        toks = g.strip().split()
-        odds = None
-        for t in reversed(toks):
-            try:
-                odds = float(t.replace(",", "."))
-                break
-            except:
-                continue
-        if odds:
-            total *= odds
-        lines.append(f"{i}. *{g}*")
-
-    total_text = f"{total:.2f}" if total != 1.0 else "—"
-    lines.append(f"\n💰 *Total Odds:* {total_text}")
-    lines.append("\n🔥 Play Responsibly 🔥")
-    return "\n".join(lines)
+    return games.render(SLIP_TITLE, show_odds=False)
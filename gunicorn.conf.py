@@ -0,0 +1,23 @@
+# gunicorn.conf.py
+# Several aiohttp workers over one data directory:
+#
+#   WEB_CONCURRENCY=4 gunicorn app:app -c gunicorn.conf.py
+#
+# Workers share the user store and elect one leader for the background jobs
+# (services/cluster.py). STORAGE_BACKEND=sqlite is the better fit for more
+# than a couple of workers.
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '10000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = "aiohttp.GunicornWebWorker"
+# app.py must be imported after the fork so each worker opens its own
+# database connection and knows its own pid
+preload_app = False
+timeout = 60
+graceful_timeout = 30
+
+
+def post_fork(server, worker):
+    # services/cluster.py reads the worker count; keep it right when -w overrides the config
+    os.environ["WEB_CONCURRENCY"] = str(server.cfg.workers)
@@ -0,0 +1,156 @@
+# services/broadcast.py
+# Concurrent Telegram sends within the Bot API rate limits.
+#
+# Each bot gets one Broadcaster with a global token bucket (~30 msg/s) and a
+# bucket per chat (1 msg/s for private chats, 20 msg/min for groups). Sends run
+# concurrently and each waits only for its own budget; a 429 pauses the chat for the
+# advertised retry_after, and network / server errors are retried with jitter.
+# send_many() returns one result dict per recipient:
+#   {"chat_id", "ok", "attempts", "error", "message", "permanent"}
+# permanent: Telegram refused the chat itself (bot blocked, chat not found), so
+# sending again later won't help either
+import os
+import time
+import random
+import asyncio
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from aiogram.exceptions import (TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError,
+                                TelegramRetryAfter, TelegramServerError)
+
+from services import cluster, metrics
+
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "30"))         # msg/s per bot
+TG_CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))             # msg/s per private chat
+TG_GROUP_PER_MIN = float(os.getenv("TG_GROUP_PER_MIN", "20"))     # msg/min per group
+TG_SEND_CONCURRENCY = int(os.getenv("TG_SEND_CONCURRENCY", "50"))
+TG_SEND_ATTEMPTS = int(os.getenv("TG_SEND_ATTEMPTS", "4"))
+
+MAX_CHAT_BUCKETS = 10000
+
+
+class TokenBucket:
+    # reservation style: tokens may go negative, which queues callers into the future
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, n: float = 1) -> float:
+        # take n tokens; returns how long to wait before using them
+        self._refill()
+        self.tokens -= n
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def try_take(self, n: float = 1) -> bool:
+        self._refill()
+        if self.tokens >= n:
+            self.tokens -= n
+            return True
+        return False
+
+    def pause(self, seconds: float):
+        # no token for `seconds`: the next acquire() waits at least that long
+        self._refill()
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+    async def acquire(self, n: float = 1):
+        delay = self.reserve(n)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def idle(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class Broadcaster:
+    def __init__(self, bot):
+        self.bot = bot
+        self.name = str(getattr(bot, "id", "") or id(bot))
+        # the per-bot limit is shared by every worker process
+        rate = TG_GLOBAL_RATE / cluster.WORKERS
+        self.global_bucket = TokenBucket(rate, rate)
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        self.sem = asyncio.Semaphore(TG_SEND_CONCURRENCY)
+        self.sent = 0
+        self.failed = 0
+        self.rate_limited = 0
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        b = self.chat_buckets.get(chat_id)
+        if b is None:
+            if len(self.chat_buckets) >= MAX_CHAT_BUCKETS:
+                # forget chats whose budget has fully refilled
+                for cid in [c for c, bk in self.chat_buckets.items() if bk.idle()]:
+                    del self.chat_buckets[cid]
+            if chat_id < 0:
+                b = TokenBucket(TG_GROUP_PER_MIN / 60.0, 1)
+            else:
+                b = TokenBucket(TG_CHAT_RATE, 1)
+            self.chat_buckets[chat_id] = b
+        return b
+
+    async def send(self, chat_id: int, text: str, **kwargs) -> Dict[str, Any]:
+        chat_id = int(chat_id)
+        result = {"chat_id": chat_id, "ok": False, "attempts": 0, "error": None, "message": None, "permanent": False}
+        while result["attempts"] < TG_SEND_ATTEMPTS:
+            result["attempts"] += 1
+            # wait for the chat's budget first so a busy chat doesn't hold global tokens
+            await self._chat_bucket(chat_id).acquire()
+            await self.global_bucket.acquire()
+            try:
+                # the semaphore caps calls in flight; it's not held while waiting on the buckets,
+                # or sends to slow group chats would block every DM behind them
+                async with self.sem:
+                    start = time.perf_counter()
+                    result["message"] = await self.bot.send_message(chat_id, text, **kwargs)
+                    metrics.TG_SEND_LATENCY.observe(time.perf_counter() - start, bot=self.name)
+                result["ok"] = True
+                result["error"] = None
+                self.sent += 1
+                return result
+            except TelegramRetryAfter as e:
+                metrics.TG_SEND_429.inc(bot=self.name)
+                self.rate_limited += 1
+                result["error"] = str(e)
+                # honour retry_after: every pending send to this chat waits it out
+                self._chat_bucket(chat_id).pause(e.retry_after)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                metrics.TG_SEND_ERRORS.inc(bot=self.name, kind=type(e).__name__)
+                result["error"] = str(e)
+                await asyncio.sleep(random.uniform(0.5, 1.5) * (2 ** (result["attempts"] - 1)))
+            except Exception as e:
+                # blocked bot, bad chat id, malformed markup: retrying won't help
+                metrics.TG_SEND_ERRORS.inc(bot=self.name, kind=type(e).__name__)
+                result["error"] = str(e)
+                result["permanent"] = isinstance(e, (TelegramForbiddenError, TelegramBadRequest))
+                break
+        self.failed += 1
+        return result
+
+    async def send_many(self, messages: Sequence[Tuple[int, str, Optional[Dict[str, Any]]]]) -> List[Dict[str, Any]]:
+        # messages: [(chat_id, text, kwargs or None)]; results come back in the same order
+        return await asyncio.gather(*(self.send(cid, text, **(kw or {})) for cid, text, kw in messages))
+
+    async def broadcast(self, chat_ids: Sequence[int], text: str, **kwargs) -> List[Dict[str, Any]]:
+        return await self.send_many([(cid, text, kwargs) for cid in chat_ids])
+
+    def stats(self) -> Dict[str, Any]:
+        return {"sent": self.sent, "failed": self.failed, "rate_limited": self.rate_limited}
+
+
+_broadcasters: Dict[int, Broadcaster] = {}
+
+def broadcaster_for(bot) -> Broadcaster:
+    # one per bot, since Telegram's limits are per bot token
+    b = _broadcasters.get(id(bot))
+    if b is None:
+        b = _broadcasters[id(bot)] = Broadcaster(bot)
+    return b
@@ -0,0 +1,117 @@
+# services/cache.py
+import json
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from services.storage import FileLock, atomic_write
+
+
+class TTLCache:
+    # bounded LRU with per-entry expiry; optionally saved to / restored from a JSON file.
+    # shared=True is for several processes saving the same file: each save merges what is
+    # already there under a file lock, so one worker's save doesn't drop the others' entries
+
+    def __init__(self, maxsize: int, ttl: float, path: Optional[Path] = None, shared: bool = False):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = Path(path) if path else None
+        self.shared = shared
+        self._lock = FileLock(self.path.with_name(self.path.name + ".lock")) if self.path and shared else None
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()   # key -> (expires_at, value)
+        self._dirty = False
+
+    def get(self, key: str) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        expires_at, value = item
+        if expires_at < time.time():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def __contains__(self, key: str) -> bool:
+        item = self._data.get(key)
+        return item is not None and item[0] >= time.time()
+
+    def set(self, key: str, value: Any = True):
+        self._data[key] = (time.time() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+        self._dirty = True
+
+    def discard(self, key: str):
+        if self._data.pop(key, None) is not None:
+            self._dirty = True
+
+    def clear(self):
+        self._data.clear()
+        self._dirty = True
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+    # --------------------
+    # Persistence
+    # --------------------
+    def _read(self) -> list:
+        if not self.path.exists():
+            return []
+        try:
+            return json.loads(self.path.read_text(encoding="utf-8"))
+        except Exception as e:
+            print("Could not read cache", self.path, e)
+            return []
+
+    def load(self):
+        if not self.path:
+            return
+        if self._lock is not None:
+            with self._lock:
+                rows = self._read()
+        else:
+            rows = self._read()
+        now = time.time()
+        # rows are saved oldest first, so re-inserting keeps the LRU order
+        for key, expires_at, value in rows:
+            if expires_at >= now:
+                self._data[key] = (expires_at, value)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def save(self):
+        if not self.path or not self._dirty:
+            return
+        now = time.time()
+        rows = [[k, exp, v] for k, (exp, v) in self._data.items() if exp >= now]
+        if self._lock is None:
+            atomic_write(self.path, json.dumps(rows, ensure_ascii=False))
+        else:
+            with self._lock:
+                merged = {k: (exp, v) for k, exp, v in self._read() if exp >= now}
+                for k, exp, v in rows:
+                    if k not in merged or merged[k][0] < exp:
+                        merged[k] = (exp, v)
+                # oldest first, as load() expects; the newest maxsize survive
+                rows = sorted(([k, exp, v] for k, (exp, v) in merged.items()), key=lambda r: r[1])[-self.maxsize:]
+                atomic_write(self.path, json.dumps(rows, ensure_ascii=False))
+        self._dirty = False
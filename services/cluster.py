@@ -0,0 +1,107 @@
+# services/cluster.py
+# Running several aiohttp worker processes over the same data directory.
+#
+# WEB_CONCURRENCY (the variable gunicorn reads for its worker count) > 1 turns
+# on multi-worker mode: the user store writes through under a cross-process
+# lock and pulls other workers' writes (services/user_store.py), and the
+# background jobs that must run once per deployment (expiry reminders,
+# self-ping, compaction) run only in the worker holding the leader lease.
+#
+# The lease lives in the storage backend with an expiry. The leader renews it
+# every ttl/3; if it dies, another worker takes over once the lease lapses. A
+# leader that cannot renew steps down before its lease could be taken, so two
+# workers never run the singleton jobs at once.
+import os
+import time
+import socket
+import asyncio
+from typing import Awaitable, Callable, List, Optional
+
+WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+MULTI_WORKER = WORKERS > 1
+LEADER_LEASE_TTL = float(os.getenv("LEADER_LEASE_TTL", "15"))   # seconds
+
+
+def worker_id() -> str:
+    # evaluated late: gunicorn forks workers after import when preload_app is on
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class LeaderElection:
+    def __init__(self, backend, name: str = "leader", ttl: float = LEADER_LEASE_TTL):
+        self.backend = backend
+        self.name = name
+        self.ttl = ttl
+        self.holder: Optional[str] = None
+        self.is_leader = False
+        self.elections = 0
+        self.valid_until = 0.0
+        self.on_elected: List[Callable[[], None]] = []
+        self._jobs: List[Callable[[], Awaitable[None]]] = []
+        self._tasks: List[asyncio.Task] = []
+        self._stopped = False
+
+    def add_job(self, factory: Callable[[], Awaitable[None]]):
+        # factory() returns the coroutine to run while this process leads
+        self._jobs.append(factory)
+
+    def stats(self):
+        return {
+            "holder": self.holder,
+            "is_leader": self.is_leader,
+            "elections": self.elections,
+            "lease_valid_for": round(max(0.0, self.valid_until - time.time()), 1) if self.is_leader and MULTI_WORKER else None,
+        }
+
+    async def run(self):
+        self.holder = worker_id()
+        if not MULTI_WORKER:
+            # one process: always the leader, nothing to coordinate
+            self.valid_until = float("inf")
+            self._promote()
+            return
+        while not self._stopped:
+            try:
+                ok = self.backend.try_lease(self.name, self.holder, self.ttl)
+                if ok:
+                    self.valid_until = time.time() + self.ttl
+            except Exception as e:
+                print("Leader lease check failed:", e)
+                # unknown outcome: keep leading only while the last lease is surely ours
+                ok = self.is_leader and time.time() < self.valid_until - self.ttl / 3
+            if ok and not self.is_leader:
+                self._promote()
+            elif not ok and self.is_leader:
+                print(f"{self.holder} lost the leader lease")
+                self._demote()
+            await asyncio.sleep(self.ttl / 3)
+
+    def _promote(self):
+        self.is_leader = True
+        self.elections += 1
+        if MULTI_WORKER:
+            print(f"{self.holder} is now the leader")
+        for cb in self.on_elected:
+            try:
+                cb()
+            except Exception as e:
+                print("Leader election callback failed:", e)
+        self._tasks = [asyncio.create_task(factory()) for factory in self._jobs]
+
+    def _demote(self):
+        self.is_leader = False
+        for t in self._tasks:
+            t.cancel()
+        self._tasks = []
+
+    async def release(self):
+        # on shutdown: stop the jobs and hand the lease over without waiting for it to lapse
+        self._stopped = True
+        was_leader = self.is_leader
+        if was_leader:
+            self._demote()
+        if MULTI_WORKER and was_leader and self.holder:
+            try:
+                self.backend.release_lease(self.name, self.holder)
+            except Exception as e:
+                print("Leader lease release failed:", e)
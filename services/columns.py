@@ -0,0 +1,206 @@
+# services/columns.py
+# Columnar mirror of the user store for scans over every subscriber.
+#
+# One row per user, in NumPy arrays:
+#   expires_at int64, chat_id int64 (0 = not linked), plan uint8 (code into
+#   `plans`, 0 = none), active bool, alive bool (False = free row)
+# plus an email / reference string table. Rows are reused after deletes.
+#
+# For cursor pagination the rows are also kept in email order, matched against
+# the store's own sorted email list rather than a second copy of it. Writes
+# don't touch that order: new rows wait in a pending set and deleted ones stay
+# behind as dead rows until the next read merges them in one vectorized insert,
+# so a burst of signups costs one O(N) pass instead of one per user.
+#
+# UserStore keeps it current on every put / delete / sync, so filters, counts
+# and the expiry scheduler's window queries are boolean masks over the arrays
+# instead of loops over the user dicts. The dicts stay the source of truth:
+# callers turn matching rows back into users with store.get(email).
+import bisect
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+
+class UserColumns:
+    def __init__(self, sorted_emails: Callable[[], List[str]], capacity: int = 1024):
+        self.sorted_emails = sorted_emails   # the store's emails_sorted, live emails in order
+        self.plans: List[Optional[str]] = [None]
+        self._plan_codes: Dict[Optional[str], int] = {None: 0}
+        self.emails: List[Optional[str]] = []
+        self.references: List[Optional[str]] = []
+        self.row_of: Dict[str, int] = {}
+        self.size = 0            # rows handed out so far, including freed ones
+        self._free: List[int] = []
+        self._order = np.zeros(0, dtype=np.int64)   # rows by email, minus _new, plus dead rows
+        self._new: Dict[int, None] = {}             # rows not merged into _order yet
+        self._dead = 0                              # deleted rows still in _order
+        self._alloc(capacity)
+
+    def _alloc(self, capacity: int):
+        self.expires_at = np.zeros(capacity, dtype=np.int64)
+        self.chat_id = np.zeros(capacity, dtype=np.int64)
+        self.plan = np.zeros(capacity, dtype=np.uint8)
+        self.active = np.zeros(capacity, dtype=bool)
+        self.alive = np.zeros(capacity, dtype=bool)
+
+    def _grow(self):
+        old = (self.expires_at, self.chat_id, self.plan, self.active, self.alive)
+        self._alloc(max(1024, 2 * len(self.alive)))
+        for new, prev in zip((self.expires_at, self.chat_id, self.plan, self.active, self.alive), old):
+            new[:len(prev)] = prev
+
+    def __len__(self):
+        return len(self.row_of)
+
+    def nbytes(self) -> int:
+        arrays = (self.expires_at, self.chat_id, self.plan, self.active, self.alive, self._order)
+        return sum(a.nbytes for a in arrays)
+
+    def plan_code(self, plan: Optional[str]) -> int:
+        code = self._plan_codes.get(plan)
+        if code is None:
+            if len(self.plans) >= 256:
+                raise ValueError("too many distinct plans for a uint8 column")
+            code = self._plan_codes[plan] = len(self.plans)
+            self.plans.append(plan)
+        return code
+
+    # --------------------
+    # Sync
+    # --------------------
+    def reset(self, users: Dict[str, Dict[str, Any]]):
+        # one pass over every user (store load / full reload)
+        n = len(users)
+        self.emails = list(users)
+        self.row_of = {email: i for i, email in enumerate(self.emails)}
+        self.references = [u.get("paystack_reference") for u in users.values()]
+        self.size = n
+        self._free = []
+        self._alloc(max(1024, n + n // 4))
+        vals = users.values()
+        self.expires_at[:n] = np.fromiter((int(u.get("expires_at") or 0) for u in vals), dtype=np.int64, count=n)
+        self.chat_id[:n] = np.fromiter((int(u.get("chat_id") or 0) for u in vals), dtype=np.int64, count=n)
+        self.plan[:n] = np.fromiter((self.plan_code(u.get("plan")) for u in vals), dtype=np.uint8, count=n)
+        self.active[:n] = np.fromiter((bool(u.get("active")) for u in vals), dtype=bool, count=n)
+        self.alive[:n] = True
+        self._order = np.fromiter((self.row_of[e] for e in self.sorted_emails()), dtype=np.int64, count=n)
+        self._new = {}
+        self._dead = 0
+
+    def put(self, email: str, u: Dict[str, Any]):
+        row = self.row_of.get(email)
+        if row is None:
+            if self._free:
+                row = self._free.pop()
+                self.emails[row] = email
+                self.references[row] = None
+            else:
+                if self.size >= len(self.alive):
+                    self._grow()
+                row = self.size
+                self.size += 1
+                self.emails.append(email)
+                self.references.append(None)
+            self.row_of[email] = row
+            self.alive[row] = True
+            self._new[row] = None
+        self.expires_at[row] = int(u.get("expires_at") or 0)
+        self.chat_id[row] = int(u.get("chat_id") or 0)
+        self.plan[row] = self.plan_code(u.get("plan"))
+        self.active[row] = bool(u.get("active"))
+        self.references[row] = u.get("paystack_reference")
+
+    def delete(self, email: str):
+        row = self.row_of.pop(email, None)
+        if row is None:
+            return
+        self.alive[row] = False
+        self.active[row] = False
+        self.emails[row] = None
+        self.references[row] = None
+        if row in self._new:
+            del self._new[row]
+            self._free.append(row)
+        else:
+            # still in _order: reusable once the next merge drops it
+            self._dead += 1
+
+    def order(self) -> np.ndarray:
+        # live rows in email order, lined up with sorted_emails()
+        if self._new or self._dead:
+            order = self._order
+            if self._dead:
+                keep = self.alive[order]
+                self._free.extend(order[~keep].tolist())
+                order = order[keep]
+            if self._new:
+                rows = sorted(self._new, key=self.emails.__getitem__)
+                sorted_emails = self.sorted_emails()
+                # a new email's rank among all live emails, less the new ones before it
+                pos = [bisect.bisect_left(sorted_emails, self.emails[r]) - i for i, r in enumerate(rows)]
+                order = np.insert(order, pos, rows)
+            self._order = order
+            self._new = {}
+            self._dead = 0
+        return self._order
+
+    # --------------------
+    # Queries
+    # --------------------
+    def mask(self, f: Dict[str, Any]) -> np.ndarray:
+        # the same filters as services/user_query.matches(), over every row at once
+        n = self.size
+        m = self.alive[:n].copy()
+        if "plan" in f:
+            code = self._plan_codes.get(f["plan"])
+            if code is None:
+                return np.zeros(n, dtype=bool)
+            m &= self.plan[:n] == code
+        if "active" in f:
+            m &= self.active[:n] == bool(f["active"])
+        if "linked" in f:
+            m &= (self.chat_id[:n] != 0) == bool(f["linked"])
+        if "expires_before" in f:
+            m &= self.expires_at[:n] < f["expires_before"]
+        if "expires_after" in f:
+            m &= self.expires_at[:n] > f["expires_after"]
+        return m
+
+    def count(self, f: Dict[str, Any]) -> int:
+        return int(np.count_nonzero(self.mask(f)))
+
+    def count_by_plan(self, f: Dict[str, Any]) -> Dict[str, int]:
+        m = self.mask(f)
+        counts = np.bincount(self.plan[:self.size][m], minlength=len(self.plans))
+        return {str(self.plans[i]) if self.plans[i] is not None else "none": int(c)
+                for i, c in enumerate(counts) if c}
+
+    def matching_rows(self, f: Dict[str, Any], after: Optional[str] = None) -> np.ndarray:
+        # matching rows in email order, starting just after `after`
+        order = self.order()
+        start = bisect.bisect_right(self.sorted_emails(), after) if after else 0
+        rows = order[start:]
+        return rows[self.mask(f)[rows]]
+
+    def emails_at(self, rows: Iterable[int]) -> List[str]:
+        emails = self.emails
+        return [emails[r] for r in rows]
+
+    def due_between(self, offsets: Iterable[int], lo: float, hi: float) -> List[str]:
+        # active users with expires_at - offset in [lo, hi) for any of the offsets
+        n = self.size
+        exp = self.expires_at[:n]
+        hit = np.zeros(n, dtype=bool)
+        for off in offsets:
+            due = exp - off
+            hit |= (due >= lo) & (due < hi)
+        hit &= self.active[:n] & self.alive[:n] & (exp > 0)
+        return self.emails_at(np.flatnonzero(hit))
+
+    def expired_between(self, lo: float, hi: float) -> List[str]:
+        # linked users whose expires_at is in (lo, hi], active flag or not
+        n = self.size
+        exp = self.expires_at[:n]
+        hit = self.alive[:n] & (self.chat_id[:n] != 0) & (exp > lo) & (exp <= hi)
+        return self.emails_at(np.flatnonzero(hit))
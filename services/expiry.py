@@ -0,0 +1,189 @@
+# services/expiry.py
+# Deadline scheduler for subscription reminders and expiries.
+#
+# A min-heap holds (due, seq, email, kind, expires_at). Entries are pushed when a
+# subscription is granted, renewed or linked, and checked lazily when popped:
+# an entry whose expires_at no longer matches the user (renewed since) is
+# dropped. The loop sleeps until the earliest deadline, so work scales with the
+# number of due events rather than the number of users.
+#
+# With the store's columnar mirror the heap only holds deadlines before
+# `horizon` (HORIZON seconds ahead): rebuild() and each refill pick the users
+# due in the next window with one vectorized scan, so the heap stays small
+# however many subscribers there are. Without it every active user is pushed.
+#
+# Sent reminders are recorded on the user record so each one goes out once per
+# expiry date:
+#   reminded_for        expires_at the user was DMed about
+#   admin_reminded_for  expires_at admins were told about (user had no chat_id)
+#
+# An event whose callback fails is pushed again RETRY_BASE seconds later,
+# doubling up to RETRY_MAX, until it goes through or turns stale (a reminder
+# whose expiry has passed). Callbacks raise PermanentEventError when retrying
+# won't help (the user blocked the bot, the chat is gone).
+import time
+import heapq
+import asyncio
+import itertools
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from services import metrics
+
+REMINDER = "reminder"
+EXPIRY = "expiry"
+
+MAX_SLEEP = 3600  # re-check the clock at least hourly
+HORIZON = 86400   # columnar mode: deadlines further out than this wait for a refill
+RETRY_BASE = 60   # seconds before a failed event is tried again; doubles per failure
+RETRY_MAX = 3600
+
+
+class PermanentEventError(Exception):
+    # raise from on_reminder / on_expired to skip the retries
+    pass
+
+
+class ExpiryScheduler:
+    def __init__(self, store, alert_seconds: int,
+                 on_reminder: Callable[[Dict[str, Any]], Awaitable[None]],
+                 on_expired: Callable[[Dict[str, Any]], Awaitable[None]]):
+        self.store = store
+        self.alert_seconds = alert_seconds
+        self.on_reminder = on_reminder
+        self.on_expired = on_expired
+        self.fired = 0
+        self.last_run: Optional[float] = None
+        self._heap: List[Tuple[float, int, str, str, int]] = []
+        self._failures: Dict[Tuple[str, str, int], int] = {}   # (email, kind, expires_at) -> failed attempts
+        self.retried = 0
+        self.horizon = float("inf")
+        self._seq = itertools.count()
+        self._wake = asyncio.Event()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def next_due(self) -> Optional[float]:
+        return self._heap[0][0] if self._heap else None
+
+    # --------------------
+    # Scheduling
+    # --------------------
+    def schedule(self, user: Dict[str, Any], since: float = float("-inf")):
+        # pushes the user's deadlines in [since, horizon); later ones come with a refill
+        if not user or not user.get("active"):
+            return
+        exp = int(user.get("expires_at") or 0)
+        if not exp:
+            return
+        email = user["email"]
+        if not self._reminder_done(user, exp):
+            self._push(exp - self.alert_seconds, email, REMINDER, exp, since)
+        self._push(exp, email, EXPIRY, exp, since)
+
+    def rebuild(self):
+        # at startup, and whenever stale entries pile up
+        self._heap = []
+        cols = getattr(self.store, "columns", None)
+        if cols is None:
+            self.horizon = float("inf")
+            for u in self.store.all().values():
+                self.schedule(u)
+            return
+        self.horizon = time.time() + HORIZON
+        self._fill(float("-inf"), self.horizon)
+
+    def _refill(self):
+        # the next window, from the columns
+        lo = self.horizon
+        self.horizon = max(lo, time.time()) + HORIZON
+        self._fill(lo, self.horizon)
+
+    def _fill(self, lo: float, hi: float):
+        for email in self.store.columns.due_between((self.alert_seconds, 0), lo, hi):
+            self.schedule(self.store.get(email), since=lo)
+
+    def _push(self, due: float, email: str, kind: str, exp: int, since: float = float("-inf")):
+        if not since <= due < self.horizon:
+            return
+        head = self.next_due()
+        heapq.heappush(self._heap, (due, next(self._seq), email, kind, exp))
+        if head is None or due < head:
+            self._wake.set()
+        # renewals leave stale entries behind; rebuild when they dominate
+        if len(self._heap) > 2 * len(self.store) + 1000:
+            self.rebuild()
+
+    def _retry(self, email: str, kind: str, exp: int):
+        # past the horizon too: a refill only picks deadlines that are still ahead
+        key = (email, kind, exp)
+        n = self._failures[key] = self._failures.get(key, 0) + 1
+        due = time.time() + min(RETRY_MAX, RETRY_BASE * 2 ** (n - 1))
+        heapq.heappush(self._heap, (due, next(self._seq), email, kind, exp))
+        self.retried += 1
+
+    def _reminder_done(self, user: Dict[str, Any], exp: int) -> bool:
+        if user.get("chat_id"):
+            return user.get("reminded_for") == exp
+        return user.get("admin_reminded_for") == exp
+
+    # --------------------
+    # Loop
+    # --------------------
+    async def run(self):
+        while True:
+            self._wake.clear()
+            if time.time() >= self.horizon:
+                self._refill()
+            head = self.next_due()
+            delay = min(MAX_SLEEP, self.horizon - time.time())
+            if head is not None:
+                delay = min(delay, head - time.time())
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            async with metrics.task_run("expiry_scheduler"):
+                await self.fire_due()
+
+    async def fire_due(self):
+        # everything due now fires concurrently; the senders pace themselves
+        now = time.time()
+        self.last_run = now
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, _, email, kind, exp = heapq.heappop(self._heap)
+            u = self.store.get(email)
+            # stale: renewed, deactivated or removed since this entry was pushed
+            if not u or not u.get("active") or int(u.get("expires_at") or 0) != exp:
+                self._failures.pop((email, kind, exp), None)
+                continue
+            if kind == REMINDER and (exp <= now or self._reminder_done(u, exp)):
+                self._failures.pop((email, kind, exp), None)
+                continue
+            due.append((email, kind, exp, u))
+        await asyncio.gather(*(self._fire(*d) for d in due))
+
+    async def _fire(self, email: str, kind: str, exp: int, u: Dict[str, Any]):
+        try:
+            if kind == REMINDER:
+                await self.on_reminder(u)
+                if u.get("chat_id"):
+                    self.store.update_for_expiry(email, exp, reminded_for=exp)
+                else:
+                    self.store.update_for_expiry(email, exp, admin_reminded_for=exp)
+            else:
+                u = self.store.update_for_expiry(email, exp, active=False)
+                if u is None:
+                    return   # renewed by another worker meanwhile
+                await self.on_expired(u)
+            self.fired += 1
+            self._failures.pop((email, kind, exp), None)
+        except PermanentEventError as e:
+            self._failures.pop((email, kind, exp), None)
+            print("Expiry event failed for", email, kind, e, "(not retrying)")
+        except Exception as e:
+            self._retry(email, kind, exp)
+            print("Expiry event failed for", email, kind, e, f"(attempt {self._failures[(email, kind, exp)]}, will retry)")
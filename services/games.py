@@ -0,0 +1,122 @@
+# services/games.py
+# Structured betting-slip games, parsed once when the admin adds them.
+#
+# game structure: { raw, fixture, market, odds }
+#   "Real vs Opp GG - 1.55"          -> fixture "Real vs Opp", market "GG", odds 1.55
+#   "Arsenal vs Chelsea Over 2.5 @1.85" -> odds 1.85 (an "@" price wins over other numbers)
+#   "Spurs vs Leeds BTTS 5/4"        -> odds 2.25 (fractional: 1 + 5/4)
+#   "Home | Over 1.5 | 1.30"         -> explicit fixture | market | odds
+# Without a separator the fixture runs up to the first word after "vs".
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+_NUM = r"\d+(?:[.,]\d+)?"
+_AT_ODDS = re.compile(r"@\s*(" + _NUM + r")")
+_TRAILING_ODDS = re.compile(r"(?:^|\s)[-–:]?\s*(" + _NUM + r")(?:\s*/\s*(" + _NUM + r"))?\s*(?:odds)?\s*$", re.IGNORECASE)
+_FIXTURE = re.compile(r"^(.+?\s+(?:vs\.?|v\.?)\s+\S+)\s*(.*)$", re.IGNORECASE)
+_TRAILING_SEP = re.compile(r"[\s\-–:@]+$")
+
+
+def _num(s: str) -> float:
+    return float(s.replace(",", "."))
+
+
+def parse_odds(text: str) -> Tuple[Optional[float], str]:
+    # returns (odds or None, text with the odds removed)
+    m = _AT_ODDS.search(text)
+    if m:
+        return _num(m.group(1)) or None, (text[:m.start()] + text[m.end():]).strip()
+    m = _TRAILING_ODDS.search(text)
+    if m:
+        if m.group(2):
+            den = _num(m.group(2))
+            odds = 1 + _num(m.group(1)) / den if den else None
+        else:
+            odds = _num(m.group(1)) or None
+        return odds, text[:m.start()].strip()
+    return None, text
+
+
+def parse_game(text: str) -> Dict[str, Any]:
+    raw = text.strip()
+    if raw.count("|") == 2:
+        fixture, market, odds_text = (p.strip() for p in raw.split("|"))
+        odds, _ = parse_odds(odds_text)
+        return {"raw": raw, "fixture": fixture, "market": market, "odds": odds}
+    odds, rest = parse_odds(raw)
+    rest = _TRAILING_SEP.sub("", rest)
+    m = _FIXTURE.match(rest)
+    if m:
+        fixture, market = m.group(1), _TRAILING_SEP.sub("", m.group(2))
+    else:
+        fixture, market = rest, ""
+    return {"raw": raw, "fixture": fixture, "market": market, "odds": odds}
+
+
+def as_game(g: Any) -> Dict[str, Any]:
+    # games.json used to hold plain strings
+    if isinstance(g, str):
+        return parse_game(g)
+    if isinstance(g, dict) and isinstance(g.get("raw"), str):
+        return g
+    raise ValueError(f"not a game: {g!r}"[:80])
+
+
+class GameSlip:
+    def __init__(self, games: Iterable[Any] = ()):
+        self.games: List[Dict[str, Any]] = []
+        self.total_odds = 1.0
+        self._rendered: Dict[Tuple[str, bool], str] = {}
+        for g in games:
+            self._append(as_game(g))
+
+    def __len__(self):
+        return len(self.games)
+
+    def __bool__(self):
+        return bool(self.games)
+
+    def __iter__(self):
+        return iter(self.games)
+
+    def _append(self, game: Dict[str, Any]):
+        self.games.append(game)
+        if game.get("odds"):
+            self.total_odds *= game["odds"]
+        self._rendered.clear()
+
+    def add(self, text: str) -> Dict[str, Any]:
+        game = parse_game(text)
+        self._append(game)
+        return game
+
+    def clear(self):
+        self.games.clear()
+        self.total_odds = 1.0
+        self._rendered.clear()
+
+    def to_json(self) -> List[Dict[str, Any]]:
+        return list(self.games)
+
+    def render(self, title: str, show_odds: bool = True) -> str:
+        # Markdown slip, memoized until the list changes
+        key = (title, show_odds)
+        text = self._rendered.get(key)
+        if text is None:
+            text = self._rendered[key] = self._render(title, show_odds)
+        return text
+
+    def _render(self, title: str, show_odds: bool) -> str:
+        if not self.games:
+            return "📭 No games added yet."
+        lines = [title]
+        for i, g in enumerate(self.games, start=1):
+            if show_odds and g.get("odds"):
+                lines.append(f"{i}. *{g['raw']}* — `{g['odds']:.2f}`")
+            else:
+                lines.append(f"{i}. *{g['raw']}*")
+        total = self.total_odds
+        total_text = f"{total:.2f}" if total and total != 1.0 else "—"
+        lines.append("\n💰 *Total Odds:* " + total_text)
+        lines.append("\n🔥 Play Responsibly 🔥")
+        return "\n".join(lines)
@@ -0,0 +1,52 @@
+# services/http_client.py
+# One aiohttp ClientSession for the whole process: keep-alive pooling, per-host
+# limits and DNS caching, so Paystack calls and self-pings reuse connections
+# instead of paying a new TCP + TLS handshake each time.
+import os
+import aiohttp
+from typing import Optional
+
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))                  # total, seconds
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "20"))
+HTTP_DNS_TTL = int(os.getenv("HTTP_DNS_TTL", "300"))
+HTTP_KEEPALIVE = float(os.getenv("HTTP_KEEPALIVE", "30"))
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "")   # e.g. a local Bot API server or bench/fake_servers.py
+
+_session: Optional[aiohttp.ClientSession] = None
+
+
+async def start() -> aiohttp.ClientSession:
+    return get_session()
+
+
+def get_session() -> aiohttp.ClientSession:
+    # created lazily on first use so modules without an on_startup hook (bots/) can share it
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=HTTP_DNS_TTL,
+            keepalive_timeout=HTTP_KEEPALIVE,
+        )
+        timeout = aiohttp.ClientTimeout(total=HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+        _session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    return _session
+
+
+async def close():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+def telegram_session():
+    # aiogram session for TELEGRAM_API_BASE; None keeps aiogram's default api.telegram.org
+    if not TELEGRAM_API_BASE:
+        return None
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    return AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_BASE.rstrip("/")))
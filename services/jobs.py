@@ -0,0 +1,206 @@
+# services/jobs.py
+# Bounded asyncio job queue with a worker pool, retry with backoff and an
+# optional on-disk journal so accepted jobs survive a restart.
+#
+# journal lines: {"id": n, "job": {...}} when accepted, {"done": n} when finished
+import os
+import json
+import random
+import asyncio
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+class PermanentJobError(Exception):
+    # raise from a handler to skip the remaining retries
+    pass
+
+
+class JobQueue:
+    def __init__(self, handler: Callable[[Dict[str, Any]], Awaitable[Any]], maxsize: int = 1000,
+                 workers: int = 4, max_attempts: int = 5, backoff_base: float = 1.0,
+                 journal_path: Optional[Path] = None, name: str = "jobs"):
+        self.handler = handler
+        self.maxsize = maxsize
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.journal_path = Path(journal_path) if journal_path else None
+        self.name = name
+        self.queue: Optional[asyncio.Queue] = None
+        self.accepting = False
+        self.on_done: Optional[Callable[[Dict[str, Any]], None]] = None
+        self.processed = 0
+        self.failed = 0
+        self.retried = 0
+        self.rejected = 0
+        self._next_id = 0
+        self._tasks: List[asyncio.Task] = []
+        self._journal = None
+        self._journal_lines = 0
+        self._running = 0
+
+    @property
+    def depth(self) -> int:
+        return self.queue.qsize() if self.queue else 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "depth": self.depth,
+            "maxsize": self.maxsize,
+            "workers": self.workers,
+            "accepting": self.accepting,
+            "processed": self.processed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "rejected": self.rejected,
+        }
+
+    # --------------------
+    # Lifecycle
+    # --------------------
+    async def start(self) -> List[Dict[str, Any]]:
+        # returns jobs recovered from the journal (already re-queued)
+        # the bound is enforced in submit() so recovered jobs are never dropped
+        self.queue = asyncio.Queue()
+        recovered = self._recover()
+        if self.journal_path:
+            self._journal = open(self.journal_path, "a", encoding="utf-8")
+            # rewrite the journal with just the unfinished jobs
+            self._journal.truncate(0)
+            self._journal_lines = 0
+            for job_id, job in recovered:
+                self._journal_write({"id": job_id, "job": job})
+        for job_id, job in recovered:
+            self.queue.put_nowait((job_id, job, 1))
+        self.accepting = True
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(i)))
+        if recovered:
+            print(f"{self.name}: recovered {len(recovered)} unfinished job(s)")
+        return [job for _, job in recovered]
+
+    async def drain(self, timeout: float = 30.0):
+        # stop taking new work, let workers finish what's queued, then stop them
+        self.accepting = False
+        if self.queue is not None:
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout)
+            except asyncio.TimeoutError:
+                print(f"{self.name}: drain timed out with {self.depth} job(s) left")
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    # --------------------
+    # Producer side
+    # --------------------
+    def submit(self, job: Dict[str, Any]) -> bool:
+        # False when the queue is full or shutting down (caller answers 503)
+        if not self.accepting or self.queue is None or self.queue.qsize() >= self.maxsize:
+            self.rejected += 1
+            return False
+        self._next_id += 1
+        job_id = self._next_id
+        self._journal_write({"id": job_id, "job": job})
+        self.queue.put_nowait((job_id, job, 1))
+        return True
+
+    # --------------------
+    # Workers
+    # --------------------
+    async def _worker(self, n: int):
+        while True:
+            job_id, job, attempt = await self.queue.get()
+            self._running += 1
+            try:
+                await self._run(job_id, job, attempt)
+            finally:
+                self._running -= 1
+                self.queue.task_done()
+            if self._running == 0 and self.queue.empty():
+                self._truncate_journal()
+
+    async def _run(self, job_id: int, job: Dict[str, Any], attempt: int):
+        while True:
+            try:
+                await self.handler(job)
+                self.processed += 1
+                break
+            except asyncio.CancelledError:
+                raise
+            except PermanentJobError as e:
+                self.failed += 1
+                print(f"{self.name}: job {job_id} dropped: {e}")
+                break
+            except Exception as e:
+                if attempt >= self.max_attempts:
+                    self.failed += 1
+                    print(f"{self.name}: job {job_id} failed after {attempt} attempt(s): {e}")
+                    break
+                self.retried += 1
+                # exponential backoff with full jitter
+                delay = random.uniform(0, self.backoff_base * (2 ** (attempt - 1)))
+                attempt += 1
+                await asyncio.sleep(delay)
+        self._journal_write({"done": job_id})
+        if self.on_done is not None:
+            self.on_done(job)
+
+    # --------------------
+    # Journal
+    # --------------------
+    def _journal_write(self, entry: Dict[str, Any]):
+        if self._journal is None:
+            return
+        self._journal.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._journal_lines += 1
+
+    def _truncate_journal(self):
+        # nothing queued or running: every accepted job has its "done" line
+        if self._journal is not None and self._journal_lines >= 1000:
+            self._journal.truncate(0)
+            self._journal_lines = 0
+
+    def _recover(self):
+        if not self.journal_path:
+            return []
+        pending = read_journal(self.journal_path)
+        self._next_id = max(pending, default=0)
+        return sorted(pending.items())
+
+    def adopt(self, path: Path) -> List[Dict[str, Any]]:
+        # take over the unfinished jobs of another process's journal (it died), then remove it
+        jobs = [job for _, job in sorted(read_journal(path).items())]
+        for job in jobs:
+            self._next_id += 1
+            self._journal_write({"id": self._next_id, "job": job})
+            self.queue.put_nowait((self._next_id, job, 1))
+        Path(path).unlink(missing_ok=True)
+        if jobs:
+            print(f"{self.name}: adopted {len(jobs)} job(s) from {path}")
+        return jobs
+
+
+def read_journal(path: Path) -> Dict[int, Dict[str, Any]]:
+    # {id: job} for accepted jobs without a "done" line
+    pending: Dict[int, Dict[str, Any]] = {}
+    if not Path(path).exists():
+        return pending
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if "done" in entry:
+                pending.pop(entry["done"], None)
+            elif "id" in entry:
+                pending[entry["id"]] = entry["job"]
+    return pending
@@ -0,0 +1,347 @@
+# services/ledger.py
+# Append-only history of payments and Telegram links.
+#
+# The user store only keeps each subscriber's latest state; every grant and
+# link is also appended here as one NDJSON line and never rewritten:
+#   {"type": "charge", "ts", "email", "reference", "plan", "amount", "paid_at",
+#    "expires_at", "action": "activated" | "renewed"}
+#   {"type": "link", "ts", "email", "reference", "chat_id"}
+#   {"type": "import", "ts", "email", "user": {...}}   state carried over when the ledger was started
+#
+# The fold also keeps each user's paid_references, so a store restored from it
+# still recognises redelivered charges.
+#
+# Events carry the state they produced (expires_at, action), so replaying them
+# is a plain fold and doesn't depend on the plan rules of the day.
+#
+# The folded state is kept in memory and snapshotted now and then to
+# payments.ledger.snapshot.json together with the byte offset it covers.
+# load() reads the snapshot and replays only the lines after that offset, so a
+# restart doesn't reparse the whole history; other workers' appends are picked
+# up the same way (catch_up()).
+#
+#   python -m services.ledger stats | replay [--full] | verify | history EMAIL | restore
+import os
+import json
+import time
+import asyncio
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from services import metrics
+from services.storage import FileLock, atomic_write, load_json
+
+LEDGER_ENABLED = os.getenv("PAYMENT_LEDGER", "1") == "1"
+LEDGER_FLUSH_INTERVAL = float(os.getenv("LEDGER_FLUSH_INTERVAL", "1.0"))       # seconds
+LEDGER_SNAPSHOT_EVERY = int(os.getenv("LEDGER_SNAPSHOT_EVERY", "10000"))        # events
+LEDGER_SNAPSHOT_INTERVAL = float(os.getenv("LEDGER_SNAPSHOT_INTERVAL", "300"))  # seconds between checks
+PAID_REFERENCES_KEPT = int(os.getenv("PAID_REFERENCES_KEPT", "50"))            # per user, far past Paystack's retries
+
+CHUNK = 1 << 20
+
+IMPORT_FIELDS = ("plan", "paystack_reference", "expires_at", "chat_id", "activated_at", "linked_at",
+                 "last_paid_at", "last_amount", "last_action", "paid_references")
+
+
+def apply_event(users: Dict[str, Dict[str, Any]], e: Dict[str, Any]):
+    # hot loop of every replay: plain indexing, no helper dicts
+    email = e.get("email")
+    if not email:
+        return
+    kind = e.get("type")
+    if kind == "charge":
+        u = users.get(email)
+        action = e.get("action")
+        paid_at = e.get("paid_at")
+        amount = e.get("amount")
+        refs = (u.get("paid_references") or [u.get("paystack_reference")]) if u else []
+        if u is None or action == "activated":
+            # an activation starts a new record, like grant_or_renew's put()
+            u = users[email] = {"email": email, "chat_id": None, "linked_at": None, "activated_at": paid_at,
+                                "payments": u["payments"] if u else 0, "paid_total": u["paid_total"] if u else 0}
+        ref = e.get("reference")
+        u["plan"] = e.get("plan")
+        u["paystack_reference"] = ref
+        u["paid_references"] = ([r for r in refs if r and r != ref] + [ref])[-PAID_REFERENCES_KEPT:]
+        u["expires_at"] = e.get("expires_at")
+        u["last_paid_at"] = paid_at
+        u["last_amount"] = amount
+        u["last_action"] = action
+        u["payments"] += 1
+        if amount:
+            u["paid_total"] += amount
+    elif kind == "link":
+        u = users.get(email)
+        if u is not None:
+            if not u.get("chat_id"):
+                u["linked_at"] = e.get("ts")
+            u["chat_id"] = e.get("chat_id")
+    elif kind == "import":
+        src = e.get("user") or {}
+        users[email] = dict({k: src.get(k) for k in IMPORT_FIELDS}, email=email, payments=0, paid_total=0)
+
+
+class PaymentLedger:
+    def __init__(self, path: Path, shared: bool = False):
+        self.path = Path(path)
+        self.snapshot_path = self.path.with_name(self.path.name + ".snapshot.json")
+        self.shared = shared                 # several workers append: write through, in order
+        self.users: Dict[str, Dict[str, Any]] = {}
+        self.offset = 0                      # bytes of the ledger folded into `users`
+        self.events = 0
+        self.snapshot_offset = 0
+        self.snapshot_events = 0
+        self.loaded = False
+        self._pending: List[str] = []
+        self._lock = FileLock(self.path.with_name(self.path.name + ".lock"))
+
+    # --------------------
+    # Appending
+    # --------------------
+    def append(self, event: Dict[str, Any]):
+        event.setdefault("ts", int(time.time()))
+        self._pending.append(json.dumps(event, ensure_ascii=False, separators=(",", ":")))
+        if self.shared:
+            self.flush()
+
+    def charge(self, email: str, reference: str, plan: str, amount: Optional[int],
+               paid_at: int, expires_at: int, action: str):
+        self.append({"type": "charge", "email": email, "reference": reference, "plan": plan,
+                     "amount": amount, "paid_at": paid_at, "expires_at": expires_at, "action": action})
+
+    def link(self, email: str, reference: str, chat_id: int):
+        self.append({"type": "link", "email": email, "reference": reference, "chat_id": chat_id})
+
+    def flush(self):
+        if not self._pending:
+            return
+        lines, self._pending = self._pending, []
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        with self._lock, open(self.path, "a+b") as f:
+            size = f.seek(0, os.SEEK_END)
+            if size:
+                f.seek(size - 1)
+                if f.read(1) != b"\n":
+                    # a crash cut the last line short; keep it apart from ours
+                    data = b"\n" + data
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def seed(self, users: Dict[str, Dict[str, Any]]) -> int:
+        # first start with existing subscribers: record where each one stands
+        with self._lock:
+            if self.path.exists() and self.path.stat().st_size:
+                return 0
+            now = int(time.time())
+            with open(self.path, "a", encoding="utf-8") as f:
+                for email, u in users.items():
+                    f.write(json.dumps({"type": "import", "ts": now, "email": email, "user": u},
+                                       ensure_ascii=False, separators=(",", ":")) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        return len(users)
+
+    # --------------------
+    # Replay
+    # --------------------
+    def iter_batches(self, offset: int = 0) -> Iterator[Tuple[int, List[Dict[str, Any]]]]:
+        # (offset after the batch, events) for the whole lines from `offset`, about CHUNK bytes at a time.
+        # A batch is parsed as one JSON array, which is much cheaper than a loads() per line.
+        if not self.path.exists():
+            return
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            rest = b""
+            while True:
+                chunk = f.read(CHUNK)
+                if not chunk:
+                    break
+                data = rest + chunk
+                end = data.rfind(b"\n") + 1
+                rest = data[end:]
+                if not end:
+                    continue
+                lines = [line for line in data[:end].split(b"\n") if line.strip()]
+                try:
+                    events = json.loads(b"[" + b",".join(lines) + b"]")
+                except ValueError:
+                    events = []
+                    for line in lines:
+                        try:
+                            events.append(json.loads(line))
+                        except ValueError:
+                            # torn write from a crash (flush() starts the next line after it)
+                            print("Skipping corrupt ledger line:", line[:80])
+                offset += end
+                yield offset, events
+
+    def _fold(self, offset: int) -> int:
+        n = 0
+        users = self.users
+        for end, events in self.iter_batches(offset):
+            for e in events:
+                apply_event(users, e)
+            self.offset = end
+            n += len(events)
+        self.events += n
+        return n
+
+    def load(self, full: bool = False) -> int:
+        # snapshot + tail; full=True replays the whole file instead
+        snap = {} if full else load_json(self.snapshot_path)
+        self.users = snap.get("users") or {}
+        self.offset = self.snapshot_offset = int(snap.get("offset") or 0)
+        self.events = self.snapshot_events = int(snap.get("events") or 0)
+        if self.path.exists() and self.path.stat().st_size < self.offset:
+            # the ledger was replaced under the snapshot
+            print("Ledger is shorter than its snapshot; replaying from the start")
+            self.users, self.offset, self.events = {}, 0, 0
+            self.snapshot_offset = self.snapshot_events = 0
+        tail = self._fold(self.offset)
+        self.loaded = True
+        return tail
+
+    def catch_up(self) -> int:
+        # our own buffered events and anything other workers appended
+        self.flush()
+        return self._fold(self.offset)
+
+    # --------------------
+    # Snapshots
+    # --------------------
+    def needs_snapshot(self) -> bool:
+        return self.events - self.snapshot_events >= LEDGER_SNAPSHOT_EVERY
+
+    async def write_snapshot(self):
+        # copy on the loop, serialize and write on a thread
+        self.catch_up()
+        snap = {"offset": self.offset, "events": self.events, "written_at": int(time.time()),
+                "users": {email: dict(u) for email, u in self.users.items()}}
+        await asyncio.to_thread(lambda: atomic_write(self.snapshot_path, json.dumps(snap, ensure_ascii=False)))
+        self.snapshot_offset, self.snapshot_events = snap["offset"], snap["events"]
+
+    async def run(self):
+        # every worker: push buffered events out
+        while True:
+            await asyncio.sleep(LEDGER_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except Exception as e:
+                print("Payment ledger flush failed:", e)
+
+    async def snapshot_loop(self):
+        # leader only
+        while True:
+            await asyncio.sleep(LEDGER_SNAPSHOT_INTERVAL)
+            try:
+                async with metrics.task_run("ledger_snapshot"):
+                    self.catch_up()
+                    if self.needs_snapshot():
+                        await self.write_snapshot()
+            except Exception as e:
+                print("Payment ledger snapshot failed:", e)
+
+    # --------------------
+    # Users / audit
+    # --------------------
+    def rebuild_users(self, now: Optional[float] = None, alert_seconds: int = 0) -> Dict[str, Dict[str, Any]]:
+        # store records from the ledger. Reminder marks aren't in it: any reminder
+        # whose time has passed is taken as sent, so a restore doesn't send them again
+        now = time.time() if now is None else now
+        users = {}
+        for email, s in self.users.items():
+            exp = int(s.get("expires_at") or 0)
+            u = {k: v for k, v in s.items() if k not in ("payments", "paid_total")}
+            u["active"] = exp > now
+            if exp and exp - alert_seconds <= now:
+                u["reminded_for"] = u["admin_reminded_for"] = exp
+            users[email] = u
+        return users
+
+    def verify(self, users: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        # where the store disagrees with the ledger on what payments and links decide
+        fields = ("plan", "paystack_reference", "expires_at", "chat_id")
+        diff = []
+        for email, s in self.users.items():
+            u = users.get(email)
+            if u is None:
+                diff.append({"email": email, "store": None})
+                continue
+            bad = {f: {"ledger": s.get(f), "store": u.get(f)} for f in fields if (s.get(f) or None) != (u.get(f) or None)}
+            if bad:
+                diff.append(dict(bad, email=email))
+        extra = [email for email in users if email not in self.users]
+        return {"ledger_users": len(self.users), "store_users": len(users),
+                "mismatched": len(diff), "not_in_ledger": len(extra),
+                "examples": diff[:20], "not_in_ledger_examples": extra[:20]}
+
+    def history(self, email: str) -> List[Dict[str, Any]]:
+        # full scan of what's been flushed; lines are filtered as bytes before parsing
+        needle = json.dumps(email, ensure_ascii=False).encode("utf-8")
+        out = []
+        if not self.path.exists():
+            return out
+        with open(self.path, "rb") as f:
+            for line in f:
+                if needle in line:
+                    try:
+                        e = json.loads(line)
+                    except ValueError:
+                        continue
+                    if e.get("email") == email:
+                        out.append(e)
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "events": self.events,
+            "users": len(self.users),
+            "bytes": self.offset,
+            "pending": len(self._pending),
+            "snapshot_events": self.snapshot_events,
+            "since_snapshot": self.events - self.snapshot_events,
+        }
+
+
+if __name__ == "__main__":
+    import sys
+    import argparse
+
+    from services.storage import DATA_DIR, get_backend
+
+    ap = argparse.ArgumentParser(description="Replay / audit the payment ledger")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("stats", help="load snapshot + tail and print counts")
+    p = sub.add_parser("replay", help="time a replay and write a fresh snapshot")
+    p.add_argument("--full", action="store_true", help="replay from the start instead of the snapshot")
+    sub.add_parser("verify", help="compare the ledger with the user store")
+    p = sub.add_parser("history", help="every event for one email")
+    p.add_argument("email")
+    p = sub.add_parser("restore", help="overwrite the user store with the ledger's state")
+    p.add_argument("--alert-days", type=int, default=int(os.getenv("EXPIRY_ALERT_DAYS", "3")))
+    args = ap.parse_args()
+
+    ledger = PaymentLedger(DATA_DIR / "payments.ledger")
+    if args.cmd == "history":
+        for e in ledger.history(args.email):
+            print(json.dumps(e, ensure_ascii=False))
+        sys.exit(0)
+    started = time.perf_counter()
+    tail = ledger.load(full=args.cmd == "replay" and args.full)
+    took = time.perf_counter() - started
+    print(f"{ledger.events} events ({tail} replayed) for {len(ledger.users)} users in {took:.2f}s")
+    if args.cmd == "replay":
+        asyncio.run(ledger.write_snapshot())
+        print("Snapshot written to", ledger.snapshot_path)
+    elif args.cmd == "stats":
+        print(json.dumps(ledger.stats(), indent=2))
+    elif args.cmd == "verify":
+        backend = get_backend()
+        print(json.dumps(ledger.verify(backend.load_users()), indent=2, ensure_ascii=False))
+        backend.close()
+    elif args.cmd == "restore":
+        backend = get_backend()
+        backend.replace_users(ledger.rebuild_users(alert_seconds=args.alert_days * 86400))
+        backend.close()
+        print(f"Restored {len(ledger.users)} users into the {type(backend).__name__}")
@@ -0,0 +1,280 @@
+# services/membership.py
+# Removes expired subscribers from the paid groups and lets renewed ones back in.
+#
+# Each sweep (leader only) takes the linked users whose expires_at passed since
+# the previous sweep, from the store's columnar mirror rather than a scan of
+# every user, and removes them from the groups their plan is routed to (see
+# services/publisher.py): ban_chat_member followed by unban_chat_member, so
+# they're out but can come back through an invite link. Telegram calls go through a token bucket
+# (MEMBERSHIP_RATE per second) in batches of MEMBERSHIP_BATCH users; the
+# records get
+#   removed_for       expires_at they were removed for (a re-run skips them)
+#   removed_chat_id   their Telegram id, in case a re-activation drops chat_id
+#
+# A removed user who pays again (the store shows the change through
+# UserStore.observers) gets a single-use invite link per group of their plan,
+# sent by DM.
+#
+# The sweep window and the users still to handle are checkpointed in
+# membership_sweep.json after every batch:
+#   {"swept_until": ts, "pending": [email], "readmit": [[email, chat_id, queued_at]]}
+# so a restart picks up the rest instead of starting over.
+import os
+import time
+import asyncio
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram.exceptions import (TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError,
+                                TelegramRetryAfter, TelegramServerError)
+
+from services import metrics
+from services.broadcast import TokenBucket
+from services.storage import load_json, save_json
+
+MEMBERSHIP_SWEEP_INTERVAL = float(os.getenv("MEMBERSHIP_SWEEP_INTERVAL", "300"))  # seconds; 0 = off
+MEMBERSHIP_GRACE = int(os.getenv("MEMBERSHIP_GRACE", "0"))                       # seconds after expiry
+MEMBERSHIP_LOOKBACK_DAYS = int(os.getenv("MEMBERSHIP_LOOKBACK_DAYS", "30"))      # first sweep only
+MEMBERSHIP_RATE = float(os.getenv("MEMBERSHIP_RATE", "10"))                      # Telegram admin calls / s
+MEMBERSHIP_BATCH = int(os.getenv("MEMBERSHIP_BATCH", "50"))                      # users per checkpoint
+INVITE_LINK_TTL = int(os.getenv("INVITE_LINK_TTL", str(2 * 86400)))              # seconds
+
+ATTEMPTS = 4
+READMIT_GIVE_UP = 7 * 86400   # stop retrying a re-admission after this long
+MAX_READMIT_QUEUE = 10000     # workers other than the leader only collect
+
+# Telegram's answers for someone who isn't (or can't be) in the group: nothing left to do
+_GONE = ("user not found", "participant_id_invalid", "user_not_participant", "not a member",
+         "member not found", "user is an administrator", "can't remove chat owner")
+
+
+class MembershipSweeper:
+    def __init__(self, store, bot: Callable[[], Any], routes: Dict[str, List[int]], checkpoint_path: Path,
+                 notify: Callable[[int, Dict[str, Any], List[Tuple[int, str]]], Awaitable[None]]):
+        self.store = store
+        self.bot = bot                       # group admin; called at use, bots are built lazily
+        self.routes = routes
+        self.groups = sorted({gid for gids in routes.values() for gid in gids})
+        self.checkpoint_path = Path(checkpoint_path)
+        self.notify = notify                 # (chat_id, user, [(group_id, invite_link)]) -> DM
+        self.bucket = TokenBucket(MEMBERSHIP_RATE, MEMBERSHIP_RATE)
+        self.removed = 0
+        self.readmitted = 0
+        self.errors = 0
+        self.last_sweep: Optional[Dict[str, Any]] = None
+        self._readmit: Dict[str, Tuple[int, float]] = {}   # email -> (chat_id, queued_at)
+        self._wake = asyncio.Event()
+        self._lock = asyncio.Lock()
+
+    def groups_for(self, plan: Optional[str]) -> List[int]:
+        # the groups a plan grants: what removal takes away and re-admission gives back
+        return self.routes.get(plan or "", [])
+
+    # --------------------
+    # Store observer: removed users who pay again
+    # --------------------
+    def reset(self, users: Dict[str, Dict[str, Any]]):
+        pass
+
+    def changed(self, before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]):
+        if not before or not after or not before.get("removed_for"):
+            return
+        if not after.get("active") or int(after.get("expires_at") or 0) <= int(before.get("expires_at") or 0):
+            return
+        chat_id = after.get("chat_id") or before.get("removed_chat_id")
+        if chat_id:
+            self._readmit[after["email"]] = (int(chat_id), time.time())
+            if len(self._readmit) > MAX_READMIT_QUEUE:
+                del self._readmit[next(iter(self._readmit))]
+            self._wake.set()
+
+    # --------------------
+    # Checkpoint
+    # --------------------
+    def load_checkpoint(self) -> Dict[str, Any]:
+        return load_json(self.checkpoint_path)
+
+    def save_checkpoint(self, cp: Dict[str, Any]):
+        cp["readmit"] = [[email, cid, at] for email, (cid, at) in self._readmit.items()]
+        save_json(self.checkpoint_path, cp)
+
+    # --------------------
+    # Telegram
+    # --------------------
+    async def _call(self, fn, *args, **kwargs) -> Optional[str]:
+        # None when done (or nothing to do), else the error that's worth another sweep
+        error = None
+        for attempt in range(ATTEMPTS):
+            await self.bucket.acquire()
+            try:
+                await fn(*args, **kwargs)
+                return None
+            except TelegramRetryAfter as e:
+                self.bucket.pause(e.retry_after)
+                error = str(e)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                error = str(e)
+                await asyncio.sleep(2 ** attempt)
+            except (TelegramBadRequest, TelegramForbiddenError) as e:
+                if any(s in str(e).lower() for s in _GONE):
+                    return None
+                # missing admin rights, unknown group: retrying won't help, but say so
+                self.errors += 1
+                print(f"Membership call {fn.__name__}{args} failed:", e)
+                return None
+        self.errors += 1
+        return error
+
+    async def _remove(self, email: str) -> bool:
+        # False: try again next sweep
+        with self.store.transaction():
+            # catch up first: another worker may have just written the renewal
+            u = self.store.get(email)
+        if not u:
+            return True
+        exp = int(u.get("expires_at") or 0)
+        chat_id = u.get("chat_id")
+        if not chat_id or exp > time.time() - MEMBERSHIP_GRACE or u.get("removed_for") == exp:
+            return True   # renewed, unlinked or already done
+        bot = self.bot()
+        for gid in self.groups_for(u.get("plan")):
+            # ban + unban: out of the group, but free to come back with an invite link
+            if await self._call(bot.ban_chat_member, gid, int(chat_id)):
+                return False
+            if await self._call(bot.unban_chat_member, gid, int(chat_id), only_if_banned=True):
+                return False
+        if self.store.update_for_expiry(email, exp, removed_for=exp, removed_chat_id=int(chat_id),
+                                        removed_at=int(time.time())) is None:
+            # renewed while the calls were out: let them back in
+            self._readmit[email] = (int(chat_id), time.time())
+            self._wake.set()
+            return True
+        self.removed += 1
+        metrics.MEMBERSHIP_ACTIONS.inc(action="removed")
+        return True
+
+    async def _readmit_one(self, email: str, chat_id: int, queued_at: float) -> bool:
+        u = self.store.get(email)
+        now = time.time()
+        if not u or not u.get("active") or int(u.get("expires_at") or 0) <= now:
+            return True
+        if (u.get("readmitted_at") or 0) >= int(queued_at) or now - queued_at > READMIT_GIVE_UP:
+            return True
+        bot = self.bot()
+        links: List[Tuple[int, str]] = []
+        for gid in self.groups_for(u.get("plan")):
+            if await self._call(bot.unban_chat_member, gid, chat_id, only_if_banned=True):
+                return False
+            await self.bucket.acquire()
+            try:
+                link = await bot.create_chat_invite_link(gid, name=f"renewal {chat_id}"[:32],
+                                                         expire_date=int(now) + INVITE_LINK_TTL, member_limit=1)
+            except Exception as e:
+                print("Invite link for", gid, "failed:", e)
+                self.errors += 1
+                return False
+            links.append((gid, link.invite_link))
+        if links:
+            await self.notify(chat_id, u, links)
+        with self.store.transaction():
+            # re-read: the copy above may predate another worker's write
+            u = self.store.get(email)
+            if not u:
+                return True
+            fields: Dict[str, Any] = {"readmitted_at": int(now), "removed_for": None}
+            if not u.get("chat_id") and not self.store.find_by_chat(chat_id):
+                # the re-activation started a fresh record; it's the same subscriber
+                fields["chat_id"] = chat_id
+            self.store.update(email, **fields)
+        self.readmitted += 1
+        metrics.MEMBERSHIP_ACTIONS.inc(action="readmitted")
+        return True
+
+    # --------------------
+    # Sweep
+    # --------------------
+    def _expired_between(self, lo: float, hi: float) -> List[str]:
+        cols = getattr(self.store, "columns", None)
+        if cols is not None:
+            return cols.expired_between(lo, hi)
+        return [email for email, u in self.store.all().items()
+                if u.get("chat_id") and lo < int(u.get("expires_at") or 0) <= hi]
+
+    async def sweep_once(self) -> Dict[str, Any]:
+        async with self._lock:
+            started = time.perf_counter()
+            cp = self.load_checkpoint()
+            for email, cid, at in cp.get("readmit") or []:
+                self._readmit.setdefault(email, (int(cid), float(at)))
+            hi = time.time() - MEMBERSHIP_GRACE
+            lo = cp.get("swept_until") or hi - MEMBERSHIP_LOOKBACK_DAYS * 86400
+            if not cp.get("pending"):
+                # a new window, plus last window's failures; a resumed window keeps its list
+                found = self._expired_between(lo, hi) if hi > lo else []
+                cp.update(pending=sorted(set(cp.get("retry") or []) | set(found)), retry=[], swept_until=max(lo, hi))
+                self.save_checkpoint(cp)
+
+            pending = list(cp["pending"])
+            checked = len(pending)
+            removed = self.removed
+            while pending:
+                batch, pending = pending[:MEMBERSHIP_BATCH], pending[MEMBERSHIP_BATCH:]
+                done = await asyncio.gather(*(self._remove(email) for email in batch))
+                cp["retry"] = (cp.get("retry") or []) + [e for e, ok in zip(batch, done) if not ok]
+                cp["pending"] = pending
+                self.save_checkpoint(cp)
+
+            readmit = list(self._readmit.items())
+            readmitted = self.readmitted
+            for i in range(0, len(readmit), MEMBERSHIP_BATCH):
+                batch = readmit[i:i + MEMBERSHIP_BATCH]
+                done = await asyncio.gather(*(self._readmit_one(email, cid, at) for email, (cid, at) in batch))
+                for (email, v), ok in zip(batch, done):
+                    # failures stay queued for the next sweep
+                    if ok and self._readmit.get(email) == v:
+                        del self._readmit[email]
+                self.save_checkpoint(cp)
+
+            self.last_sweep = {
+                "window": [lo, cp["swept_until"]],
+                "checked": checked,
+                "removed": self.removed - removed,
+                "retry": len(cp["retry"]),
+                "readmitted": self.readmitted - readmitted,
+                "readmit_queued": len(self._readmit),
+                "seconds": round(time.perf_counter() - started, 3),
+            }
+            return self.last_sweep
+
+    async def run(self, interval: float = MEMBERSHIP_SWEEP_INTERVAL):
+        # leader only
+        if interval <= 0 or not self.groups:
+            return
+        while True:
+            self._wake.clear()
+            try:
+                async with metrics.task_run("membership_sweep"):
+                    await self.sweep_once()
+            except Exception as e:
+                print("Membership sweep failed:", e)
+            try:
+                await asyncio.wait_for(self._wake.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def queued(self) -> int:
+        return len(self._readmit)
+
+    def stats(self) -> Dict[str, Any]:
+        cp = self.load_checkpoint()
+        return {
+            "groups": self.groups,
+            "removed": self.removed,
+            "readmitted": self.readmitted,
+            "errors": self.errors,
+            "swept_until": cp.get("swept_until"),
+            "pending": len(cp.get("pending") or []),
+            "retry": len(cp.get("retry") or []),
+            "readmit_queued": len(self._readmit),
+            "last": self.last_sweep,
+        }
@@ -0,0 +1,195 @@
+# services/metrics.py
+# Minimal in-process metrics registry rendered in Prometheus text format.
+# Counters, gauges and histograms keep plain floats keyed by label values, so
+# recording a sample is a dict lookup and an add.
+import time
+import bisect
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: List["_Metric"] = []
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) and not v.is_integer() else str(int(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple:
+        return tuple(str(labels.get(n, "")) for n in self.label_names)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        return []
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        k = self._key(labels)
+        self.values[k] = self.values.get(k, 0) + amount
+
+    def _samples(self):
+        return [f"{self.name}{_labels(self.label_names, k)} {_fmt(v)}" for k, v in self.values.items()]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self.values: Dict[Tuple, float] = {}
+        self.functions: Dict[Tuple, Callable[[], float]] = {}
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+    def set_function(self, fn: Callable[[], float], **labels):
+        # evaluated at scrape time
+        self.functions[self._key(labels)] = fn
+
+    def _samples(self):
+        out = [f"{self.name}{_labels(self.label_names, k)} {_fmt(v)}" for k, v in self.values.items()]
+        for k, fn in self.functions.items():
+            try:
+                out.append(f"{self.name}{_labels(self.label_names, k)} {_fmt(fn())}")
+            except Exception:
+                pass
+        return out
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self.series: Dict[Tuple, List[float]] = {}   # key -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        k = self._key(labels)
+        s = self.series.get(k)
+        if s is None:
+            s = self.series[k] = [0.0] * (len(self.buckets) + 2)
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            s[i] += 1
+        s[-2] += value
+        s[-1] += 1
+
+    def time(self, **labels) -> "_Timer":
+        return _Timer(self, labels)
+
+    def _samples(self):
+        out = []
+        for k, s in self.series.items():
+            acc = 0.0
+            for b, c in zip(self.buckets, s):
+                acc += c
+                le = 'le="%s"' % _fmt(b)
+                out.append(f"{self.name}_bucket{_labels(self.label_names, k, le)} {_fmt(acc)}")
+            le = 'le="+Inf"'
+            out.append(f"{self.name}_bucket{_labels(self.label_names, k, le)} {_fmt(s[-1])}")
+            out.append(f"{self.name}_sum{_labels(self.label_names, k)} {_fmt(s[-2])}")
+            out.append(f"{self.name}_count{_labels(self.label_names, k)} {_fmt(s[-1])}")
+        return out
+
+
+class _Timer:
+    # with HIST.time(route="x"): ...   (also usable as an async context manager)
+    def __init__(self, hist: Histogram, labels: Dict[str, str]):
+        self.hist = hist
+        self.labels = labels
+        self.start: Optional[float] = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc):
+        return self.__exit__(*exc)
+
+
+def render() -> str:
+    lines: List[str] = []
+    for m in _registry:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+
+# --------------------
+# Metrics shared across modules
+# --------------------
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "aiohttp request latency", ("route", "method", "status"))
+PAYSTACK_VERIFY_LATENCY = Histogram("paystack_verify_duration_seconds", "Paystack transaction verify latency")
+PAYSTACK_VERIFY_TOTAL = Counter("paystack_verify_total", "Paystack verify calls by outcome", ("outcome",))
+STORE_LOAD_SECONDS = Histogram("user_store_load_seconds", "User store load duration", buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60))
+STORE_FLUSH_SECONDS = Histogram("user_store_flush_seconds", "User store batch write duration")
+STORE_COMPACT_SECONDS = Histogram("user_store_compact_seconds", "User store snapshot compaction duration", buckets=(0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60))
+STORE_FILE_BYTES = Gauge("user_store_file_bytes", "Size of the user store on disk")
+STORE_USERS = Gauge("user_store_users", "Users held in memory")
+HANDLER_LATENCY = Histogram("bot_handler_duration_seconds", "aiogram handler latency", ("bot", "handler"))
+TG_SEND_LATENCY = Histogram("telegram_send_duration_seconds", "Telegram sendMessage latency", ("bot",))
+TG_SEND_ERRORS = Counter("telegram_send_errors_total", "Failed Telegram send attempts", ("bot", "kind"))
+TG_POLLED_UPDATES = Counter("telegram_polled_updates_total", "Updates received through getUpdates", ("bot",))
+TG_SEND_429 = Counter("telegram_send_rate_limited_total", "Telegram 429 responses", ("bot",))
+TASK_LAST_RUN = Gauge("background_task_last_run_timestamp_seconds", "Last time a background task ran", ("task",))
+TASK_DURATION = Gauge("background_task_last_duration_seconds", "Duration of the last background task run", ("task",))
+TASK_RUNS = Counter("background_task_runs_total", "Background task runs", ("task", "status"))
+QUEUE_DEPTH = Gauge("queue_depth", "Items waiting in internal queues", ("queue",))
+SLIP_DELIVERY_LAG = Histogram("slip_delivery_lag_seconds", "Time from a slip's scheduled send time to delivery in a group",
+                              buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300))
+MEMBERSHIP_ACTIONS = Counter("group_membership_actions_total", "Expired subscribers removed from / re-admitted to groups", ("action",))
+SHED_REQUESTS = Counter("http_shed_requests_total", "Requests refused by rate limiting or load shedding", ("route", "reason"))
+
+
+class task_run:
+    # records last run / duration / outcome for a background task pass
+    def __init__(self, task: str):
+        self.task = task
+
+    async def __aenter__(self):
+        self.start = time.perf_counter()
+        TASK_LAST_RUN.set(time.time(), task=self.task)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        TASK_DURATION.set(time.perf_counter() - self.start, task=self.task)
+        TASK_RUNS.inc(task=self.task, status="error" if exc_type else "ok")
+        return False
@@ -0,0 +1,86 @@
+# services/middleware.py
+# aiohttp and aiogram middlewares shared by the runner.
+#
+# Both time every handler into the latency histograms and log the ones slower
+# than SLOW_HANDLER_SECONDS with what they were handling (route, or update
+# type and callback data), so a slow handler in production shows up by name.
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiohttp import web
+
+from services import metrics
+
+SLOW_HANDLER_SECONDS = float(os.getenv("SLOW_HANDLER_SECONDS", "0.5"))   # 0 = don't log
+
+
+def route_label(request: web.Request) -> str:
+    # the route template, not the raw path, to keep label cardinality bounded
+    route = request.match_info.route
+    resource = getattr(route, "resource", None)
+    if resource is not None:
+        return resource.canonical
+    return "unmatched"
+
+
+@web.middleware
+async def timing_middleware(request: web.Request, handler):
+    start = time.perf_counter()
+    status = 500
+    try:
+        resp = await handler(request)
+        status = resp.status
+        return resp
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        route = route_label(request)
+        metrics.HTTP_LATENCY.observe(elapsed, route=route, method=request.method, status=status)
+        if SLOW_HANDLER_SECONDS and elapsed >= SLOW_HANDLER_SECONDS:
+            name = getattr(request.match_info.handler, "__name__", "?")
+            print(f"Slow request {elapsed:.3f}s: {request.method} {route} ({name}) -> {status}")
+
+
+def handler_label(event: Any, data: Dict[str, Any]) -> str:
+    # the matched handler's function name, never text or callback data from the user:
+    # those would make one latency series per distinct value anyone cares to send
+    h = data.get("handler")
+    name = getattr(getattr(h, "callback", None), "__name__", None)
+    return name or type(event).__name__
+
+
+def describe_event(event: Any, data: Dict[str, Any]) -> str:
+    # for the slow-handler log: handler function, update type, chat / user and text or callback data
+    h = data.get("handler")
+    name = getattr(getattr(h, "callback", None), "__name__", "?")
+    parts = [name, type(event).__name__]
+    chat = getattr(getattr(event, "chat", None), "id", None) or getattr(getattr(getattr(event, "message", None), "chat", None), "id", None)
+    user = getattr(getattr(event, "from_user", None), "id", None)
+    if chat is not None:
+        parts.append(f"chat={chat}")
+    if user is not None:
+        parts.append(f"user={user}")
+    cb_data = getattr(event, "data", None)
+    if isinstance(cb_data, str):
+        parts.append(f"data={cb_data[:64]!r}")
+    text = getattr(event, "text", None)
+    if isinstance(text, str):
+        parts.append(f"text={text[:64]!r}")
+    return " ".join(parts)
+
+
+def aiogram_timing(bot_name: str) -> Callable:
+    # register with dp.message.middleware(...) / dp.callback_query.middleware(...)
+    async def middleware(handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]], event: Any, data: Dict[str, Any]):
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.HANDLER_LATENCY.observe(elapsed, bot=bot_name, handler=handler_label(event, data))
+            if SLOW_HANDLER_SECONDS and elapsed >= SLOW_HANDLER_SECONDS:
+                print(f"Slow {bot_name} bot handler {elapsed:.3f}s: {describe_event(event, data)}")
+    return middleware
@@ -0,0 +1,145 @@
+# services/migrate.py
+# One-shot copy of the JSON store into SQLite.
+#
+#   python -m services.migrate [--users data/users.json] [--games data/games.json] [--db data/stakeaware.db]
+#
+# users.json is streamed entry by entry (it is never loaded whole) and written
+# in batched transactions; a pending users.journal is replayed on top.
+import sys
+import json
+import argparse
+from pathlib import Path
+from typing import Iterator, Tuple, Any
+
+from services.storage import DATA_DIR, SQLITE_PATH, SqliteBackend, JsonBackend, load_json, _user_row
+
+BATCH = 1000
+CHUNK = 1 << 16
+
+_WS = " \t\r\n"
+
+
+def iter_object_items(p: Path) -> Iterator[Tuple[str, Any]]:
+    # incremental parse of a top-level {"key": value, ...} document
+    decoder = json.JSONDecoder()
+    with open(p, "r", encoding="utf-8") as f:
+        buf = ""
+        pos = 0
+        eof = False
+
+        def fill():
+            nonlocal buf, pos, eof
+            chunk = f.read(CHUNK)
+            if not chunk:
+                eof = True
+            buf = buf[pos:] + chunk
+            pos = 0
+
+        def skip_ws():
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in _WS:
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return
+                fill()
+
+        def decode():
+            nonlocal pos
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                    # a number at the end of the buffer may continue in the next chunk
+                    if end < len(buf) or eof:
+                        pos = end
+                        return value
+                except ValueError:
+                    if eof:
+                        raise
+                fill()
+
+        def expect(ch: str) -> bool:
+            nonlocal pos
+            skip_ws()
+            if pos < len(buf) and buf[pos] == ch:
+                pos += 1
+                return True
+            return False
+
+        fill()
+        skip_ws()
+        if pos >= len(buf):
+            return
+        if not expect("{"):
+            raise ValueError(f"{p} is not a JSON object")
+        if expect("}"):
+            return
+        while True:
+            skip_ws()
+            key = decode()
+            if not expect(":"):
+                raise ValueError(f"expected ':' after {key!r} in {p}")
+            skip_ws()
+            value = decode()
+            yield key, value
+            if expect(","):
+                continue
+            if expect("}"):
+                return
+            raise ValueError(f"expected ',' or '}}' after {key!r} in {p}")
+
+
+def migrate(users_file: Path, games_file: Path, db_path: Path):
+    db = SqliteBackend(db_path)
+    count = 0
+    if users_file.exists():
+        rows = []
+        for email, u in iter_object_items(users_file):
+            rows.append(_user_row(email, u))
+            if len(rows) >= BATCH:
+                db.put_user_rows(rows)
+                count += len(rows)
+                rows = []
+        if rows:
+            db.put_user_rows(rows)
+            count += len(rows)
+
+    # apply anything still sitting in the JSON backend's journal, in order
+    replayed = 0
+    journal = JsonBackend(users_file, games_file)
+    for p in (journal.rotated_path, journal.journal_path):
+        if not p.exists():
+            continue
+        entries = []
+        with open(p, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                entries.append((entry.get("op"), entry["email"], entry.get("user")))
+                if len(entries) >= BATCH:
+                    db.write_users(entries)
+                    replayed += len(entries)
+                    entries = []
+        db.write_users(entries)
+        replayed += len(entries)
+
+    games = load_json(games_file).get("games", []) if games_file.exists() else []
+    db.save_games(games)
+    db.close()
+    print(f"Migrated {count} users (+{replayed} journal entries) and {len(games)} games into {db_path}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Copy users.json / games.json into the SQLite backend")
+    ap.add_argument("--users", default=str(DATA_DIR / "users.json"))
+    ap.add_argument("--games", default=str(DATA_DIR / "games.json"))
+    ap.add_argument("--db", default=str(SQLITE_PATH))
+    args = ap.parse_args(argv)
+    migrate(Path(args.users), Path(args.games), Path(args.db))
+    print("Set STORAGE_BACKEND=sqlite to use it.")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
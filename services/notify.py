@@ -0,0 +1,102 @@
+# services/notify.py
+# Coalesces admin notifications into digests.
+#
+# Events are buffered by kind ("activated", "renewed", "expired", ...) and sent
+# as one message per admin when the window since the first buffered event
+# closes or when a kind reaches max_items. Urgent events skip the buffer.
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Set
+
+TELEGRAM_MAX_TEXT = 4096
+
+
+class AdminDigest:
+    def __init__(self, send: Callable[[str], Awaitable[None]], window: float = 30.0,
+                 max_items: int = 50, urgent_kinds: Sequence[str] = ()):
+        self.send = send
+        self.window = window
+        self.max_items = max_items
+        self.urgent_kinds = set(urgent_kinds)
+        self.digests_sent = 0
+        self.events = 0
+        self._buffer: Dict[str, List[str]] = {}
+        self._first_at: Optional[float] = None
+        self._wake = asyncio.Event()
+        self._sending: Set[asyncio.Task] = set()   # urgent sends in flight
+
+    def add(self, kind: str, text: str, urgent: bool = False):
+        self.events += 1
+        if urgent or kind in self.urgent_kinds or self.window <= 0:
+            t = asyncio.create_task(self.send(text))
+            self._sending.add(t)
+            t.add_done_callback(self._sent)
+            return
+        if self._first_at is None:
+            self._first_at = asyncio.get_running_loop().time()
+            self._wake.set()   # start the window clock
+        items = self._buffer.setdefault(kind, [])
+        items.append(text)
+        if len(items) >= self.max_items:
+            self._wake.set()
+
+    def pending(self) -> int:
+        return sum(len(v) for v in self._buffer.values())
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # woken by the first buffered event, or by a kind filling up
+            await self._wake.wait()
+            self._wake.clear()
+            if self._first_at is None:
+                continue
+            deadline = self._first_at + self.window
+            while not self._any_full():
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self._wake.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                self._wake.clear()
+            await self.flush()
+
+    def _any_full(self) -> bool:
+        return any(len(v) >= self.max_items for v in self._buffer.values())
+
+    def _sent(self, t: asyncio.Task):
+        self._sending.discard(t)
+        if not t.cancelled() and t.exception() is not None:
+            print("Urgent admin notice failed:", t.exception())
+
+    async def flush(self):
+        if self._sending:
+            # urgent sends still going, so shutdown waits for them too
+            await asyncio.gather(*self._sending, return_exceptions=True)
+        if not self._buffer:
+            return
+        buffer, self._buffer = self._buffer, {}
+        self._first_at = None
+        for text in self.render(buffer):
+            await self.send(text)
+        self.digests_sent += 1
+
+    def render(self, buffer: Dict[str, List[str]]) -> List[str]:
+        total = sum(len(v) for v in buffer.values())
+        lines = [f"📋 Admin digest — {total} event(s)"]
+        for kind, items in buffer.items():
+            lines.append("")
+            lines.append(f"{kind} ({len(items)}):")
+            lines.extend(f"• {t}" for t in items)
+        # split on line boundaries to stay under Telegram's message limit
+        chunks, cur = [], ""
+        for line in lines:
+            line = line[:TELEGRAM_MAX_TEXT - 1]
+            if cur and len(cur) + len(line) + 1 > TELEGRAM_MAX_TEXT:
+                chunks.append(cur)
+                cur = ""
+            cur = f"{cur}\n{line}" if cur else line
+        if cur:
+            chunks.append(cur)
+        return chunks
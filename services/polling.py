@@ -0,0 +1,135 @@
+# services/polling.py
+# Long-polls getUpdates for a bot, for running without a public URL (behind
+# NAT, local runs and benchmarks) instead of receiving webhooks.
+#
+# Each call waits up to POLL_TIMEOUT seconds on Telegram's side and returns up
+# to POLL_LIMIT (at most 100) updates. The batch goes into the same
+# UpdateExecutor the webhook route feeds, so dedup, per-chat ordering and the
+# in-flight cap are shared. The next call's offset, which is what confirms
+# updates to Telegram, only moves past a batch once every update in it has been
+# handled: a crash or restart mid-batch gets the batch again rather than losing
+# it.
+#
+# Updates are fetched with the shared aiohttp session and handed over as the raw
+# dicts, so they're parsed once, by the dispatcher. getUpdates refuses to run
+# while a webhook is set, so run() deletes it first. Only one process may poll a
+# bot at a time; the runner starts pollers as leader jobs.
+import os
+import asyncio
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+from services import http_client, metrics
+
+POLL_TIMEOUT = int(os.getenv("POLL_TIMEOUT", "30"))               # seconds Telegram holds an empty poll
+POLL_LIMIT = max(1, min(100, int(os.getenv("POLL_LIMIT", "100"))))
+POLL_RETRY_MAX = float(os.getenv("POLL_RETRY_MAX", "30"))          # seconds between failed polls, at most
+
+DEFAULT_API = "https://api.telegram.org"
+
+
+class PollError(Exception):
+    def __init__(self, code: Optional[int], description: str, retry_after: Optional[int] = None):
+        super().__init__(f"{code}: {description}")
+        self.code = code
+        self.retry_after = retry_after
+
+
+class UpdatePoller:
+    def __init__(self, name: str, token: str, executor, timeout: int = POLL_TIMEOUT, limit: int = POLL_LIMIT):
+        self.name = name
+        self.token = token
+        self.executor = executor     # services.updates.UpdateExecutor
+        self.timeout = timeout
+        self.limit = limit
+        self.offset: Optional[int] = None      # next getUpdates offset; confirms everything below it
+        self.committed: Optional[int] = None   # offset Telegram has last been sent
+        self._batch_end: Optional[int] = None  # offset past the batch being handled
+        self.polls = 0
+        self.received = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+        self.running = False
+
+    def _url(self, method: str) -> str:
+        return f"{(http_client.TELEGRAM_API_BASE or DEFAULT_API).rstrip('/')}/bot{self.token}/{method}"
+
+    async def _call(self, method: str, params: Dict[str, Any], timeout: float) -> Any:
+        session = http_client.get_session()
+        async with session.post(self._url(method), json=params, timeout=aiohttp.ClientTimeout(total=timeout)) as r:
+            data = await r.json(content_type=None)
+        if not data.get("ok"):
+            raise PollError(data.get("error_code"), data.get("description") or "",
+                            (data.get("parameters") or {}).get("retry_after"))
+        return data["result"]
+
+    async def _get_updates(self) -> List[Dict[str, Any]]:
+        params: Dict[str, Any] = {"timeout": self.timeout, "limit": self.limit}
+        if self.offset is not None:
+            params["offset"] = self.offset
+        updates = await self._call("getUpdates", params, self.timeout + http_client.HTTP_TIMEOUT)
+        self.committed = self.offset
+        self.polls += 1
+        return updates
+
+    async def run(self):
+        self.running = True
+        try:
+            try:
+                await self._call("deleteWebhook", {"drop_pending_updates": False}, http_client.HTTP_TIMEOUT)
+            except Exception as e:
+                print(f"{self.name} bot: could not delete the webhook before polling:", e)
+            print(f"{self.name} bot: polling getUpdates")
+            failures = 0
+            while True:
+                try:
+                    updates = await self._get_updates()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    failures += 1
+                    self.errors += 1
+                    self.last_error = f"{type(e).__name__}: {e}"
+                    # 409: a webhook was set again or another process polls this bot
+                    delay = getattr(e, "retry_after", None) or min(POLL_RETRY_MAX, 2 ** failures)
+                    print(f"{self.name} bot: getUpdates failed ({self.last_error}); retrying in {delay}s")
+                    await asyncio.sleep(delay)
+                    continue
+                failures = 0
+                if not updates:
+                    continue
+                self.received += len(updates)
+                metrics.TG_POLLED_UPDATES.inc(len(updates), bot=self.name)
+                self._batch_end = max(u["update_id"] for u in updates) + 1
+                for u in updates:
+                    while not self.executor.submit(u):
+                        # queue full: wait for room rather than drop the update
+                        await asyncio.sleep(0.1)
+                await self.executor.idle()
+                self.offset = self._batch_end
+        finally:
+            self.running = False
+
+    async def commit(self):
+        # after run() was stopped (shutdown): confirm a batch that finished meanwhile, so a
+        # restart doesn't handle it twice. Called once the executor has drained.
+        if self._batch_end is not None and self.executor.pending == 0:
+            self.offset = self._batch_end
+        if self.offset is None or self.offset == self.committed:
+            return
+        try:
+            await self._call("getUpdates", {"offset": self.offset, "limit": 1, "timeout": 0}, http_client.HTTP_TIMEOUT)
+            self.committed = self.offset
+        except Exception as e:
+            print(f"{self.name} bot: could not confirm updates before {self.offset}:", e)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "offset": self.offset,
+            "polls": self.polls,
+            "received": self.received,
+            "errors": self.errors,
+            "last_error": self.last_error,
+        }
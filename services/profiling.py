@@ -0,0 +1,122 @@
+# services/profiling.py
+# On-demand profiling of a live process, behind the admin endpoints.
+#
+#   profile_for(seconds)   cProfile on the event loop thread for a while, so it
+#                          sees every handler and background task that runs
+#                          meanwhile; returns the pstats report (or the raw
+#                          stats for snakeviz / pstats.Stats)
+#   MemoryTracker          tracemalloc start / stop, snapshots and the diff
+#                          against the previous one, grouped by line or file
+#
+# Both cost while they run (cProfile roughly doubles handler time, tracemalloc
+# slows every allocation), so they're off until asked for and bounded.
+import io
+import os
+import time
+import pstats
+import asyncio
+import cProfile
+import marshal
+import tracemalloc
+from typing import Any, Dict, Optional
+
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "120"))
+TRACEMALLOC_FRAMES = int(os.getenv("TRACEMALLOC_FRAMES", "10"))
+
+SORT_KEYS = ("cumulative", "tottime", "calls", "ncalls", "time", "filename", "name")
+GROUP_BY = ("lineno", "filename", "traceback")
+
+_profiling = asyncio.Lock()
+
+
+class ProfilerBusy(RuntimeError):
+    pass
+
+
+async def profile_for(seconds: float, sort: str = "cumulative", limit: int = 50,
+                      raw: bool = False) -> Any:
+    # text report, or the marshalled stats (pstats.Stats can load them) with raw=True
+    if sort not in SORT_KEYS:
+        raise ValueError(f"sort must be one of {', '.join(SORT_KEYS)}")
+    seconds = max(0.1, min(float(seconds), PROFILE_MAX_SECONDS))
+    if _profiling.locked():
+        raise ProfilerBusy("a profile is already running")
+    async with _profiling:
+        prof = cProfile.Profile()
+        started = time.time()
+        prof.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            prof.disable()
+    prof.create_stats()
+    if raw:
+        return marshal.dumps(prof.stats)
+    out = io.StringIO()
+    out.write(f"cProfile of pid {os.getpid()} for {seconds:.1f}s from {time.strftime('%H:%M:%S', time.gmtime(started))} UTC\n")
+    stats = pstats.Stats(prof, stream=out)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+
+class MemoryTracker:
+    def __init__(self):
+        self.snapshot: Optional[tracemalloc.Snapshot] = None
+        self.snapshot_at: Optional[float] = None
+
+    def start(self, frames: int = TRACEMALLOC_FRAMES) -> Dict[str, Any]:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(max(1, frames))
+        return self.status()
+
+    def stop(self) -> Dict[str, Any]:
+        tracemalloc.stop()
+        self.snapshot = self.snapshot_at = None
+        return self.status()
+
+    def status(self) -> Dict[str, Any]:
+        tracing = tracemalloc.is_tracing()
+        current, peak = tracemalloc.get_traced_memory() if tracing else (0, 0)
+        return {
+            "tracing": tracing,
+            "frames": tracemalloc.get_traceback_limit() if tracing else None,
+            "traced_bytes": current,
+            "peak_bytes": peak,
+            "overhead_bytes": tracemalloc.get_tracemalloc_memory() if tracing else 0,
+            "snapshot_at": self.snapshot_at,
+        }
+
+    def take(self, group_by: str = "lineno", limit: int = 30) -> Dict[str, Any]:
+        # new snapshot: its top allocations and what grew since the previous one.
+        # Heavy for a big heap; call it on a thread.
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not running; start it first")
+        if group_by not in GROUP_BY:
+            raise ValueError(f"group_by must be one of {', '.join(GROUP_BY)}")
+        snap = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        prev, prev_at = self.snapshot, self.snapshot_at
+        self.snapshot, self.snapshot_at = snap, time.time()
+        out: Dict[str, Any] = {
+            "status": self.status(),
+            "top": [_stat(s) for s in snap.statistics(group_by)[:limit]],
+        }
+        if prev is not None:
+            out["diff_since"] = prev_at
+            out["diff"] = [_stat(s) for s in snap.compare_to(prev, group_by)[:limit]]
+        return out
+
+
+def _stat(s: Any) -> Dict[str, Any]:
+    d = {
+        "where": [f"{f.filename}:{f.lineno}" for f in s.traceback][:TRACEMALLOC_FRAMES],
+        "bytes": s.size,
+        "count": s.count,
+    }
+    if hasattr(s, "size_diff"):
+        d["bytes_diff"] = s.size_diff
+        d["count_diff"] = s.count_diff
+    return d
+
@@ -0,0 +1,275 @@
+# services/publisher.py
+# Scheduled betting-slip posts fanned out to the subscriber groups.
+#
+# An admin queues a slip with a send time; it is rendered and routed right
+# away and stored with the storage backend, so at the send time the only work
+# left is the sends, which go to every group at once. Each group's outcome is
+# written back to the post as it arrives, so a restart mid-send resumes with
+# the groups that haven't got it yet.
+#
+# post structure: { id, status, send_at, created_at, plans, targets, games, text,
+#                   started_at, finished_at, deliveries: { chat_id: {ok, error, attempts, at} } }
+# status: scheduled -> sending -> sent | partial | failed, or cancelled
+#
+# Routing: SLIP_ROUTES maps plans to any number of groups, e.g.
+#   SLIP_ROUTES='{"daily": [-1001, -1002], "weekend": [-1003]}'
+# (defaults to DAILY_GROUP_ID / WEEKEND_GROUP_ID), and SLIP_PLAN_DAYS limits a
+# plan to some weekdays, Monday=0 (default: weekend plan Fri-Sun). Weekdays are
+# taken in UTC at the send time, like every other date the bots show.
+import os
+import json
+import time
+import uuid
+import asyncio
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from services import cluster, metrics
+from services.games import GameSlip
+
+SLIP_SEND_TIMEOUT = float(os.getenv("SLIP_SEND_TIMEOUT", "300"))     # a post still "sending" after this is resumed
+SLIP_POLL_INTERVAL = float(os.getenv("SLIP_POLL_INTERVAL", "5"))     # multi-worker: pick up posts queued elsewhere
+SLIP_HISTORY_DAYS = int(os.getenv("SLIP_HISTORY_DAYS", "30"))
+
+MAX_SLEEP = 3600
+
+
+def _int_list(v: Any) -> List[int]:
+    return [int(x) for x in (v if isinstance(v, list) else [v]) if int(x)]
+
+
+def load_routes() -> Dict[str, List[int]]:
+    raw = os.getenv("SLIP_ROUTES")
+    if raw:
+        return {plan: _int_list(groups) for plan, groups in json.loads(raw).items()}
+    return {
+        "daily": _int_list(int(os.getenv("DAILY_GROUP_ID", "0"))),
+        "weekend": _int_list(int(os.getenv("WEEKEND_GROUP_ID", "0"))),
+    }
+
+
+def load_plan_days() -> Dict[str, List[int]]:
+    raw = os.getenv("SLIP_PLAN_DAYS")
+    if raw:
+        return {plan: [int(d) for d in days] for plan, days in json.loads(raw).items()}
+    return {"weekend": [4, 5, 6]}  # Fri, Sat, Sun
+
+
+def utc_weekday(ts: float) -> int:
+    return datetime.fromtimestamp(ts, timezone.utc).weekday()
+
+
+def route(routes: Dict[str, List[int]], plan_days: Dict[str, List[int]], send_at: float,
+          plans: Optional[Iterable[str]] = None) -> List[int]:
+    # groups for the plans that post on send_at's (UTC) weekday, each group once
+    day = utc_weekday(send_at)
+    targets: List[int] = []
+    for plan in (plans if plans is not None else routes):
+        days = plan_days.get(plan)
+        if days is not None and day not in days:
+            continue
+        for gid in routes.get(plan, []):
+            if gid not in targets:
+                targets.append(gid)
+    return targets
+
+
+def parse_plans(value: Any) -> Optional[List[str]]:
+    # None (every plan), a list, or "daily weekend" / "daily,weekend" from a form or query
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value.replace(",", " ").split() or None
+    if isinstance(value, (list, tuple)):
+        return [str(p) for p in value]
+    raise ValueError("plans must be a list of plan names")
+
+
+def parse_games(value: Any) -> List[str]:
+    # a non-empty list of game lines, as the admin would type them into the bot
+    if not isinstance(value, list) or not value:
+        raise ValueError("games must be a non-empty list of game lines")
+    if not all(isinstance(g, str) and g.strip() for g in value):
+        raise ValueError("every game must be a non-blank string")
+    return [g.strip() for g in value]
+
+
+def parse_send_at(text: str, now: Optional[float] = None) -> float:
+    # "now", "+45m" / "+2h", "18:30" (next time it is 18:30 UTC), "2026-05-01 18:30" (UTC) or a unix time
+    now = time.time() if now is None else now
+    text = text.strip()
+    if text in ("", "now"):
+        return now
+    if text.startswith("+"):
+        unit = {"m": 60, "h": 3600, "d": 86400}.get(text[-1])
+        if unit is None:
+            raise ValueError(f"bad delay: {text}")
+        return now + float(text[1:-1]) * unit
+    if text.replace(".", "", 1).isdigit():
+        return float(text)
+    if len(text) <= 5 and ":" in text:
+        hh, mm = (int(x) for x in text.split(":"))
+        today = datetime.fromtimestamp(now, timezone.utc).replace(hour=hh, minute=mm, second=0, microsecond=0)
+        ts = today.timestamp()
+        return ts if ts > now else ts + 86400
+    return datetime.fromisoformat(text).replace(tzinfo=timezone.utc).timestamp()
+
+
+class SlipPublisher:
+    def __init__(self, backend, broadcaster: Callable[[], Any], title: str,
+                 routes: Optional[Dict[str, List[int]]] = None,
+                 plan_days: Optional[Dict[str, List[int]]] = None):
+        self.backend = backend
+        self.broadcaster = broadcaster   # called at send time: bots are built lazily
+        self.title = title
+        self.routes = routes if routes is not None else load_routes()
+        self.plan_days = plan_days if plan_days is not None else load_plan_days()
+        self.published = 0
+        self.delivered = 0
+        self.failed = 0
+        self._wake = asyncio.Event()
+
+    # --------------------
+    # Queue
+    # --------------------
+    def schedule(self, games: Iterable[Any], send_at: float, plans: Optional[List[str]] = None) -> Dict[str, Any]:
+        slip = GameSlip(games)
+        if not slip:
+            raise ValueError("no games to post")
+        if plans is not None:
+            unknown = [p for p in plans if p not in self.routes]
+            if unknown:
+                raise ValueError(f"unknown plan(s): {', '.join(unknown)}")
+        post = {
+            "id": uuid.uuid4().hex[:10],
+            "status": "scheduled",
+            "send_at": float(send_at),
+            "created_at": time.time(),
+            "plans": plans,
+            # rendered and routed now so nothing but the sends is left for the send time
+            "targets": route(self.routes, self.plan_days, send_at, plans),
+            "games": slip.to_json(),
+            "text": slip.render(self.title),
+            "started_at": None,
+            "finished_at": None,
+            "deliveries": {},
+        }
+        if not post["targets"]:
+            raise ValueError("no groups are routed for that day")
+        self.backend.save_post(post)
+        self._wake.set()
+        return post
+
+    def cancel(self, post_id: str) -> Optional[Dict[str, Any]]:
+        with self.backend.transaction():
+            post = self.backend.load_post(post_id)
+            if post is None or post["status"] != "scheduled":
+                return post
+            post["status"] = "cancelled"
+            self.backend.save_post(post)
+        self._wake.set()
+        return post
+
+    def get(self, post_id: str) -> Optional[Dict[str, Any]]:
+        return self.backend.load_post(post_id)
+
+    def list(self, pending_only: bool = False) -> List[Dict[str, Any]]:
+        return self.backend.load_posts(pending_only)
+
+    def pending(self) -> int:
+        return len(self.backend.load_posts(pending_only=True))
+
+    # --------------------
+    # Sending
+    # --------------------
+    def _claim(self, post_id: str, retry: bool = False) -> Optional[Dict[str, Any]]:
+        # flips the post to "sending" under the backend lock, so one worker sends it
+        with self.backend.transaction():
+            post = self.backend.load_post(post_id)
+            if post is None:
+                return None
+            now = time.time()
+            st = post["status"]
+            stale = st == "sending" and (post.get("started_at") or 0) < now - SLIP_SEND_TIMEOUT
+            if not (st == "scheduled" or stale or (retry and st in ("partial", "failed"))):
+                return None
+            post["status"] = "sending"
+            post["started_at"] = now
+            self.backend.save_post(post)
+            return post
+
+    async def publish(self, post_id: str, retry: bool = False) -> Optional[Dict[str, Any]]:
+        # sends to every group that hasn't had it yet; None if someone else has the post
+        post = self._claim(post_id, retry)
+        if post is None:
+            return None
+        b = self.broadcaster()
+        todo = [gid for gid in post["targets"] if not (post["deliveries"].get(str(gid)) or {}).get("ok")]
+
+        async def one(gid: int):
+            r = await b.send(gid, post["text"], parse_mode="Markdown")
+            now = time.time()
+            post["deliveries"][str(gid)] = {"ok": r["ok"], "error": r["error"], "attempts": r["attempts"], "at": now}
+            if r["ok"]:
+                self.delivered += 1
+                metrics.SLIP_DELIVERY_LAG.observe(max(0.0, now - post["send_at"]))
+            else:
+                self.failed += 1
+                print("Failed to post slip", post["id"], "to", gid, r["error"])
+            # per group, so a restart only resends what is missing
+            self.backend.save_post(post)
+
+        await asyncio.gather(*(one(gid) for gid in todo))
+        ok = sum(1 for gid in post["targets"] if (post["deliveries"].get(str(gid)) or {}).get("ok"))
+        post["status"] = "sent" if ok == len(post["targets"]) else "partial" if ok else "failed"
+        post["finished_at"] = time.time()
+        self.backend.save_post(post)
+        self.published += 1
+        return post
+
+    def delivered_count(self, post: Dict[str, Any]) -> int:
+        return sum(1 for d in post["deliveries"].values() if d.get("ok"))
+
+    # --------------------
+    # Loop (leader only)
+    # --------------------
+    def _due(self, post: Dict[str, Any], now: float) -> bool:
+        if post["status"] == "scheduled":
+            return post["send_at"] <= now
+        return (post.get("started_at") or 0) < now - SLIP_SEND_TIMEOUT
+
+    async def run(self):
+        while True:
+            self._wake.clear()
+            try:
+                posts = self.backend.load_posts(pending_only=True)
+            except Exception as e:
+                print("Slip publisher failed to load posts:", e)
+                posts = []
+            now = time.time()
+            due = [p for p in posts if self._due(p, now)]
+            if due:
+                async with metrics.task_run("slip_publisher"):
+                    await asyncio.gather(*(self.publish(p["id"]) for p in due))
+                continue
+            heads = [p["send_at"] if p["status"] == "scheduled" else p["started_at"] + SLIP_SEND_TIMEOUT for p in posts]
+            delay = min(heads) - now if heads else MAX_SLEEP
+            if cluster.MULTI_WORKER:
+                # posts queued by other workers don't wake us
+                delay = min(delay, SLIP_POLL_INTERVAL)
+            try:
+                await asyncio.wait_for(self._wake.wait(), min(MAX_SLEEP, max(0.0, delay)))
+            except asyncio.TimeoutError:
+                pass
+
+    def prune(self):
+        self.backend.prune_posts(time.time() - SLIP_HISTORY_DAYS * 86400)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "routes": self.routes,
+            "plan_days": self.plan_days,
+            "published": self.published,
+            "delivered": self.delivered,
+            "failed": self.failed,
+        }
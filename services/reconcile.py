@@ -0,0 +1,192 @@
+# services/reconcile.py
+# Catches up on Paystack payments whose webhook never arrived (downtime,
+# signature mismatch, ...).
+#
+# A run pages GET /transaction?status=success&from=&to= for the window since
+# the last run, several pages in flight at once, and keeps the transactions
+# the store doesn't reflect yet (is_missing). They are handed to apply() in one
+# batch at the end, and the window start moves up to the run's end (less an
+# overlap for payments Paystack records late).
+#
+# Progress is saved to a cursor file after every wave of pages:
+#   {"since": iso, "run": {"from", "to", "next_page", "page_count", "seen", "missing": [tx]}}
+# so an interrupted run resumes at the next page of the same window instead of
+# starting over. "to" is fixed when a run starts, so pages don't shift under it
+# while new payments come in (the list is newest first).
+#
+# python -m services.reconcile [--since 2026-05-01] prints what a run would apply
+# against the data on disk without changing anything.
+import os
+import time
+import asyncio
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from services import http_client, metrics
+from services.storage import load_json, save_json
+
+RECONCILE_PER_PAGE = int(os.getenv("RECONCILE_PER_PAGE", "100"))
+RECONCILE_CONCURRENCY = int(os.getenv("RECONCILE_CONCURRENCY", "4"))     # pages in flight
+RECONCILE_LOOKBACK_DAYS = int(os.getenv("RECONCILE_LOOKBACK_DAYS", "30"))  # first run only
+RECONCILE_OVERLAP = int(os.getenv("RECONCILE_OVERLAP", "3600"))           # seconds re-read on the next run
+
+
+def to_iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def parse_ts(value: Any) -> Optional[int]:
+    # Paystack timestamps: "2026-05-01T18:30:00.000Z"
+    if not value:
+        return None
+    try:
+        return int(datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp())
+    except ValueError:
+        return None
+
+
+class PaystackReconciler:
+    def __init__(self, api_base: str, secret_key: str, cursor_path: Path,
+                 per_page: int = RECONCILE_PER_PAGE, concurrency: int = RECONCILE_CONCURRENCY):
+        self.api_base = api_base.rstrip("/")
+        self.secret_key = secret_key
+        self.cursor_path = Path(cursor_path)
+        self.per_page = per_page
+        self.concurrency = max(1, concurrency)
+        self.runs = 0
+        self.applied = 0
+        self.last_summary: Optional[Dict[str, Any]] = None
+        self._lock = asyncio.Lock()
+
+    # --------------------
+    # Paystack
+    # --------------------
+    async def fetch_page(self, page: int, since: str, until: str) -> Dict[str, Any]:
+        params = {"perPage": self.per_page, "page": page, "status": "success", "from": since, "to": until}
+        headers = {"Authorization": f"Bearer {self.secret_key}"}
+        async with http_client.get_session().get(f"{self.api_base}/transaction", params=params, headers=headers) as r:
+            if r.status != 200:
+                raise RuntimeError(f"Paystack transaction list page {page}: HTTP {r.status}")
+            j = await r.json()
+        if not j.get("status"):
+            raise RuntimeError(f"Paystack transaction list page {page}: {j.get('message')}")
+        return j
+
+    # --------------------
+    # Cursor
+    # --------------------
+    def load_cursor(self) -> Dict[str, Any]:
+        return load_json(self.cursor_path)
+
+    def save_cursor(self, cursor: Dict[str, Any]):
+        save_json(self.cursor_path, cursor)
+
+    def _start_run(self, cursor: Dict[str, Any], since: Optional[str]) -> Dict[str, Any]:
+        run = cursor.get("run")
+        if run and not since:
+            return run   # resume
+        start = since or cursor.get("since") or to_iso(time.time() - RECONCILE_LOOKBACK_DAYS * 86400)
+        return {"from": start, "to": to_iso(time.time()), "next_page": 1, "page_count": None,
+                "seen": 0, "missing": []}
+
+    # --------------------
+    # Run
+    # --------------------
+    async def run_once(self, is_missing: Callable[[Dict[str, Any]], bool],
+                       apply: Optional[Callable[[List[Dict[str, Any]]], Any]] = None,
+                       since: Optional[str] = None) -> Dict[str, Any]:
+        # apply=None is a dry run: nothing is applied and the cursor is left alone
+        async with self._lock:
+            started = time.perf_counter()
+            cursor = self.load_cursor()
+            run = self._start_run(cursor, since)
+            missing = {tx["reference"]: tx for tx in run["missing"]}
+            while run["page_count"] is None or run["next_page"] <= run["page_count"]:
+                first = run["next_page"]
+                last = first if run["page_count"] is None else min(run["page_count"], first + self.concurrency - 1)
+                pages = await asyncio.gather(*(self.fetch_page(p, run["from"], run["to"]) for p in range(first, last + 1)))
+                for j in pages:
+                    meta = j.get("meta") or {}
+                    run["page_count"] = int(meta.get("pageCount") or 0)
+                    for tx in j.get("data") or []:
+                        run["seen"] += 1
+                        ref = tx.get("reference")
+                        if ref and ref not in missing and is_missing(tx):
+                            missing[ref] = tx
+                run["next_page"] = last + 1
+                run["missing"] = list(missing.values())
+                if apply is not None:
+                    # resumable from the next wave
+                    self.save_cursor({"since": cursor.get("since"), "run": run})
+
+            txs = sorted(missing.values(), key=lambda t: parse_ts(t.get("paid_at")) or 0)
+            result = None
+            if apply is not None:
+                # re-checked: webhooks may have landed while pages were fetched
+                txs = [tx for tx in txs if is_missing(tx)]
+                if txs:
+                    result = apply(txs)
+                    if asyncio.iscoroutine(result):
+                        result = await result
+                since_ts = (parse_ts(run["to"]) or time.time()) - RECONCILE_OVERLAP
+                self.save_cursor({"since": max(run["from"], to_iso(since_ts))})
+                self.runs += 1
+                self.applied += len(txs)
+            summary = {
+                "from": run["from"],
+                "to": run["to"],
+                "pages": run["page_count"],
+                "transactions": run["seen"],
+                "missing": len(txs),
+                "references": [tx["reference"] for tx in txs[:100]],
+                "applied": result,
+                "dry_run": apply is None,
+                "seconds": round(time.perf_counter() - started, 3),
+            }
+            if apply is not None:
+                self.last_summary = summary
+            return summary
+
+    async def run(self, interval: float, is_missing: Callable[[Dict[str, Any]], bool],
+                  apply: Callable[[List[Dict[str, Any]]], Any]):
+        # leader only
+        while True:
+            try:
+                async with metrics.task_run("paystack_reconcile"):
+                    await self.run_once(is_missing, apply)
+            except Exception as e:
+                print("Paystack reconciliation failed:", e)
+            await asyncio.sleep(interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"runs": self.runs, "applied": self.applied, "cursor": self.load_cursor(), "last": self.last_summary}
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    from services import subscriptions
+    from services.storage import DATA_DIR
+
+    parser = argparse.ArgumentParser(description="List Paystack payments the user store doesn't reflect (dry run)")
+    parser.add_argument("--since", help="window start, e.g. 2026-05-01 (default: the saved cursor)")
+    args = parser.parse_args()
+
+    def is_missing(tx: Dict[str, Any]) -> bool:
+        email = (tx.get("customer") or {}).get("email") or ""
+        plan = subscriptions.plan_for(int(tx.get("amount") or 0) // 100, tx.get("metadata"))
+        return not subscriptions.payment_reflected(email, tx["reference"], plan, parse_ts(tx.get("paid_at")) or 0)
+
+    async def main():
+        subscriptions.store.load()
+        r = PaystackReconciler(os.getenv("PAYSTACK_API_BASE", "https://api.paystack.co"),
+                               os.getenv("PAYSTACK_SECRET_KEY", ""), DATA_DIR / "reconcile_cursor.json")
+        try:
+            since = to_iso(datetime.fromisoformat(args.since).replace(tzinfo=timezone.utc).timestamp()) if args.since else None
+            print(json.dumps(await r.run_once(is_missing, since=since), indent=2))
+        finally:
+            await http_client.close()
+
+    asyncio.run(main())
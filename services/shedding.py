@@ -0,0 +1,214 @@
+# services/shedding.py
+# Keeps abusive or bursty traffic on the public endpoints from starving the
+# rest of the process.
+#
+#   KeyedBuckets       a token bucket per client IP (or Telegram chat); an empty
+#                      bucket is a fast 429 with Retry-After
+#   ConcurrencyLimiter at most SHED_CONCURRENCY requests in their handlers; the
+#                      rest queue for up to SHED_MAX_QUEUE_WAIT seconds, then get
+#                      a 503. Once requests have been timing out in the queue,
+#                      new ones are refused straight away instead of waiting too
+#   UnknownReferences  references recently looked up and not found, so repeated
+#                      guesses don't take the store lock again; a store observer
+#                      forgets a reference as soon as any worker grants it
+#
+# shedding_middleware() puts the first two in front of every route except the
+# exempt ones (signed Paystack webhooks, bot webhooks, health checks, /metrics),
+# so a flood of /link_telegram or /admin calls never delays a real payment.
+import os
+import time
+import asyncio
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, Optional
+
+from aiohttp import web
+
+from services import metrics
+from services.broadcast import TokenBucket
+from services.cache import TTLCache
+from services.middleware import route_label
+
+SHED_CONCURRENCY = int(os.getenv("SHED_CONCURRENCY", "32"))          # requests in handlers at once
+SHED_MAX_QUEUE = int(os.getenv("SHED_MAX_QUEUE", "256"))             # waiting beyond that: 503 at once
+SHED_MAX_QUEUE_WAIT = float(os.getenv("SHED_MAX_QUEUE_WAIT", "0.5")) # seconds in the queue before a 503
+IP_RATE = float(os.getenv("IP_RATE", "5"))                           # requests / s per client IP
+IP_BURST = float(os.getenv("IP_BURST", "20"))
+CHAT_LINK_RATE = float(os.getenv("CHAT_LINK_RATE", "0.2"))          # link attempts / s per chat
+CHAT_LINK_BURST = float(os.getenv("CHAT_LINK_BURST", "5"))
+UNKNOWN_REF_TTL = float(os.getenv("UNKNOWN_REF_TTL", "60"))
+UNKNOWN_REF_PENALTY = float(os.getenv("UNKNOWN_REF_PENALTY", "2"))  # extra tokens a miss costs
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))      # our proxies appending X-Forwarded-For
+
+MAX_BUCKETS = 50000
+UNKNOWN_REF_MAX = 100000
+OVERLOAD_HOLD = 1.0   # seconds of fast refusals after a request timed out in the queue
+
+
+class KeyedBuckets:
+    def __init__(self, rate: float, burst: float, max_keys: int = MAX_BUCKETS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets: Dict[Any, TokenBucket] = {}
+        self.limited = 0
+
+    def _bucket(self, key: Any) -> TokenBucket:
+        b = self.buckets.get(key)
+        if b is None:
+            if len(self.buckets) >= self.max_keys:
+                # forget keys whose budget has fully refilled, then the oldest if that wasn't enough
+                for k in [k for k, bk in self.buckets.items() if bk.idle()]:
+                    del self.buckets[k]
+                while len(self.buckets) >= self.max_keys:
+                    del self.buckets[next(iter(self.buckets))]
+            b = self.buckets[key] = TokenBucket(self.rate, self.burst)
+        return b
+
+    def take(self, key: Any, n: float = 1) -> float:
+        # 0 when allowed, else seconds until it would be
+        if self.rate <= 0:
+            return 0.0
+        b = self._bucket(key)
+        if b.try_take(n):
+            return 0.0
+        self.limited += 1
+        return (n - b.tokens) / self.rate
+
+    def penalize(self, key: Any, n: float):
+        # charge extra for a request that turned out to be a miss; may go into debt
+        if self.rate > 0 and n > 0:
+            self._bucket(key).reserve(n)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"keys": len(self.buckets), "rate": self.rate, "burst": self.burst, "limited": self.limited}
+
+
+class Overloaded(Exception):
+    pass
+
+
+class ConcurrencyLimiter:
+    def __init__(self, limit: int = SHED_CONCURRENCY, max_wait: float = SHED_MAX_QUEUE_WAIT,
+                 max_queue: int = SHED_MAX_QUEUE):
+        self.limit = limit
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.active = 0
+        self.shed = 0
+        self.admitted = 0
+        self.last_wait = 0.0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._overloaded_until = 0.0
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self):
+        # raises Overloaded instead of waiting past max_wait
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            self.last_wait = 0.0
+            return
+        now = time.monotonic()
+        if len(self._waiters) >= self.max_queue or now < self._overloaded_until:
+            self.shed += 1
+            raise Overloaded()
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), self.max_wait)
+        except asyncio.TimeoutError:
+            if fut.done() and not fut.cancelled():
+                # handed a slot just as the wait ran out; pass it on
+                self.release()
+            self._overloaded_until = time.monotonic() + OVERLOAD_HOLD
+            self.shed += 1
+            raise Overloaded()
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()
+            raise
+        finally:
+            if not fut.done():
+                fut.cancel()
+            try:
+                self._waiters.remove(fut)
+            except ValueError:
+                pass
+        self.admitted += 1
+        self.last_wait = time.monotonic() - now
+
+    def release(self):
+        # hand the slot straight to the oldest waiter, or free it
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": len(self._waiters),
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "last_wait": round(self.last_wait, 4),
+            "overloaded": time.monotonic() < self._overloaded_until,
+        }
+
+
+class UnknownReferences(TTLCache):
+    # negative cache of references; also a UserStore observer
+    def __init__(self, maxsize: int = UNKNOWN_REF_MAX, ttl: float = UNKNOWN_REF_TTL):
+        super().__init__(maxsize, ttl)
+
+    def reset(self, users: Dict[str, Dict[str, Any]]):
+        self.clear()
+
+    def changed(self, before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]):
+        ref = (after or {}).get("paystack_reference")
+        if ref and len(self):
+            self.discard(ref)
+
+
+def client_ip(request: web.Request, hops: int = TRUSTED_PROXY_HOPS) -> str:
+    # the address our own proxies saw; anything further left in X-Forwarded-For
+    # is whatever the client chose to send
+    if hops > 0:
+        forwarded = [p.strip() for p in request.headers.get("X-Forwarded-For", "").split(",") if p.strip()]
+        if forwarded:
+            return forwarded[-min(hops, len(forwarded))]
+    return request.remote or "unknown"
+
+
+def _retry_after(seconds: float) -> Dict[str, str]:
+    return {"Retry-After": str(max(1, int(seconds + 0.999)))}
+
+
+def shedding_middleware(limiter: ConcurrencyLimiter, ip_buckets: KeyedBuckets, exempt: Iterable[str]):
+    exempt = frozenset(exempt)
+
+    @web.middleware
+    async def middleware(request: web.Request, handler):
+        if request.path in exempt:
+            return await handler(request)
+        ip = request["client_ip"] = client_ip(request)
+        wait = ip_buckets.take(ip)
+        if wait:
+            metrics.SHED_REQUESTS.inc(route=route_label(request), reason="rate_limited")
+            return web.json_response({"error": "too many requests"}, status=429, headers=_retry_after(wait))
+        try:
+            await limiter.acquire()
+        except Overloaded:
+            metrics.SHED_REQUESTS.inc(route=route_label(request), reason="overloaded")
+            return web.json_response({"error": "overloaded"}, status=503, headers=_retry_after(1))
+        try:
+            return await handler(request)
+        finally:
+            limiter.release()
+
+    return middleware
@@ -0,0 +1,182 @@
+# services/stats.py
+# Subscription analytics kept up to date as users change.
+#
+# SubscriptionStats watches the user store (UserStore.observers): every write,
+# and every write synced from another worker, comes in as (before, after) and
+# moves the aggregates by the difference, so /admin/stats never scans users.
+#
+#   current    users, active per plan, active linked / unlinked chat ids
+#   series     per UTC day (STATS_DAYS kept) and hour (STATS_HOURS kept):
+#              activated, renewed, revenue (naira), expired, linked
+#
+# What counts as an event, from the user record:
+#   paystack_reference changed   a payment; last_action says activated / renewed,
+#                                last_amount and last_paid_at date it
+#   active -> inactive           an expiry (churn)
+#   chat_id set                  a link
+#
+# The series are saved to stats.json with the other caches. rebuild() starts
+# over from the stored users: the current numbers are exact, the series get
+# each user's activation, last payment, link and lapsed expiry.
+import os
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from services.storage import load_json, save_json
+
+STATS_DAYS = int(os.getenv("STATS_DAYS", "90"))
+STATS_HOURS = int(os.getenv("STATS_HOURS", "72"))
+CHURN_WINDOW_DAYS = 30
+
+SERIES_FIELDS = ("activated", "renewed", "revenue", "expired", "linked")
+
+
+def _day(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d")
+
+
+def _hour(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%dT%H")
+
+
+class SubscriptionStats:
+    def __init__(self, path: Optional[Path] = None):
+        self.path = Path(path) if path else None
+        self.users = 0
+        self.active: Counter = Counter()         # plan -> active users
+        self.linked = 0                          # active users with a chat_id
+        self.unlinked = 0
+        self.days: Dict[str, Counter] = {}
+        self.hours: Dict[str, Counter] = {}
+        self.events = 0
+
+    # --------------------
+    # Store observer
+    # --------------------
+    def reset(self, users: Dict[str, Dict[str, Any]]):
+        # current numbers from scratch (store load); the series carry on
+        self.users = 0
+        self.active = Counter()
+        self.linked = self.unlinked = 0
+        for u in users.values():
+            self._count(u, 1)
+
+    def changed(self, before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]):
+        self._count(before, -1)
+        self._count(after, 1)
+        if after is None:
+            return
+        before = before or {}
+        now = time.time()
+        ref = after.get("paystack_reference")
+        if ref and ref != before.get("paystack_reference"):
+            kind = "renewed" if after.get("last_action") == "renewed" else "activated"
+            paid_at = after.get("last_paid_at") or now
+            self._event(paid_at, kind, plan=after.get("plan"))
+            if after.get("last_amount"):
+                self._event(paid_at, "revenue", int(after["last_amount"]))
+        if before.get("active") and not after.get("active"):
+            self._event(now, "expired", plan=after.get("plan"))
+        if after.get("chat_id") and not before.get("chat_id"):
+            self._event(now, "linked")
+
+    def _count(self, u: Optional[Dict[str, Any]], sign: int):
+        if not u:
+            return
+        self.users += sign
+        if u.get("active"):
+            self.active[u.get("plan") or "none"] += sign
+            if u.get("chat_id"):
+                self.linked += sign
+            else:
+                self.unlinked += sign
+
+    def _event(self, ts: float, field: str, n: int = 1, plan: Optional[str] = None):
+        self.events += 1
+        for buckets, key, keep in ((self.days, _day(ts), STATS_DAYS), (self.hours, _hour(ts), STATS_HOURS)):
+            b = buckets.get(key)
+            if b is None:
+                b = buckets[key] = Counter()
+                if len(buckets) > keep:
+                    # keys sort in time order
+                    for old in sorted(buckets)[:len(buckets) - keep]:
+                        del buckets[old]
+            b[field] += n
+            if plan:
+                b[f"{field}:{plan}"] += n
+
+    # --------------------
+    # Rebuild / persistence
+    # --------------------
+    def rebuild(self, users: Dict[str, Dict[str, Any]], plan_seconds=None):
+        # everything from the stored users; plan_seconds(plan) dates activations of
+        # records written before activated_at was kept
+        self.days = {}
+        self.hours = {}
+        self.reset(users)
+        now = time.time()
+        for u in users.values():
+            plan = u.get("plan")
+            activated = u.get("activated_at")
+            if activated is None and plan_seconds and u.get("expires_at"):
+                activated = int(u["expires_at"]) - plan_seconds(plan)
+            if activated:
+                self._event(activated, "activated", plan=plan)
+            if u.get("last_action") == "renewed" and u.get("last_paid_at"):
+                self._event(u["last_paid_at"], "renewed", plan=plan)
+            if u.get("last_amount"):
+                self._event(u.get("last_paid_at") or activated or now, "revenue", int(u["last_amount"]))
+            if u.get("linked_at"):
+                self._event(u["linked_at"], "linked")
+            exp = int(u.get("expires_at") or 0)
+            if not u.get("active") and 0 < exp <= now:
+                self._event(exp, "expired", plan=plan)
+
+    def load(self):
+        if self.path is None:
+            return
+        data = load_json(self.path)
+        self.days = {k: Counter(v) for k, v in (data.get("days") or {}).items()}
+        self.hours = {k: Counter(v) for k, v in (data.get("hours") or {}).items()}
+
+    def save(self):
+        if self.path is None:
+            return
+        save_json(self.path, {"days": self.days, "hours": self.hours})
+
+    # --------------------
+    # Query
+    # --------------------
+    def snapshot(self, bucket: str = "day", limit: Optional[int] = None) -> Dict[str, Any]:
+        buckets = self.hours if bucket == "hour" else self.days
+        keys = sorted(buckets)
+        if limit:
+            keys = keys[-limit:]
+        series = [dict({"t": k}, **{f: buckets[k].get(f, 0) for f in SERIES_FIELDS},
+                       **{f: v for f, v in buckets[k].items() if ":" in f}) for k in keys]
+        recent = sorted(self.days)[-CHURN_WINDOW_DAYS:]
+        expired = sum(self.days[k].get("expired", 0) for k in recent)
+        renewed = sum(self.days[k].get("renewed", 0) for k in recent)
+        activated = sum(self.days[k].get("activated", 0) for k in recent)
+        active = sum(self.active.values())
+        return {
+            "users": self.users,
+            "active": active,
+            "active_by_plan": {p: n for p, n in self.active.items() if n},
+            "linked": self.linked,
+            "unlinked": self.unlinked,
+            f"last_{CHURN_WINDOW_DAYS}_days": {
+                "activated": activated,
+                "renewed": renewed,
+                "expired": expired,
+                "revenue": sum(self.days[k].get("revenue", 0) for k in recent),
+                # lost over the window / (still active + lost)
+                "churn_rate": round(expired / (active + expired), 4) if active + expired else 0.0,
+                "renewal_share": round(renewed / (renewed + activated), 4) if renewed + activated else 0.0,
+            },
+            "bucket": "hour" if bucket == "hour" else "day",
+            "series": series,
+        }
@@ -0,0 +1,569 @@
+# services/storage.py
+import os
+import json
+import time
+import fcntl
+import sqlite3
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Tuple
+
+from services import cluster
+
+# Storage backends behind the user store and the games list.
+#
+# Every backend offers the same small interface:
+#   load_users() -> {email: user}
+#   write_users(entries)      entries: [("put", email, user) | ("del", email, None)], applied as one batch
+#   replace_users(users)      overwrite everything
+#   needs_compaction() / begin_compaction(users) / finish_compaction(snapshot)
+#   load_games() / save_games(games)
+#   load_posts(pending_only) / load_post(id) / save_post(post) / prune_posts(older_than)
+#                             scheduled slips, see services/publisher.py
+#   size_bytes()              on-disk footprint, for metrics
+#   close()
+#
+# and, for several worker processes over the same data (see services/cluster.py):
+#   transaction()             exclusive across processes, reentrant within one
+#   change_cursor() / changes_since(cursor) -> (entries | None, cursor)
+#                             other processes' writes; None means reload everything
+#   games_version()           changes whenever games are saved
+#   try_lease(name, holder, ttl) / release_lease(name, holder)
+#
+# STORAGE_BACKEND=json (default) keeps users.json + an append-only journal;
+# STORAGE_BACKEND=sqlite uses a WAL-mode database with indexed columns.
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").lower()
+DATA_DIR = Path(os.getenv("DATA_DIR", "data"))
+SQLITE_PATH = Path(os.getenv("SQLITE_PATH", str(DATA_DIR / "stakeaware.db")))
+COMPACT_EVERY = int(os.getenv("USER_STORE_COMPACT_EVERY", "10000"))  # journal lines
+
+Entry = Tuple[str, str, Optional[Dict[str, Any]]]
+PENDING_POST_STATUSES = ("scheduled", "sending")
+
+
+# --------------------
+# Helpers: file store
+# --------------------
+def atomic_write(p: Path, text: str):
+    # write to a temp file and rename over the target so a crash never leaves a truncated file;
+    # the temp file is unique, so two processes saving the same file don't write into each other's
+    fd, tmp = tempfile.mkstemp(dir=p.parent, prefix=p.name + ".", suffix=".tmp")
+    try:
+        with open(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, p)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def load_json(p: Path) -> Dict[str, Any]:
+    if not p.exists():
+        return {}
+    try:
+        return json.loads(p.read_text(encoding="utf-8"))
+    except Exception as e:
+        # keep the broken file around instead of letting the next save overwrite it
+        aside = p.with_name(p.name + ".corrupt")
+        os.replace(p, aside)
+        print(f"Could not parse {p} ({e}); moved it to {aside}")
+        return {}
+
+
+def save_json(p: Path, obj: Any):
+    atomic_write(p, json.dumps(obj, indent=2, ensure_ascii=False))
+
+
+class FileLock:
+    # flock() on a side file: exclusive across processes and threads, reentrant within a thread
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._fd: Optional[int] = None
+        self._depth = 0
+        self._thread_lock = threading.RLock()
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        try:
+            if self._depth == 0:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+        except BaseException:
+            self._thread_lock.release()
+            raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._depth -= 1
+        if self._depth == 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._thread_lock.release()
+        return False
+
+
+# --------------------
+# JSON snapshot + journal
+# --------------------
+class JsonBackend:
+    # journal lines: {"op": "put", "email": ..., "user": {...}} | {"op": "del", "email": ...}
+    #
+    # Other processes' writes are read by tailing the journal from a byte offset.
+    # Compaction rotates the journal and bumps users.journal.gen, which tells
+    # readers holding an offset into the old file to reload instead.
+
+    def __init__(self, users_file: Path, games_file: Path):
+        self.users_file = Path(users_file)
+        self.games_file = Path(games_file)
+        self.journal_path = self.users_file.with_suffix(".journal")
+        self.rotated_path = self.journal_path.with_name(self.journal_path.name + ".compacting")
+        self.gen_path = self.journal_path.with_name(self.journal_path.name + ".gen")
+        self.journal_lines = 0
+        self._lock = FileLock(self.journal_path.with_name(self.journal_path.name + ".lock"))
+        self._lease_lock = FileLock(self.users_file.with_name("leases.lock"))
+        self.leases_file = self.users_file.with_name("leases.json")
+        self.posts_file = self.users_file.with_name("posts.json")
+
+    def transaction(self):
+        return self._lock
+
+    def load_users(self) -> Dict[str, Dict[str, Any]]:
+        users: Dict[str, Dict[str, Any]] = {}
+        # under the lock: a compaction finishing between reading the snapshot and the rotated
+        # journal would delete lines this old snapshot doesn't have yet
+        with self._lock:
+            if self.users_file.exists():
+                text = self.users_file.read_text(encoding="utf-8")
+                if text.strip():
+                    users = json.loads(text)
+            # a crash during compaction leaves the rotated journal behind; replaying it is idempotent
+            self.journal_lines = 0
+            for p in (self.rotated_path, self.journal_path):
+                self.journal_lines += self._replay(p, users)
+        return users
+
+    def _replay(self, p: Path, users: Dict[str, Dict[str, Any]]) -> int:
+        if not p.exists():
+            return 0
+        n = 0
+        with open(p, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # torn last line from a crash mid-append
+                    print("Skipping corrupt journal line in", p)
+                    continue
+                if entry.get("op") == "put":
+                    users[entry["email"]] = entry["user"]
+                elif entry.get("op") == "del":
+                    users.pop(entry["email"], None)
+                n += 1
+        return n
+
+    def write_users(self, entries: List[Entry]):
+        if not entries:
+            return
+        lines = []
+        for op, email, user in entries:
+            if op == "put":
+                lines.append(json.dumps({"op": "put", "email": email, "user": user}, ensure_ascii=False))
+            else:
+                lines.append(json.dumps({"op": "del", "email": email}, ensure_ascii=False))
+        with self._lock, open(self.journal_path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal_lines += len(lines)
+
+    def _generation(self) -> int:
+        try:
+            return int(self.gen_path.read_text() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def change_cursor(self) -> Tuple[int, int]:
+        size = self.journal_path.stat().st_size if self.journal_path.exists() else 0
+        return (self._generation(), size)
+
+    def changes_since(self, cursor: Tuple[int, int]) -> Tuple[Optional[List[Entry]], Tuple[int, int]]:
+        gen, offset = cursor
+        if self._generation() != gen:
+            return None, self.change_cursor()
+        if not self.journal_path.exists():
+            return [], cursor
+        with open(self.journal_path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        # only whole lines; a write in progress is picked up next time
+        end = data.rfind(b"\n") + 1
+        entries: List[Entry] = []
+        for line in data[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                e = json.loads(line)
+            except ValueError:
+                continue
+            entries.append(("put", e["email"], e["user"]) if e.get("op") == "put" else ("del", e["email"], None))
+        self.journal_lines += len(entries)
+        return entries, (gen, offset + end)
+
+    def replace_users(self, users: Dict[str, Dict[str, Any]]):
+        with self._lock:
+            self.finish_compaction(self.begin_compaction(users))
+            if self.journal_path.exists():
+                self.journal_path.unlink()
+
+    def needs_compaction(self) -> bool:
+        return self.journal_lines >= COMPACT_EVERY
+
+    def begin_compaction(self, users: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        # rotate the journal and copy the state on the caller's thread; finish_compaction can run elsewhere
+        with self._lock:
+            self._rotate()
+        return {email: dict(u) for email, u in users.items()}
+
+    def _rotate(self):
+        if self.journal_path.exists():
+            if self.rotated_path.exists():
+                # an earlier compaction never finished; keep its lines until a snapshot lands
+                with open(self.rotated_path, "a", encoding="utf-8") as out:
+                    out.write(self.journal_path.read_text(encoding="utf-8"))
+                self.journal_path.unlink()
+            else:
+                os.replace(self.journal_path, self.rotated_path)
+        self.journal_lines = 0
+        atomic_write(self.gen_path, str(self._generation() + 1))
+
+    def finish_compaction(self, snapshot: Dict[str, Any]):
+        # the big write happens outside the lock; the swap and the journal removal inside it
+        tmp = self.users_file.with_name(self.users_file.name + ".compacted.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(json.dumps(snapshot, ensure_ascii=False))
+            f.flush()
+            os.fsync(f.fileno())
+        with self._lock:
+            os.replace(tmp, self.users_file)
+            if self.rotated_path.exists():
+                self.rotated_path.unlink()
+
+    def size_bytes(self) -> int:
+        return sum(p.stat().st_size for p in (self.users_file, self.journal_path, self.rotated_path) if p.exists())
+
+    def load_games(self) -> List[Any]:
+        return load_json(self.games_file).get("games", [])
+
+    def save_games(self, games: List[Any]):
+        with self._lock:
+            save_json(self.games_file, {"games": games})
+
+    def games_version(self) -> Any:
+        try:
+            st = self.games_file.stat()
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    # posts.json: {"posts": {id: post}}; a handful of slips, rewritten whole
+    def load_posts(self, pending_only: bool = False) -> List[Dict[str, Any]]:
+        posts = load_json(self.posts_file).get("posts", {}).values()
+        if pending_only:
+            posts = [p for p in posts if p.get("status") in PENDING_POST_STATUSES]
+        return sorted(posts, key=lambda p: p.get("send_at", 0))
+
+    def load_post(self, post_id: str) -> Optional[Dict[str, Any]]:
+        return load_json(self.posts_file).get("posts", {}).get(post_id)
+
+    def save_post(self, post: Dict[str, Any]):
+        with self._lock:
+            posts = load_json(self.posts_file).get("posts", {})
+            posts[post["id"]] = post
+            save_json(self.posts_file, {"posts": posts})
+
+    def prune_posts(self, older_than: float):
+        with self._lock:
+            posts = load_json(self.posts_file).get("posts", {})
+            keep = {k: p for k, p in posts.items()
+                    if p.get("status") in PENDING_POST_STATUSES or p.get("send_at", 0) >= older_than}
+            if len(keep) != len(posts):
+                save_json(self.posts_file, {"posts": keep})
+
+    def try_lease(self, name: str, holder: str, ttl: float) -> bool:
+        with self._lease_lock:
+            leases = load_json(self.leases_file)
+            cur = leases.get(name)
+            now = time.time()
+            if cur and cur.get("holder") != holder and cur.get("expires_at", 0) > now:
+                return False
+            leases[name] = {"holder": holder, "expires_at": now + ttl}
+            save_json(self.leases_file, leases)
+            return True
+
+    def release_lease(self, name: str, holder: str):
+        with self._lease_lock:
+            leases = load_json(self.leases_file)
+            if (leases.get(name) or {}).get("holder") == holder:
+                del leases[name]
+                save_json(self.leases_file, leases)
+
+    def close(self):
+        pass
+
+
+# --------------------
+# SQLite (WAL)
+# --------------------
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    email TEXT PRIMARY KEY,
+    plan TEXT,
+    paystack_reference TEXT,
+    expires_at INTEGER,
+    active INTEGER,
+    chat_id INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_reference ON users(paystack_reference);
+CREATE INDEX IF NOT EXISTS users_chat_id ON users(chat_id);
+CREATE INDEX IF NOT EXISTS users_expires_at ON users(expires_at);
+CREATE TABLE IF NOT EXISTS games (
+    pos INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    email TEXT,
+    ts REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS posts (
+    id TEXT PRIMARY KEY,
+    send_at REAL NOT NULL,
+    status TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS posts_status ON posts(status, send_at);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+_UPSERT_USER = """
+INSERT INTO users (email, plan, paystack_reference, expires_at, active, chat_id, data)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(email) DO UPDATE SET
+    plan = excluded.plan,
+    paystack_reference = excluded.paystack_reference,
+    expires_at = excluded.expires_at,
+    active = excluded.active,
+    chat_id = excluded.chat_id,
+    data = excluded.data
+"""
+
+_DELETE_USER = "DELETE FROM users WHERE email = ?"
+
+
+def _user_row(email: str, u: Dict[str, Any]) -> tuple:
+    chat_id = u.get("chat_id")
+    return (
+        email,
+        u.get("plan"),
+        u.get("paystack_reference"),
+        int(u.get("expires_at") or 0),
+        1 if u.get("active") else 0,
+        int(chat_id) if chat_id else None,
+        json.dumps(u, ensure_ascii=False),
+    )
+
+
+class SqliteBackend:
+    # with track_changes every write also appends the email to `changes`, which
+    # other processes poll; an email of NULL means "reload everything"
+
+    def __init__(self, db_path: Path, track_changes: bool = False):
+        self.db_path = Path(db_path)
+        self.track_changes = track_changes
+        self._tx_depth = 0
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # statements are cached by sqlite3, so the constant SQL above is prepared once
+        self.conn = sqlite3.connect(str(self.db_path), isolation_level=None, check_same_thread=False, cached_statements=64)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.executescript(_SCHEMA)
+
+    def load_users(self) -> Dict[str, Dict[str, Any]]:
+        return {email: json.loads(data) for email, data in self.conn.execute("SELECT email, data FROM users")}
+
+    def write_users(self, entries: List[Entry]):
+        if not entries:
+            return
+        with self.transaction():
+            for op, email, user in entries:
+                if op == "put":
+                    self.conn.execute(_UPSERT_USER, _user_row(email, user))
+                else:
+                    self.conn.execute(_DELETE_USER, (email,))
+            if self.track_changes:
+                now = time.time()
+                self.conn.executemany("INSERT INTO changes (email, ts) VALUES (?, ?)", ((e, now) for _, e, _ in entries))
+
+    def put_user_rows(self, rows: List[tuple]):
+        # bulk path used by the migration tool
+        with self.transaction():
+            self.conn.executemany(_UPSERT_USER, rows)
+
+    def replace_users(self, users: Dict[str, Dict[str, Any]]):
+        with self.transaction():
+            self.conn.execute("DELETE FROM users")
+            self.conn.executemany(_UPSERT_USER, (_user_row(e, u) for e, u in users.items()))
+            if self.track_changes:
+                self.conn.execute("INSERT INTO changes (email, ts) VALUES (NULL, ?)", (time.time(),))
+
+    def transaction(self):
+        return _Transaction(self)
+
+    def change_cursor(self) -> int:
+        return self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+
+    def changes_since(self, cursor: int) -> Tuple[Optional[List[Entry]], int]:
+        rows = self.conn.execute(
+            "SELECT c.seq, c.email, u.data FROM changes c LEFT JOIN users u ON u.email = c.email "
+            "WHERE c.seq > ? ORDER BY c.seq", (cursor,)).fetchall()
+        if not rows:
+            # everything after cursor may have been pruned while we weren't looking
+            last = self.conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'changes'").fetchone()
+            if last and last[0] > cursor:
+                return None, last[0]
+            return [], cursor
+        first = self.conn.execute("SELECT MIN(seq) FROM changes").fetchone()[0]
+        # pruned past our position, or a full replace: start over
+        if first > cursor + 1 or any(email is None for _, email, _ in rows):
+            return None, rows[-1][0]
+        entries: List[Entry] = []
+        for _, email, data in rows:
+            # the row holds the latest state, so repeated emails just re-put it
+            entries.append(("put", email, json.loads(data)) if data is not None else ("del", email, None))
+        return entries, rows[-1][0]
+
+    def prune_changes(self, older_than: float):
+        with self.transaction():
+            self.conn.execute("DELETE FROM changes WHERE ts < ?", (older_than,))
+
+    def needs_compaction(self) -> bool:
+        return False
+
+    def begin_compaction(self, users):
+        return None
+
+    def finish_compaction(self, snapshot):
+        pass
+
+    def size_bytes(self) -> int:
+        paths = (self.db_path, self.db_path.with_name(self.db_path.name + "-wal"))
+        return sum(p.stat().st_size for p in paths if p.exists())
+
+    def load_games(self) -> List[Any]:
+        return [json.loads(data) for (data,) in self.conn.execute("SELECT data FROM games ORDER BY pos")]
+
+    def save_games(self, games: List[Any]):
+        with self.transaction():
+            self.conn.execute("DELETE FROM games")
+            self.conn.executemany("INSERT INTO games (pos, data) VALUES (?, ?)",
+                                  ((i, json.dumps(g, ensure_ascii=False)) for i, g in enumerate(games)))
+            self.conn.execute("INSERT INTO meta (key, value) VALUES ('games_version', 1) "
+                              "ON CONFLICT(key) DO UPDATE SET value = value + 1")
+
+    def games_version(self) -> Any:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'games_version'").fetchone()
+        return row[0] if row else None
+
+    def load_posts(self, pending_only: bool = False) -> List[Dict[str, Any]]:
+        if pending_only:
+            rows = self.conn.execute("SELECT data FROM posts WHERE status IN (?, ?) ORDER BY send_at", PENDING_POST_STATUSES)
+        else:
+            rows = self.conn.execute("SELECT data FROM posts ORDER BY send_at")
+        return [json.loads(data) for (data,) in rows]
+
+    def load_post(self, post_id: str) -> Optional[Dict[str, Any]]:
+        row = self.conn.execute("SELECT data FROM posts WHERE id = ?", (post_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_post(self, post: Dict[str, Any]):
+        self.conn.execute("INSERT INTO posts (id, send_at, status, data) VALUES (?, ?, ?, ?) "
+                          "ON CONFLICT(id) DO UPDATE SET send_at = excluded.send_at, status = excluded.status, data = excluded.data",
+                          (post["id"], post["send_at"], post["status"], json.dumps(post, ensure_ascii=False)))
+
+    def prune_posts(self, older_than: float):
+        self.conn.execute("DELETE FROM posts WHERE send_at < ? AND status NOT IN (?, ?)", (older_than,) + PENDING_POST_STATUSES)
+
+    def try_lease(self, name: str, holder: str, ttl: float) -> bool:
+        now = time.time()
+        with self.transaction():
+            row = self.conn.execute("SELECT holder, expires_at FROM leases WHERE name = ?", (name,)).fetchone()
+            if row and row[0] != holder and row[1] > now:
+                return False
+            self.conn.execute("INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) "
+                              "ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at",
+                              (name, holder, now + ttl))
+            return True
+
+    def release_lease(self, name: str, holder: str):
+        with self.transaction():
+            self.conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+
+    def close(self):
+        self.conn.close()
+
+
+class _Transaction:
+    # BEGIN IMMEDIATE takes the database write lock, so this also serializes
+    # writers across processes; nested uses join the outer transaction
+    def __init__(self, backend: "SqliteBackend"):
+        self.backend = backend
+
+    def __enter__(self):
+        if self.backend._tx_depth == 0:
+            self.backend.conn.execute("BEGIN IMMEDIATE")
+        self.backend._tx_depth += 1
+        return self.backend.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.backend._tx_depth -= 1
+        if self.backend._tx_depth == 0:
+            self.backend.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+# --------------------
+# Factory
+# --------------------
+_backend = None
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        DATA_DIR.mkdir(exist_ok=True)
+        if STORAGE_BACKEND == "sqlite":
+            _backend = SqliteBackend(SQLITE_PATH, track_changes=cluster.MULTI_WORKER)
+        else:
+            _backend = JsonBackend(DATA_DIR / "users.json", DATA_DIR / "games.json")
+    return _backend
@@ -0,0 +1,138 @@
+# services/subscriptions.py
+# Subscription state shared by the aiohttp routes and the aiogram handlers.
+# Everything here works on the resident user store, so lookups are O(1)
+# and nothing goes over HTTP.
+import os
+from datetime import datetime, timezone
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+from services import cluster
+from services.ledger import LEDGER_ENABLED, PAID_REFERENCES_KEPT, PaymentLedger
+from services.stats import SubscriptionStats
+from services.storage import DATA_DIR, get_backend
+from services.user_store import UserStore
+
+DAILY_PLAN_DURATION = int(os.getenv("DAILY_PLAN_DURATION", "30"))
+WEEKEND_PLAN_DURATION = int(os.getenv("WEEKEND_PLAN_DURATION", "30"))
+DAILY_PLAN_AMOUNT = int(os.getenv("DAILY_PLAN_AMOUNT", "50000"))  # naira; at or above it a payment is the daily plan
+
+# users structure: { email: { email, plan, paystack_reference, expires_at, active, chat_id,
+#   activated_at, linked_at, last_paid_at, last_amount, last_action, paid_references } }
+# paid_references: the user's latest granted references, current one last. They're indexed
+# with the store, so a redelivered charge is recognised whichever worker granted it
+# resident store with email / reference / chat_id indexes; loaded in on_startup
+# with several workers it writes through and syncs with the others (see services/cluster.py)
+store = UserStore(get_backend(), shared=cluster.MULTI_WORKER)
+
+# /admin/stats aggregates, moved by every store change (see services/stats.py)
+stats = SubscriptionStats(DATA_DIR / "stats.json")
+store.observers.append(stats)
+
+# append-only history of every grant and link (see services/ledger.py)
+ledger = PaymentLedger(DATA_DIR / "payments.ledger", shared=cluster.MULTI_WORKER) if LEDGER_ENABLED else None
+
+
+def now_ts() -> int:
+    return int(datetime.now(tz=timezone.utc).timestamp())
+
+
+def plan_seconds(plan: str) -> int:
+    return (DAILY_PLAN_DURATION if plan == "daily" else WEEKEND_PLAN_DURATION) * 24 * 3600
+
+
+def plan_for(amount: int, metadata: Any = None) -> str:
+    # amount in naira; metadata.plan_type from the checkout wins
+    plan = metadata.get("plan_type") if isinstance(metadata, dict) else None
+    return plan or ("daily" if amount >= DAILY_PLAN_AMOUNT else "weekend")
+
+
+def payment_reflected(email: str, reference: str, plan: str, paid_at: int) -> bool:
+    # the store already shows this payment: its reference, or a period that runs past it
+    if store.find_by_reference(reference):
+        return True
+    u = store.get(email)
+    return bool(u) and int(u.get("expires_at") or 0) >= paid_at + plan_seconds(plan)
+
+
+def paid_references(prev: Optional[Dict[str, Any]], reference: str) -> List[str]:
+    refs = list((prev.get("paid_references") or [prev.get("paystack_reference")]) if prev else [])
+    refs = [r for r in refs if r and r != reference] + [reference]
+    return refs[-PAID_REFERENCES_KEPT:]
+
+
+def grant_or_renew(email: str, plan: str, reference: str, paid_at: Optional[int] = None,
+                   amount: Optional[int] = None) -> Tuple[Dict[str, Any], str]:
+    # returns (user, "activated" | "renewed" | "duplicate"); paid_at backdates the period (reconciled
+    # payments), amount (naira) is kept for the revenue stats. "duplicate": the reference was granted
+    # already, now or for an earlier period (a redelivered webhook after a crash, through another
+    # worker, or during warm-up); the transaction has caught up with the other workers' grants
+    now = now_ts()
+    expires_at = (paid_at or now) + plan_seconds(plan)
+
+    with store.transaction():
+        done = store.find_by_reference(reference)
+        if done:
+            return done, "duplicate"
+        prev = store.get(email)
+        if prev and prev.get("expires_at", 0) > now:
+            new_expiry = max(prev["expires_at"], expires_at)
+            user = store.update(email,
+                plan=plan,
+                paystack_reference=reference,
+                paid_references=paid_references(prev, reference),
+                expires_at=new_expiry,
+                active=True,
+                last_paid_at=paid_at or now,
+                last_amount=amount,
+                last_action="renewed"
+            )
+            if ledger is not None:
+                ledger.charge(email, reference, plan, amount, paid_at or now, new_expiry, "renewed")
+            return user, "renewed"
+
+        user = store.put(email, {
+            "email": email,
+            "plan": plan,
+            "paystack_reference": reference,
+            "paid_references": paid_references(prev, reference),
+            "expires_at": expires_at,
+            "active": True,
+            "chat_id": None,
+            "activated_at": paid_at or now,
+            "last_paid_at": paid_at or now,
+            "last_amount": amount,
+            "last_action": "activated"
+        })
+        if ledger is not None:
+            ledger.charge(email, reference, plan, amount, paid_at or now, expires_at, "activated")
+        return user, "activated"
+
+
+def grant_many(grants: Iterable[Tuple]) -> List[Tuple[Dict[str, Any], str]]:
+    # [(email, plan, reference, paid_at[, amount])] applied in one transaction and written as one batch
+    with store.transaction():
+        results = [grant_or_renew(*g) for g in grants]
+    store.flush()
+    return results
+
+
+def link_chat(reference: str, chat_id: int) -> Optional[Dict[str, Any]]:
+    # attach a Telegram chat to the subscription paid with `reference`; None if unknown
+    with store.transaction():
+        u = store.find_by_reference(reference)
+        if not u:
+            return None
+        fields = {"chat_id": int(chat_id), "active": True}
+        if not u.get("chat_id"):
+            fields["linked_at"] = now_ts()
+        if ledger is not None:
+            ledger.link(u["email"], reference, int(chat_id))
+        return store.update(u["email"], **fields)
+
+
+def status_for_chat(chat_id: int) -> Optional[Dict[str, Any]]:
+    return store.find_by_chat(chat_id)
+
+
+def format_expiry(exp: Optional[int]) -> str:
+    return datetime.fromtimestamp(int(exp), tz=timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC") if exp else "N/A"
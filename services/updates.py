@@ -0,0 +1,121 @@
+# services/updates.py
+# Runs Telegram updates off the webhook request.
+#
+# Updates are deduplicated by update_id over a bounded window (Telegram
+# redelivers when a webhook is slow), queued per chat so one chat's updates run
+# strictly in order, and different chats run in parallel under a global cap on
+# in-flight handlers.
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Set
+
+_CHAT_KEYS = ("message", "edited_message", "channel_post", "edited_channel_post", "business_message")
+
+
+def chat_key(update: Dict[str, Any]) -> Any:
+    for k in _CHAT_KEYS:
+        if k in update:
+            return (update[k].get("chat") or {}).get("id")
+    cb = update.get("callback_query")
+    if cb:
+        msg = cb.get("message") or {}
+        return (msg.get("chat") or {}).get("id") or (cb.get("from") or {}).get("id")
+    for k in ("inline_query", "chosen_inline_result", "shipping_query", "pre_checkout_query", "poll_answer"):
+        if k in update:
+            return ((update[k].get("from") or update[k].get("user")) or {}).get("id")
+    for k in ("my_chat_member", "chat_member", "chat_join_request"):
+        if k in update:
+            return (update[k].get("chat") or {}).get("id")
+    # nothing to order against
+    return ("update", update.get("update_id"))
+
+
+class UpdateExecutor:
+    def __init__(self, handler: Callable[[Dict[str, Any]], Awaitable[Any]], max_inflight: int = 64,
+                 max_pending: int = 10000, seen_window: int = 10000, name: str = "updates"):
+        self.handler = handler
+        self.max_pending = max_pending
+        self.seen_window = seen_window
+        self.name = name
+        self.sem = asyncio.Semaphore(max_inflight)
+        self.processed = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.rejected = 0
+        self.pending = 0
+        self._seen: Set[int] = set()
+        self._seen_order: Deque[int] = deque()
+        self._chats: Dict[Any, Deque[Dict[str, Any]]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": self.pending,
+            "active_chats": len(self._chats),
+            "processed": self.processed,
+            "duplicates": self.duplicates,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+    def _remember(self, update_id: int):
+        self._seen.add(update_id)
+        self._seen_order.append(update_id)
+        if len(self._seen_order) > self.seen_window:
+            self._seen.discard(self._seen_order.popleft())
+
+    def submit(self, update: Dict[str, Any]) -> bool:
+        # True when accepted or already seen; False only when over max_pending
+        update_id = update.get("update_id")
+        if update_id is not None and update_id in self._seen:
+            self.duplicates += 1
+            return True
+        if self.pending >= self.max_pending:
+            # not remembered, so Telegram's redelivery gets processed
+            self.rejected += 1
+            return False
+        if update_id is not None:
+            self._remember(update_id)
+        key = chat_key(update)
+        self.pending += 1
+        self._idle.clear()
+        q = self._chats.get(key)
+        if q is not None:
+            q.append(update)
+            return True
+        self._chats[key] = deque([update])
+        t = asyncio.create_task(self._drain_chat(key))
+        self._tasks.add(t)
+        t.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _drain_chat(self, key: Any):
+        q = self._chats[key]
+        try:
+            while q:
+                update = q[0]
+                async with self.sem:
+                    try:
+                        await self.handler(update)
+                        self.processed += 1
+                    except Exception as e:
+                        self.failed += 1
+                        print(f"{self.name}: update {update.get('update_id')} failed:", e)
+                q.popleft()
+                self.pending -= 1
+        finally:
+            del self._chats[key]
+            if self.pending == 0:
+                self._idle.set()
+
+    async def idle(self):
+        # until every accepted update has been handled
+        await self._idle.wait()
+
+    async def drain(self, timeout: float = 10.0):
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            print(f"{self.name}: {self.pending} update(s) still pending at shutdown")
@@ -0,0 +1,107 @@
+# services/user_query.py
+# Filters and cursor pagination for /admin/users.
+#
+# Query parameters:
+#   plan=daily|weekend        active=true|false        linked=true|false (has chat_id)
+#   expires_before=<unix ts>  expires_after=<unix ts>
+#   limit=<n>  cursor=<opaque>                          paginated JSON
+#   format=ndjson                                      stream every match, one user per line
+#
+# With the store's NumPy mirror (services/columns.py) a filter is one mask over
+# every row; matches() is the per-dict fallback when it is turned off.
+import base64
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Tuple
+
+MAX_LIMIT = 1000
+
+
+def _bool(v: str) -> bool:
+    return v.strip().lower() in ("1", "true", "yes", "y")
+
+
+def parse_filters(query: Mapping[str, str]) -> Dict[str, Any]:
+    # raises ValueError on malformed numbers
+    f: Dict[str, Any] = {}
+    if query.get("plan"):
+        f["plan"] = query["plan"]
+    if query.get("active"):
+        f["active"] = _bool(query["active"])
+    if query.get("linked"):
+        f["linked"] = _bool(query["linked"])
+    if query.get("expires_before"):
+        f["expires_before"] = int(query["expires_before"])
+    if query.get("expires_after"):
+        f["expires_after"] = int(query["expires_after"])
+    return f
+
+
+def matches(u: Dict[str, Any], f: Dict[str, Any]) -> bool:
+    if "plan" in f and u.get("plan") != f["plan"]:
+        return False
+    if "active" in f and bool(u.get("active")) != f["active"]:
+        return False
+    if "linked" in f and bool(u.get("chat_id")) != f["linked"]:
+        return False
+    if "expires_before" in f or "expires_after" in f:
+        exp = int(u.get("expires_at") or 0)
+        if "expires_before" in f and not exp < f["expires_before"]:
+            return False
+        if "expires_after" in f and not exp > f["expires_after"]:
+            return False
+    return True
+
+
+def encode_cursor(email: str) -> str:
+    return base64.urlsafe_b64encode(email.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> str:
+    pad = "=" * (-len(cursor) % 4)
+    return base64.urlsafe_b64decode(cursor + pad).decode("utf-8")
+
+
+def page(store, f: Dict[str, Any], cursor: Optional[str], limit: int) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    after = decode_cursor(cursor) if cursor else None
+    limit = max(1, min(limit, MAX_LIMIT))
+    cols = store.columns
+    if cols is not None:
+        rows = cols.matching_rows(f, after)
+        emails = cols.emails_at(rows[:limit])
+        out = [store.get(e) for e in emails]
+        return out, encode_cursor(emails[-1]) if len(rows) > limit else None
+    out: List[Dict[str, Any]] = []
+    last = None
+    for email, u in store.iter_from(after):
+        if matches(u, f):
+            out.append(u)
+            last = email
+            if len(out) >= limit:
+                break
+    else:
+        return out, None
+    return out, encode_cursor(last)
+
+
+def iter_matching(store, f: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    # over a copy of the key list, so it is safe to await between items
+    users = store.all()
+    cols = store.columns
+    emails = cols.emails_at(cols.matching_rows(f)) if cols is not None else list(store.emails_sorted)
+    for email in emails:
+        u = users.get(email)
+        if u is not None and (cols is not None or matches(u, f)):
+            yield u
+
+
+def count(store, f: Dict[str, Any]) -> Dict[str, Any]:
+    # {"total": n, "by_plan": {plan: n}} for the users matching f
+    cols = store.columns
+    if cols is not None:
+        by_plan = cols.count_by_plan(f)
+    else:
+        by_plan = {}
+        for u in store.all().values():
+            if matches(u, f):
+                plan = str(u.get("plan") or "none")
+                by_plan[plan] = by_plan.get(plan, 0) + 1
+    return {"total": sum(by_plan.values()), "by_plan": by_plan}
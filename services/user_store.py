@@ -0,0 +1,340 @@
+# services/user_store.py
+import os
+import bisect
+import asyncio
+from typing import Callable, Dict, Any, Optional, List
+
+from services import metrics
+from services.columns import UserColumns
+from services.storage import Entry
+
+# users structure: { email: { email, plan, paystack_reference, paid_references, expires_at, active, chat_id } }
+#
+# The store is loaded once and kept in memory. Every write updates the record
+# and its indexes in place and queues an entry; entries are handed to the
+# storage backend in batches, and backends that keep a journal get compacted
+# in the background.
+#
+# shared=True is for several processes over one backend: writes go through to
+# the backend at once under its cross-process lock, other processes' writes are
+# pulled every SYNC_INTERVAL (and at the start of every transaction), and
+# compaction is left to whoever runs compact_loop() (the leader).
+# Read-modify-write sequences belong in `with store.transaction():` so they see
+# the latest state and no other process writes in between. In either mode the
+# writes of one transaction reach the backend together, in one batch.
+
+FLUSH_INTERVAL = float(os.getenv("USER_STORE_FLUSH_INTERVAL", "1.0"))   # seconds
+FLUSH_BATCH = int(os.getenv("USER_STORE_FLUSH_BATCH", "500"))
+SYNC_INTERVAL = float(os.getenv("USER_STORE_SYNC_INTERVAL", "0.25"))    # seconds, shared mode
+USER_COLUMNS = os.getenv("USER_STORE_COLUMNS", "1") == "1"               # NumPy mirror, see services/columns.py
+
+
+class UserStore:
+    def __init__(self, backend, shared: bool = False):
+        self.backend = backend
+        self.shared = shared
+        # called with each user put by a sync, or None after a full reload
+        self.listeners: List[Callable[[Optional[Dict[str, Any]]], None]] = []
+        # aggregates kept in step with every change (services/stats.py):
+        # reset(users) after a load, changed(before, after) on each put / update / delete / sync
+        self.observers: List[Any] = []
+        self.users: Dict[str, Dict[str, Any]] = {}
+        self.by_reference: Dict[str, str] = {}
+        self.by_chat: Dict[int, str] = {}
+        self.emails_sorted: List[str] = []   # for cursor pagination
+        self.columns: Optional[UserColumns] = UserColumns(lambda: self.emails_sorted) if USER_COLUMNS else None
+        self.version = 0
+        self.loaded = False
+        self._pending: List[Entry] = []
+        self._compacting: Optional[asyncio.Task] = None
+        self._cursor: Any = None
+        self._tx = None
+        self._tx_depth = 0
+        self._closed = False
+
+    # --------------------
+    # Loading
+    # --------------------
+    def load(self):
+        with metrics.STORE_LOAD_SECONDS.time():
+            if self.shared:
+                # taken first: anything written during the load is replayed, which is idempotent
+                self._cursor = self.backend.change_cursor()
+            self.users = self.backend.load_users()
+            self._reindex()
+            if self.columns is not None:
+                self.columns.reset(self.users)
+            for o in self.observers:
+                o.reset(self.users)
+        self.version += 1
+        self.loaded = True
+
+    def _reindex(self):
+        self.emails_sorted = sorted(self.users)
+        self.by_reference = {}
+        self.by_chat = {}
+        for email, u in self.users.items():
+            self._index(email, u)
+
+    def _index(self, email: str, u: Dict[str, Any]):
+        # earlier payments' references too, so a redelivered old charge is still found
+        for ref in u.get("paid_references") or ():
+            self.by_reference[ref] = email
+        ref = u.get("paystack_reference")
+        if ref:
+            self.by_reference[ref] = email
+        chat_id = u.get("chat_id")
+        if chat_id:
+            self.by_chat[int(chat_id)] = email
+
+    def _unindex(self, email: str, u: Dict[str, Any]):
+        for ref in (u.get("paid_references") or []) + [u.get("paystack_reference")]:
+            if ref and self.by_reference.get(ref) == email:
+                del self.by_reference[ref]
+        chat_id = u.get("chat_id")
+        if chat_id and self.by_chat.get(int(chat_id)) == email:
+            del self.by_chat[int(chat_id)]
+
+    # --------------------
+    # Reads (O(1))
+    # --------------------
+    def get(self, email: str) -> Optional[Dict[str, Any]]:
+        return self.users.get(email)
+
+    def find_by_reference(self, reference: str) -> Optional[Dict[str, Any]]:
+        email = self.by_reference.get(reference)
+        return self.users.get(email) if email else None
+
+    def find_by_chat(self, chat_id: int) -> Optional[Dict[str, Any]]:
+        email = self.by_chat.get(int(chat_id))
+        return self.users.get(email) if email else None
+
+    def all(self) -> Dict[str, Dict[str, Any]]:
+        # live view; mutate records through put()/update() so indexes and journal stay in sync
+        return self.users
+
+    def iter_from(self, after: Optional[str] = None):
+        # users in email order, starting just after `after`
+        i = bisect.bisect_right(self.emails_sorted, after) if after else 0
+        emails = self.emails_sorted
+        while i < len(emails):
+            email = emails[i]
+            i += 1
+            u = self.users.get(email)
+            if u is not None:
+                yield email, u
+
+    def __len__(self):
+        return len(self.users)
+
+    # --------------------
+    # Writes
+    # --------------------
+    def put(self, email: str, user: Dict[str, Any]) -> Dict[str, Any]:
+        prev = self.users.get(email)
+        if prev is not None:
+            self._unindex(email, prev)
+        else:
+            bisect.insort(self.emails_sorted, email)
+        self.users[email] = user
+        self._index(email, user)
+        if self.columns is not None:
+            self.columns.put(email, user)
+        self._observe(prev, user)
+        self._log("put", email, user)
+        return user
+
+    def update(self, email: str, **fields) -> Optional[Dict[str, Any]]:
+        u = self.users.get(email)
+        if u is None:
+            return None
+        prev = dict(u) if self.observers else None
+        self._unindex(email, u)
+        u.update(fields)
+        self._index(email, u)
+        if self.columns is not None:
+            self.columns.put(email, u)
+        self._observe(prev, u)
+        self._log("put", email, u)
+        return u
+
+    def update_for_expiry(self, email: str, expires_at: int, **fields) -> Optional[Dict[str, Any]]:
+        # update() only while the record still has this expires_at; None if it was renewed (or
+        # deleted) since. In shared mode the transaction catches up with other workers first,
+        # so a renewal this copy hasn't seen yet isn't overwritten
+        with self.transaction():
+            u = self.users.get(email)
+            if u is None or int(u.get("expires_at") or 0) != int(expires_at):
+                return None
+            return self.update(email, **fields)
+
+    def delete(self, email: str):
+        u = self.users.pop(email, None)
+        if u is None:
+            return
+        self._unindex(email, u)
+        i = bisect.bisect_left(self.emails_sorted, email)
+        if i < len(self.emails_sorted) and self.emails_sorted[i] == email:
+            del self.emails_sorted[i]
+        if self.columns is not None:
+            self.columns.delete(email)
+        self._observe(u, None)
+        self._log("del", email, None)
+
+    def _log(self, op: str, email: str, user: Optional[Dict[str, Any]]):
+        self.version += 1
+        # copy now so later in-place edits can't leak into an earlier entry
+        self._pending.append((op, email, dict(user) if user is not None else None))
+        if self.shared:
+            if self._tx_depth == 0:
+                self.flush()
+        elif len(self._pending) >= FLUSH_BATCH and self._tx_depth == 0:
+            self.flush()
+
+    # --------------------
+    # Cross-process (shared mode)
+    # --------------------
+    def transaction(self):
+        return _StoreTransaction(self)
+
+    def sync(self):
+        # apply writes made by other processes since the last sync
+        if not self.shared or self._cursor is None:
+            return
+        entries, self._cursor = self.backend.changes_since(self._cursor)
+        if entries is None:
+            self.load()
+            self._notify(None)
+            return
+        for op, email, user in entries:
+            prev = self.users.get(email)
+            if prev is not None:
+                self._unindex(email, prev)
+            if op == "put":
+                if prev is None:
+                    bisect.insort(self.emails_sorted, email)
+                self.users[email] = user
+                self._index(email, user)
+                if self.columns is not None:
+                    self.columns.put(email, user)
+                self._observe(prev, user)
+                self._notify(user)
+            elif prev is not None:
+                del self.users[email]
+                i = bisect.bisect_left(self.emails_sorted, email)
+                if i < len(self.emails_sorted) and self.emails_sorted[i] == email:
+                    del self.emails_sorted[i]
+                if self.columns is not None:
+                    self.columns.delete(email)
+                self._observe(prev, None)
+            self.version += 1
+
+    def _observe(self, before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]):
+        for o in self.observers:
+            try:
+                o.changed(before, after)
+            except Exception as e:
+                print("User store observer failed:", e)
+
+    def _notify(self, user: Optional[Dict[str, Any]]):
+        for cb in self.listeners:
+            try:
+                cb(user)
+            except Exception as e:
+                print("User store listener failed:", e)
+
+    # --------------------
+    # Persistence
+    # --------------------
+    def flush(self):
+        if not self._pending:
+            return
+        entries, self._pending = self._pending, []
+        with metrics.STORE_FLUSH_SECONDS.time():
+            self.backend.write_users(entries)
+
+    async def compact(self):
+        # copy on the loop, serialize and write on a thread
+        self.flush()
+        with metrics.STORE_COMPACT_SECONDS.time():
+            if self.shared:
+                with self.transaction():
+                    snapshot = self.backend.begin_compaction(self.users)
+                    # we were in sync when the journal rotated, so start from the new one
+                    self._cursor = self.backend.change_cursor()
+            else:
+                snapshot = self.backend.begin_compaction(self.users)
+            if snapshot is not None:
+                await asyncio.to_thread(self.backend.finish_compaction, snapshot)
+
+    async def run(self):
+        # background flusher / compactor; in shared mode it pulls other processes' writes instead
+        while not self._closed:
+            await asyncio.sleep(SYNC_INTERVAL if self.shared else FLUSH_INTERVAL)
+            try:
+                self.flush()
+                if self.shared:
+                    self.sync()
+                elif self.backend.needs_compaction() and (self._compacting is None or self._compacting.done()):
+                    self._compacting = asyncio.create_task(self.compact())
+            except Exception as e:
+                print("User store flush failed:", e)
+
+    async def compact_loop(self):
+        # shared mode: run by exactly one process (the leader)
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                if self.backend.needs_compaction():
+                    await self.compact()
+            except Exception as e:
+                print("User store compaction failed:", e)
+
+    async def close(self):
+        self._closed = True
+        if self._compacting is not None and not self._compacting.done():
+            await self._compacting
+        self.flush()
+
+
+class _StoreTransaction:
+    # shared mode: hold the backend lock, catch up with other processes first and
+    # write everything logged inside before letting go; nests
+    def __init__(self, store: UserStore):
+        self.store = store
+
+    def __enter__(self):
+        st = self.store
+        if not st.shared:
+            # batch only: nothing else writes this backend
+            st._tx_depth += 1
+            return st
+        if st._tx_depth == 0:
+            st._tx = st.backend.transaction()
+            st._tx.__enter__()
+            try:
+                st.sync()
+            except Exception:
+                st._tx.__exit__(None, None, None)
+                st._tx = None
+                raise
+        st._tx_depth += 1
+        return st
+
+    def __exit__(self, exc_type, exc, tb):
+        st = self.store
+        if not st.shared:
+            st._tx_depth -= 1
+            if st._tx_depth == 0 and len(st._pending) >= FLUSH_BATCH:
+                st.flush()
+            return False
+        st._tx_depth -= 1
+        if st._tx_depth == 0:
+            tx, st._tx = st._tx, None
+            try:
+                st.flush()
+            except BaseException as e:
+                tx.__exit__(type(e), e, e.__traceback__)
+                raise
+            tx.__exit__(exc_type, exc, tb)
+        return False